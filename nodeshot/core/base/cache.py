@@ -1,6 +1,8 @@
 """
 utilities for caching
 """
+import uuid
+
 from django.core.cache import cache
 
 
@@ -13,6 +15,29 @@ def cache_delete_pattern_or_all(pattern):
         cache.clear()
 
 
+def _generation_key(name):
+    return 'Generation:%s' % name
+
+
+def get_generation(name):
+    """
+    returns the current generation of a group of cached items, which must be part of their keys:
+    bump_generation outdates the whole group without deleting keys, on any cache backend
+    """
+    key = _generation_key(name)
+    generation = cache.get(key)
+    if generation is None:
+        # first use or evicted, keys of previous generations can't match a new one
+        cache.add(key, uuid.uuid4().hex, None)
+        generation = cache.get(key)
+    return generation
+
+
+def bump_generation(name):
+    """ outdates all the cached items of a group (see get_generation) """
+    cache.set(_generation_key(name), uuid.uuid4().hex, None)
+
+
 def cache_by_group(view_instance, view_method, request, args, kwargs):
     """
     Cache view response by media type and user group.
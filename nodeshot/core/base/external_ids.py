@@ -0,0 +1,102 @@
+"""
+Registry of hstore keys used as external identifiers
+(eg: the id that an imported object has in the original data source).
+
+An expression index is maintained for each registered key,
+queries can take advantage of it through the "by_external_id" manager method.
+"""
+import re
+
+from django.db import connections
+from django.db.models import get_model
+
+
+__all__ = [
+    'registry',
+    'register',
+    'get_index_name',
+    'ensure_indexes'
+]
+
+
+# "app_label.modelname": set of (hstore field name, key)
+registry = {}
+
+
+def _get_label(model):
+    if isinstance(model, basestring):
+        return model.lower()
+    return '%s.%s' % (model._meta.app_label, model._meta.object_name.lower())
+
+
+def register(model, key, field='data'):
+    """
+    declare that an hstore key is used to store an external identifier
+
+    :param model: model class or "app_label.ModelName" string
+    :param key: hstore key, eg: "cnml_id"
+    :param field: name of the hstore field, defaults to "data"
+    """
+    registry.setdefault(_get_label(model), set()).add((field, key))
+
+
+def get_index_name(table, column, key=None):
+    """
+    returns name of the GIN index of an hstore column
+    or the name of the expression index of one of its keys if key is specified
+    """
+    if key is None:
+        name = '%s_%s_gin' % (table, column)
+    else:
+        name = '%s_%s_%s_idx' % (table, column, re.sub('[^a-z0-9_]', '_', key.lower()))
+    # max length of postgres identifiers
+    return name[0:63]
+
+
+def ensure_indexes(using='default'):
+    """
+    creates the indexes of the registered keys which do not exist yet,
+    a GIN index is created on each hstore column too (used by "contains" lookups)
+
+    :returns: list of names of the created indexes
+    """
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return []
+
+    cursor = connection.cursor()
+    tables = connection.introspection.table_names(cursor)
+    cursor.execute('SELECT indexname FROM pg_indexes')
+    existing = set(row[0] for row in cursor.fetchall())
+    quote = connection.ops.quote_name
+    created = []
+
+    for label, keys in registry.items():
+        model = get_model(*label.split('.'))
+        # app not installed
+        if model is None:
+            continue
+        for field_name, key in sorted(keys):
+            field = model._meta.get_field(field_name)
+            # inherited fields are stored in the table of the parent model
+            table = field.model._meta.db_table
+            if table not in tables:
+                continue
+
+            name = get_index_name(table, field.column)
+            if name not in existing:
+                cursor.execute('CREATE INDEX %s ON %s USING gin (%s)' % (
+                    quote(name), quote(table), quote(field.column)
+                ))
+                existing.add(name)
+                created.append(name)
+
+            name = get_index_name(table, field.column, key)
+            if name not in existing:
+                cursor.execute('CREATE INDEX %s ON %s ((%s -> %%s))' % (
+                    quote(name), quote(table), quote(field.column)
+                ), [key])
+                existing.add(name)
+                created.append(name)
+
+    return created
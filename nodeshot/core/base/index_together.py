@@ -0,0 +1,89 @@
+"""
+Indexes declared with "index_together" by models of apps which do not have migrations
+
+syncdb creates them only along with new tables, the ones which are missing
+in existing databases are created by "ensure_indexes".
+Existing indexes are looked up by columns, whatever their name is.
+"""
+from django.db import connections
+from django.db.models import get_model
+
+
+__all__ = [
+    'registry',
+    'register',
+    'get_index_name',
+    'ensure_indexes'
+]
+
+
+# "app_label.modelname" strings
+registry = []
+
+
+def _get_label(model):
+    if isinstance(model, basestring):
+        return model.lower()
+    return '%s.%s' % (model._meta.app_label, model._meta.object_name.lower())
+
+
+def register(model):
+    """
+    declare that the "index_together" indexes of a model must be created if missing
+
+    :param model: model class or "app_label.ModelName" string
+    """
+    label = _get_label(model)
+    if label not in registry:
+        registry.append(label)
+
+
+def get_index_name(table, columns):
+    """ returns name of the index of the specified columns """
+    name = '%s_%s_idx' % (table, '_'.join(columns))
+    # max length of postgres identifiers
+    return name[0:63]
+
+
+def _index_exists(cursor, table, columns):
+    """ whether table has an index on exactly the specified columns, in the same order """
+    cursor.execute('SELECT attname, attnum FROM pg_attribute WHERE attrelid = %s::regclass AND attnum > 0',
+                   [table])
+    attnums = dict(cursor.fetchall())
+    cursor.execute('SELECT indkey::text FROM pg_index WHERE indrelid = %s::regclass', [table])
+    indkey = ' '.join(str(attnums[column]) for column in columns)
+    return indkey in [row[0] for row in cursor.fetchall()]
+
+
+def ensure_indexes(using='default'):
+    """
+    creates the "index_together" indexes of the registered models which do not exist yet
+
+    :returns: list of names of the created indexes
+    """
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return []
+
+    cursor = connection.cursor()
+    tables = connection.introspection.table_names(cursor)
+    quote = connection.ops.quote_name
+    created = []
+
+    for label in registry:
+        model = get_model(*label.split('.'))
+        # app not installed
+        if model is None or model._meta.db_table not in tables:
+            continue
+        table = model._meta.db_table
+        for field_names in model._meta.index_together:
+            columns = [model._meta.get_field(name).column for name in field_names]
+            if _index_exists(cursor, table, columns):
+                continue
+            name = get_index_name(table, columns)
+            cursor.execute('CREATE INDEX %s ON %s (%s)' % (
+                quote(name), quote(table), ', '.join(quote(column) for column in columns)
+            ))
+            created.append(name)
+
+    return created
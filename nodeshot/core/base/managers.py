@@ -74,6 +74,26 @@ class ACLMixin(BaseUtilityMixin):
         return queryset
 
 
+class ExternalIdMixin(object):
+    """ adds lookup by external identifier stored in an hstore field """
+
+    def by_external_id(self, key, value, field='data'):
+        """
+        returns items which have the specified value in the specified hstore key;
+        the key should be registered in nodeshot.core.base.external_ids
+        in order to be backed by an expression index
+
+        :param key: hstore key, eg: "cnml_id"
+        :param value: external identifier
+        :param field: name of the hstore field, defaults to "data"
+        """
+        field = self.model._meta.get_field(field)
+        # inherited fields are stored in the table of the parent model
+        table = field.model._meta.db_table
+        where = '"%s"."%s" -> %%s = %%s' % (table, field.column)
+        return self.extra(where=[where], params=[key, unicode(value)])
+
+
 class ExtendedManagerMixin(BaseUtilityMixin):
     """ add this mixin to add  support for chainable custom methods to your manager """
     
@@ -117,22 +137,27 @@ class GeoAccessLevelPublishedQuerySet(GeoQuerySet, ACLMixin, PublishedMixin):
     pass
 
 
-class HStoreAccessLevelQuerySet(HStoreQuerySet, ACLMixin):
+class HStoreNodeshotQuerySet(HStoreQuerySet, ExternalIdMixin):
+    """ HStoreQuerySet and ExternalIdMixin """
+    pass
+
+
+class HStoreAccessLevelQuerySet(HStoreQuerySet, ACLMixin, ExternalIdMixin):
     """ HStoreQuerySet, ACLMixin queryset """
     pass
 
 
-class HStoreGeoPublishedQuerySet(HStoreGeoQuerySet, PublishedMixin):
+class HStoreGeoPublishedQuerySet(HStoreGeoQuerySet, PublishedMixin, ExternalIdMixin):
     """ HStoreGeoQuerySet and PublishedMixin """
     pass
 
 
-class HStoreGeoAccessLevelQuerySet(HStoreGeoQuerySet, ACLMixin):
+class HStoreGeoAccessLevelQuerySet(HStoreGeoQuerySet, ACLMixin, ExternalIdMixin):
     """ HStoreGeoQuerySet and AccessLevel """
     pass
 
 
-class HStoreGeoAccessLevelPublishedQuerySet(HStoreGeoQuerySet, ACLMixin, PublishedMixin):
+class HStoreGeoAccessLevelPublishedQuerySet(HStoreGeoQuerySet, ACLMixin, PublishedMixin, ExternalIdMixin):
     """ HStoreGeoQuerySet, AccessLevelQuerySet, PublishedQuerySet with GeoDjango queryset """
     pass
 
@@ -192,12 +217,14 @@ class GeoAccessLevelPublishedManager(GeoManager, ExtendedManagerMixin, ACLMixin,
         return GeoAccessLevelPublishedQuerySet(self.model, using=self._db)
 
 
-class HStoreNodeshotManager(HStoreManager, ExtendedManagerMixin):
+class HStoreNodeshotManager(HStoreManager, ExtendedManagerMixin, ExternalIdMixin):
     """ HStoreManager + ExtendedManagerMixin """
-    pass
+
+    def get_query_set(self):
+        return HStoreNodeshotQuerySet(self.model, using=self._db)
 
 
-class HStoreAccessLevelManager(HStoreManager, ExtendedManagerMixin, ACLMixin):
+class HStoreAccessLevelManager(HStoreManager, ExtendedManagerMixin, ACLMixin, ExternalIdMixin):
     """
     HStoreManager and AccessLeveManager in one
     """
@@ -206,7 +233,7 @@ class HStoreAccessLevelManager(HStoreManager, ExtendedManagerMixin, ACLMixin):
         return HStoreAccessLevelQuerySet(self.model, using=self._db)
 
 
-class HStoreGeoPublishedManager(HStoreGeoManager, ExtendedManagerMixin, PublishedMixin):
+class HStoreGeoPublishedManager(HStoreGeoManager, ExtendedManagerMixin, PublishedMixin, ExternalIdMixin):
     """
     HStoreGeoManager and PublishedMixin in one
     """
@@ -215,7 +242,7 @@ class HStoreGeoPublishedManager(HStoreGeoManager, ExtendedManagerMixin, Publishe
         return HStoreGeoPublishedQuerySet(self.model, using=self._db)
 
 
-class HStoreGeoAccessLevelManager(HStoreGeoManager, ExtendedManagerMixin, ACLMixin):
+class HStoreGeoAccessLevelManager(HStoreGeoManager, ExtendedManagerMixin, ACLMixin, ExternalIdMixin):
     """
     HStoreGeoManager and AccessLeveManager in one
     """
@@ -224,7 +251,7 @@ class HStoreGeoAccessLevelManager(HStoreGeoManager, ExtendedManagerMixin, ACLMix
         return HStoreGeoAccessLevelQuerySet(self.model, using=self._db)
 
 
-class HStoreGeoAccessLevelPublishedManager(HStoreGeoManager, ExtendedManagerMixin, ACLMixin, PublishedMixin):
+class HStoreGeoAccessLevelPublishedManager(HStoreGeoManager, ExtendedManagerMixin, ACLMixin, PublishedMixin, ExternalIdMixin):
     """
     HStoreManager, GeoManager, AccessLeveManager and Publishedmanager in one
     """
@@ -1,9 +1,17 @@
 """
 reusable restframework mixins for API views
 """
+import json
+import base64
+from collections import OrderedDict
 
 import reversion
+from django.db import connections
+from django.utils.dateparse import parse_datetime
+from django.utils.translation import ugettext_lazy as _
 from rest_framework.response import Response
+from rest_framework.exceptions import ParseError
+from rest_framework.templatetags.rest_framework import replace_query_param
 
 
 class ACLMixin(object):
@@ -99,3 +107,95 @@ class RevisionCreate(object):
             reversion.set_user(request.user)
             reversion.set_comment('created through the RESTful API from ip %s' % request.META['REMOTE_ADDR'])
             return self.create(request, *args, **kwargs)
+
+
+class CursorPaginationMixin(object):
+    """
+    Opt-in keyset pagination for list views, activated by the "cursor" parameter
+    (empty for the first page), the response contains the URL of the next page.
+
+    Pages are retrieved with a "WHERE (updated, id) > (last values)" condition instead of OFFSET
+    and the total count is not calculated, so the cost of each page does not depend on its position;
+    "count=approximate" adds the number of items estimated by the query planner.
+
+    Items are ordered by (updated, id) or by id if "order=id" is specified.
+    """
+    cursor_orderings = {
+        'updated': ('updated', 'id'),
+        'id': ('id',)
+    }
+    # page size used when the view does not paginate by default
+    cursor_paginate_by = 100
+
+    def encode_cursor(self, order, item):
+        values = [order] + [getattr(item, field) for field in self.cursor_orderings[order]]
+        values = [value.isoformat() if hasattr(value, 'isoformat') else value for value in values]
+        return base64.urlsafe_b64encode(json.dumps(values))
+
+    def decode_cursor(self, cursor):
+        """ :returns: tuple of order and list of values of the last item of the previous page """
+        try:
+            values = json.loads(base64.urlsafe_b64decode(str(cursor)))
+            order, values = values[0], values[1:]
+            fields = self.cursor_orderings[order]
+            if len(values) != len(fields):
+                raise ValueError()
+            for i, field in enumerate(fields):
+                if field != 'id':
+                    values[i] = parse_datetime(values[i])
+                    if values[i] is None:
+                        raise ValueError()
+        except (TypeError, ValueError, KeyError, IndexError):
+            raise ParseError(_('cursor: invalid value'))
+        return order, values
+
+    def get_approximate_count(self, queryset):
+        """ returns the number of rows estimated by the PostgreSQL query planner, without counting them """
+        sql, params = queryset.order_by().values('pk').query.sql_with_params()
+        cursor = connections[queryset.db].cursor()
+        cursor.execute('EXPLAIN (FORMAT JSON) %s' % sql, params)
+        plan = cursor.fetchone()[0]
+        # depending on the version, psycopg2 might not decode json
+        if isinstance(plan, basestring):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+    def list(self, request, *args, **kwargs):
+        cursor = request.QUERY_PARAMS.get('cursor')
+        if cursor is None:
+            return super(CursorPaginationMixin, self).list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        if cursor:
+            order, values = self.decode_cursor(cursor)
+        else:
+            order, values = request.QUERY_PARAMS.get('order', 'updated'), None
+            if order not in self.cursor_orderings:
+                raise ParseError(_('order: expected one of %s') % ', '.join(sorted(self.cursor_orderings)))
+        fields = self.cursor_orderings[order]
+        data = OrderedDict()
+        if request.QUERY_PARAMS.get('count') == 'approximate':
+            data['count'] = self.get_approximate_count(queryset)
+        if values:
+            # row value comparison, uses the index on the ordering fields
+            quote = connections[queryset.db].ops.quote_name
+            columns = ['%s.%s' % (quote(queryset.model._meta.db_table),
+                                  quote(queryset.model._meta.get_field(field).column)) for field in fields]
+            queryset = queryset.extra(where=['(%s) > (%s)' % (', '.join(columns), ', '.join(['%s'] * len(values)))],
+                                      params=values)
+        page_size = self.get_paginate_by() or self.cursor_paginate_by
+        # one more item tells whether there is a next page
+        page = list(queryset.order_by(*fields)[0:page_size + 1])
+        if len(page) > page_size:
+            page = page[0:page_size]
+            url = request.build_absolute_uri()
+            data['next'] = replace_query_param(url, 'cursor', self.encode_cursor(order, page[-1]))
+        else:
+            data['next'] = None
+        serialized = self.get_serializer(page, many=True).data
+        # GeoJSON serializers return a FeatureCollection
+        if isinstance(serialized, dict):
+            data['type'] = 'FeatureCollection'
+            data['features'] = serialized['features']
+        else:
+            data['results'] = serialized
+        return Response(data)
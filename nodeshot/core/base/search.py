@@ -0,0 +1,162 @@
+"""
+Search of text fields and hstore keys backed by trigram indexes (pg_trgm)
+
+Matching is case insensitive and looks for the search terms anywhere in the text,
+like the "icontains" lookup: PostgreSQL can execute these queries with the GIN trigram indexes
+which are maintained for the registered fields (terms shorter than 3 characters can't use them).
+Results are ordered by similarity to the search terms.
+
+The same indexes are used by the "icontains" lookups of the admin autocomplete.
+
+Creating the pg_trgm extension requires a superuser, if the database user is not allowed
+to create it the indexes are skipped and a warning explains how to create it manually.
+"""
+import logging
+
+from django.db import connections, transaction, DatabaseError
+from django.db.models import get_model
+
+
+__all__ = [
+    'registry',
+    'register',
+    'search',
+    'get_index_name',
+    'ensure_indexes'
+]
+
+
+# "app_label.modelname": list of (field name, hstore key or None)
+registry = {}
+
+logger = logging.getLogger(__name__)
+
+
+def _get_label(model):
+    if isinstance(model, basestring):
+        return model.lower()
+    return '%s.%s' % (model._meta.app_label, model._meta.object_name.lower())
+
+
+def register(model, fields, keys=(), hstore_field='data'):
+    """
+    declare the fields of a model which are searched
+
+    :param model: model class or "app_label.ModelName" string
+    :param fields: list of names of text fields
+    :param keys: list of hstore keys
+    :param hstore_field: name of the hstore field which contains the keys, defaults to "data"
+    """
+    searched = registry.setdefault(_get_label(model), [])
+    for item in [(field, None) for field in fields] + [(hstore_field, key) for key in keys]:
+        if item not in searched:
+            searched.append(item)
+
+
+def _get_expression(model, field_name, key, quote, qualified=True):
+    """ returns the indexed SQL expression of a field or of an hstore key (which is passed as a param) """
+    field = model._meta.get_field(field_name)
+    column = quote(field.column)
+    if qualified:
+        # inherited fields are stored in the table of the parent model
+        column = '%s.%s' % (quote(field.model._meta.db_table), column)
+    if key is None:
+        # same expression used by the "icontains" lookup
+        return 'UPPER(%s::text)' % column
+    return 'UPPER(%s -> %%s)' % column
+
+
+def search(queryset, text):
+    """
+    filters the queryset by the registered fields which contain text (case insensitive),
+    the most similar results come first
+    """
+    searched = registry[_get_label(queryset.model)]
+    connection = connections[queryset.db]
+    quote = connection.ops.quote_name
+    pattern = '%%%s%%' % connection.ops.prep_for_like_query(text)
+    where = []
+    where_params = []
+    similarities = []
+    similarity_params = []
+    for field_name, key in searched:
+        expression = _get_expression(queryset.model, field_name, key, quote)
+        key_params = [] if key is None else [key]
+        where.append('%s LIKE UPPER(%%s)' % expression)
+        where_params += key_params + [pattern]
+        similarities.append('similarity(%s, UPPER(%%s))' % expression)
+        similarity_params += key_params + [text]
+    # GREATEST ignores NULL values
+    rank = 'GREATEST(%s)' % ', '.join(similarities)
+    return queryset.extra(select={'search_rank': rank},
+                          select_params=similarity_params,
+                          where=['(%s)' % ' OR '.join(where)],
+                          params=where_params,
+                          order_by=['-search_rank'])
+
+
+def get_index_name(table, column, key=None):
+    """ returns name of the trigram index of a column or of one of its hstore keys if key is specified """
+    if key is None:
+        name = '%s_%s_trgm' % (table, column)
+    else:
+        name = '%s_%s_%s_trgm' % (table, column, ''.join(c if c.isalnum() else '_' for c in key.lower()))
+    # max length of postgres identifiers
+    return name[0:63]
+
+
+def _ensure_extension(connection):
+    """ creates the pg_trgm extension if missing, returns False if it can't be created """
+    cursor = connection.cursor()
+    cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+    if cursor.fetchone():
+        return True
+    try:
+        # savepoint, a failed statement would abort the transaction of the migration
+        with transaction.atomic(using=connection.alias):
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    except DatabaseError as e:
+        logger.warning('trigram indexes not created, the pg_trgm extension could not be created: %s\n'
+                       'create it as a superuser with "CREATE EXTENSION pg_trgm;" on database "%s" '
+                       'and then run "python manage.py migrate" again', e, connection.settings_dict['NAME'])
+        return False
+    return True
+
+
+def ensure_indexes(using='default'):
+    """
+    creates the pg_trgm extension and the trigram indexes of the registered fields which do not exist yet,
+    nothing is created if the extension is missing and the database user is not allowed to create it
+
+    :returns: list of names of the created indexes
+    """
+    connection = connections[using]
+    if connection.vendor != 'postgresql' or not _ensure_extension(connection):
+        return []
+
+    cursor = connection.cursor()
+    tables = connection.introspection.table_names(cursor)
+    cursor.execute('SELECT indexname FROM pg_indexes')
+    existing = set(row[0] for row in cursor.fetchall())
+    quote = connection.ops.quote_name
+    created = []
+
+    for label, searched in registry.items():
+        model = get_model(*label.split('.'))
+        # app not installed
+        if model is None:
+            continue
+        for field_name, key in searched:
+            field = model._meta.get_field(field_name)
+            table = field.model._meta.db_table
+            name = get_index_name(table, field.column, key)
+            if table not in tables or name in existing:
+                continue
+            expression = _get_expression(model, field_name, key, quote, qualified=False)
+            cursor.execute('CREATE INDEX %s ON %s USING gin ((%s) gin_trgm_ops)' % (
+                quote(name), quote(table), expression
+            ), [] if key is None else [key])
+            existing.add(name)
+            created.append(name)
+
+    return created
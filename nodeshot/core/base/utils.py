@@ -4,7 +4,9 @@ from datetime import datetime, timedelta
 from django.utils.translation import ugettext_lazy as _
 from django.utils.translation import ugettext
 from django.utils.timezone import utc
+from django.template.defaultfilters import slugify
 from django.conf import settings
+from django.contrib.gis.geos import Polygon
 
 from .settings import DISCONNECTABLE_SIGNALS
 from .exceptions import DependencyError
@@ -19,6 +21,8 @@ __all__ = [
     'now',
     'now_after',
     'after',
+    'SlugAllocator',
+    'parse_bbox',
 ]
 
 
@@ -84,6 +88,51 @@ def get_key_by_value(dictionary, search_value):
             return ugettext(key)
 
 
+class SlugAllocator(object):
+    """
+    Hands out unique slugs by keeping the slugs already taken in a set.
+
+    When the slug of a name is taken, a number is appended to the name
+    (eg: "name - 2", "name - 3") until a free slug is found; the last number
+    tried for each name is remembered, so allocating the same name
+    many times costs amortised O(1) per allocation.
+
+    :param taken: iterable of slugs which are already taken
+    :param name_format: format used to number conflicting names
+    :param slugify: function used to convert names into slugs
+    """
+    def __init__(self, taken=None, name_format='%s - %d', slugify=slugify):
+        self.taken = set(taken or [])
+        self.name_format = name_format
+        self.slugify = slugify
+        self._last_number = {}
+
+    def __contains__(self, slug):
+        return slug in self.taken
+
+    def add(self, slug):
+        """ mark slug as taken """
+        self.taken.add(slug)
+
+    def allocate(self, name):
+        """
+        returns a (name, slug) tuple with a slug which was not taken
+        and marks the slug as taken
+        """
+        slug = self.slugify(name)
+
+        if slug in self.taken:
+            number = self._last_number.get(name, 1)
+            while slug in self.taken:
+                number += 1
+                slug = self.slugify(self.name_format % (name, number))
+            self._last_number[name] = number
+            name = self.name_format % (name, number)
+
+        self.taken.add(slug)
+        return name, slug
+
+
 def pause_disconnectable_signals():
     """
     Disconnects non critical signals like notifications, websockets and stuff like that.
@@ -123,3 +172,17 @@ def after(date, **kwargs):
     :paramm datetime: datetime object to which add more time
     """
     return date + timedelta(**kwargs)
+
+
+def parse_bbox(value):
+    """
+    converts a "<min lng>,<min lat>,<max lng>,<max lat>" string to a polygon (SRID 4326)
+
+    :raises: ValueError if the string is not valid
+    """
+    coords = [float(coord) for coord in value.split(',')]
+    if len(coords) != 4:
+        raise ValueError('expected 4 coordinates, got %d' % len(coords))
+    polygon = Polygon.from_bbox(coords)
+    polygon.srid = 4326
+    return polygon
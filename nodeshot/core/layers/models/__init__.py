@@ -20,3 +20,29 @@ ExtensibleNodeSerializer.add_relationship(**{
     'view_name': 'api_layer_detail',
     'lookup_field': 'layer.slug'
 })
+
+
+# ------ Signals ------ #
+
+from django.dispatch import receiver
+from django.db.models.signals import post_save, post_delete
+from nodeshot.core.nodes.models import Node, Status
+from nodeshot.core.nodes import snapshots
+from ..tiles import clear_tile_cache
+
+
+@receiver(post_save, sender=Layer, dispatch_uid='clear_tile_cache_on_layer_save')
+@receiver(post_delete, sender=Layer, dispatch_uid='clear_tile_cache_on_layer_delete')
+@receiver(post_save, sender=Node, dispatch_uid='clear_tile_cache_on_node_save')
+@receiver(post_delete, sender=Node, dispatch_uid='clear_tile_cache_on_node_delete')
+@receiver(post_save, sender=Status, dispatch_uid='clear_tile_cache_on_status_save')
+@receiver(post_delete, sender=Status, dispatch_uid='clear_tile_cache_on_status_delete')
+def clear_tile_cache_on_change(sender, **kwargs):
+    clear_tile_cache()
+
+
+@receiver(post_save, sender=Layer, dispatch_uid='outdate_node_snapshots_on_layer_save')
+@receiver(post_delete, sender=Layer, dispatch_uid='outdate_node_snapshots_on_layer_delete')
+def outdate_node_snapshots(sender, **kwargs):
+    # nodes are published or unpublished along with their layer with a bulk query
+    snapshots.outdate(snapshots.get_key(), snapshots.get_key(kwargs['instance'].id))
@@ -5,6 +5,7 @@ HSTORE_SCHEMA = getattr(settings, 'NODESHOT_LAYERS_HSTORE_SCHEMA', None)
 NODES_MINIMUM_DISTANCE = getattr(settings, 'NODESHOT_LAYERS_NODES_MINIMUM_DISTANCE', 0)
 REVERSION_ENABLED = getattr(settings, 'NODESHOT_LAYERS_REVERSION_ENABLED', True)
 TEXT_HTML = getattr(settings, 'NODESHOT_LAYERS_TEXT_HTML', True)
+TILES_CACHE_TIMEOUT = getattr(settings, 'NODESHOT_LAYERS_TILES_CACHE_TIMEOUT', 86400)
 
 
 if HSTORE_SCHEMA:
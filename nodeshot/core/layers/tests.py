@@ -338,6 +338,13 @@ class LayerTest(TestCase):
         response = self.client.get(url)
         self.assertEqual(200, response.status_code)
 
+    def test_layer_nodes_geojson_clusters(self):
+        url = reverse('api_layer_nodes_geojson', args=['rome'])
+        count = Node.objects.filter(layer__slug='rome').published().access_level_up_to('public').count()
+        response = self.client.get(url, {'zoom': 0})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sum(feature['properties']['count'] for feature in response.data['features']), count)
+
     def test_layer_nodes_geojson_pagination(self):
         url = reverse('api_layer_nodes_geojson', args=['rome'])
         # ensure all results returned by default
@@ -349,3 +356,71 @@ class LayerTest(TestCase):
         self.assertIn('type', response.data)
         self.assertIn('features', response.data)
         self.assertEqual(len(response.data['features']), 1)
+
+    def test_vector_tile(self):
+        url = reverse('api_vector_tile', args=[0, 0, 0])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/vnd.mapbox-vector-tile')
+        # names of layers and attribute values are stored as plain strings
+        self.assertIn(b'nodes', response.content)
+        self.assertIn(b'layers', response.content)
+        self.assertIn(b'Fusolab', response.content)
+        self.assertIn(b'rome', response.content)
+        # private nodes are not visible to anonymous users
+        self.assertNotIn(b'Hidden Node Rome', response.content)
+        self.assertNotIn(b'registered node', response.content)
+        # cached by group
+        self.client.login(username='admin', password='tester')
+        response = self.client.get(url)
+        self.assertIn(b'Hidden Node Rome', response.content)
+
+    def test_vector_tile_cache_invalidation(self):
+        url = reverse('api_vector_tile', args=[0, 0, 0])
+        response = self.client.get(url)
+        self.assertIn(b'Fusolab', response.content)
+        node = Node.objects.get(name='Fusolab')
+        node.name = 'Fusolab renamed'
+        node.save()
+        response = self.client.get(url)
+        self.assertIn(b'Fusolab renamed', response.content)
+        node.delete()
+        response = self.client.get(url)
+        self.assertNotIn(b'Fusolab', response.content)
+
+    def test_vector_tile_cache_generation(self):
+        from django.core.cache import get_cache
+        from nodeshot.core.base import cache as base_cache
+        from .tiles import clear_tile_cache
+        # the dummy cache used in development does not store anything
+        original_cache = base_cache.cache
+        base_cache.cache = get_cache('django.core.cache.backends.locmem.LocMemCache')
+        try:
+            base_cache.cache.set('unrelated', 'value')
+            generation = base_cache.get_generation('VectorTile')
+            self.assertEqual(base_cache.get_generation('VectorTile'), generation)
+            clear_tile_cache()
+            self.assertNotEqual(base_cache.get_generation('VectorTile'), generation)
+            # the rest of the cache is not cleared
+            self.assertEqual(base_cache.cache.get('unrelated'), 'value')
+        finally:
+            base_cache.cache = original_cache
+
+    def test_vector_tile_not_found(self):
+        # x and y must be lower than 2 ** zoom
+        response = self.client.get(reverse('api_vector_tile', args=[1, 2, 0]))
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(reverse('api_vector_tile', args=[31, 0, 0]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_vector_tile_postgis_not_supported(self):
+        from . import tiles
+        original_versions = tiles._postgis_versions.copy()
+        # ST_AsMVT is not available before postgis 2.4
+        tiles._postgis_versions['default'] = (2, 3, 0)
+        try:
+            response = self.client.get(reverse('api_vector_tile', args=[0, 0, 0]))
+            self.assertEqual(response.status_code, 501)
+        finally:
+            tiles._postgis_versions.clear()
+            tiles._postgis_versions.update(original_versions)
@@ -0,0 +1,176 @@
+"""
+Mapbox Vector Tiles of nodes, layer areas and of the other registered models
+
+Tiles are encoded by PostGIS (ST_AsMVT, requires PostGIS >= 2.4), one query per layer of the tile.
+Attributes are limited to what is needed to style the features.
+"""
+import re
+from collections import OrderedDict
+
+from django.db import connections
+from django.contrib.gis.geos import Polygon
+
+from nodeshot.core.base.cache import cache_by_group, get_generation, bump_generation
+from nodeshot.core.nodes.models import Node, Status
+
+from .models import Layer
+
+
+__all__ = [
+    'registry',
+    'register',
+    'column_sql',
+    'slug_sql',
+    'get_bounds',
+    'get_postgis_version',
+    'tiles_supported',
+    'get_tile',
+    'tile_cache_key',
+    'clear_tile_cache'
+]
+
+
+# size of the tiles in tile units and width of the border in which features are not clipped
+EXTENT = 4096
+BUFFER = 64
+# half of the circumference of the earth in web mercator (EPSG:3857) units
+ORIGIN_SHIFT = 20037508.342789244
+
+# ST_AsMVT and ST_AsMVTGeom
+MIN_POSTGIS_VERSION = (2, 4)
+
+# layer name: (function which returns the queryset of a user, geometry field name, attributes)
+registry = OrderedDict()
+
+# database alias: version of the PostGIS library
+_postgis_versions = {}
+
+
+def column_sql(model, field_name):
+    """ returns the quoted column of a field, prefixed with the quoted table name """
+    quote = connections['default'].ops.quote_name
+    return '%s.%s' % (quote(model._meta.db_table), quote(model._meta.get_field(field_name).column))
+
+
+def slug_sql(model, field_name, related_model):
+    """ returns SQL which selects the slug of the object referenced by a foreign key """
+    quote = connections['default'].ops.quote_name
+    return '(SELECT %s FROM %s WHERE %s = %s)' % (
+        column_sql(related_model, 'slug'),
+        quote(related_model._meta.db_table),
+        column_sql(related_model, related_model._meta.pk.name),
+        column_sql(model, field_name)
+    )
+
+
+def register(name, get_queryset, geometry, attributes):
+    """
+    adds a layer to the vector tiles
+
+    :param name: name of the layer in the tiles
+    :param get_queryset: callable which receives a user and returns the objects accessible to that user
+    :param geometry: name of the geometry field
+    :param attributes: list of (attribute name, SQL expression, SQL params) tuples
+    """
+    registry[name] = (get_queryset, geometry, attributes)
+
+
+def get_bounds(zoom, x, y):
+    """ returns xmin, ymin, xmax, ymax of the specified tile in web mercator units """
+    size = 2 * ORIGIN_SHIFT / 2 ** zoom
+    xmin = -ORIGIN_SHIFT + x * size
+    ymax = ORIGIN_SHIFT - y * size
+    return xmin, ymax - size, xmin + size, ymax
+
+
+def get_postgis_version(using='default'):
+    """
+    returns the version of the PostGIS library as a tuple of integers, eg: (2, 4, 3)
+    queried once (POSTGIS_VERSION setting does not necessarily match the installed library)
+    """
+    if using not in _postgis_versions:
+        cursor = connections[using].cursor()
+        cursor.execute('SELECT PostGIS_Lib_Version()')
+        version = re.findall(r'\d+', cursor.fetchone()[0])
+        _postgis_versions[using] = tuple(int(number) for number in version[0:3])
+    return _postgis_versions[using]
+
+
+def tiles_supported(using='default'):
+    """ whether the installed PostGIS can encode vector tiles """
+    return get_postgis_version(using) >= MIN_POSTGIS_VERSION
+
+
+def get_tile(zoom, x, y, user):
+    """
+    encodes the objects accessible to user which intersect the specified tile,
+    geometries are simplified according to the zoom level
+    :returns: tile as bytes
+    """
+    xmin, ymin, xmax, ymax = get_bounds(zoom, x, y)
+    # size of a tile unit, smaller details would not be visible anyway
+    tolerance = (xmax - xmin) / EXTENT
+    margin = tolerance * BUFFER
+    bbox = Polygon.from_bbox((xmin - margin, ymin - margin, xmax + margin, ymax + margin))
+    bbox.srid = 3857
+    tile = []
+    for name, (get_queryset, geometry, attributes) in registry.items():
+        queryset = get_queryset(user)
+        select = OrderedDict([
+            ('geom', 'ST_AsMVTGeom(ST_Simplify(ST_Transform(%s, 3857), %%s), '
+                     'ST_MakeEnvelope(%%s, %%s, %%s, %%s, 3857), %%s, %%s, true)' % column_sql(queryset.model, geometry))
+        ])
+        select_params = [tolerance, xmin, ymin, xmax, ymax, EXTENT, BUFFER]
+        for attribute, sql, params in attributes:
+            select[attribute] = sql
+            select_params += list(params)
+        # "&&" operator, uses the spatial index
+        queryset = queryset.filter(**{'%s__bboverlaps' % geometry: bbox}) \
+                           .extra(select=select, select_params=select_params) \
+                           .values(*select.keys()).order_by()
+        sql, params = queryset.query.sql_with_params()
+        cursor = connections[queryset.db].cursor()
+        # features which are too small to be drawn are NULL
+        cursor.execute(
+            "SELECT COALESCE(ST_AsMVT(tile, %%s, %%s, 'geom'), '') FROM (%s) AS tile "
+            "WHERE tile.geom IS NOT NULL" % sql,
+            [name, EXTENT] + list(params)
+        )
+        tile.append(bytes(cursor.fetchone()[0]))
+    return b''.join(tile)
+
+
+def tile_cache_key(view_instance, view_method, request, args, kwargs):
+    """ same as cache_by_group, tiles cached before the last call to clear_tile_cache are not used anymore """
+    key = cache_by_group(view_instance, view_method, request, args, kwargs)
+    return '%s.%s' % (key, get_generation('VectorTile'))
+
+
+def clear_tile_cache():
+    """
+    outdates the cached tiles, other cached items are not affected,
+    must be called whenever registered objects are changed with bulk queries, which do not send signals
+    """
+    bump_generation('VectorTile')
+
+
+register(
+    'layers',
+    lambda user: Layer.objects.published().exclude(area__isnull=True),
+    'area',
+    [
+        ('name', column_sql(Layer, 'name'), []),
+        ('slug', column_sql(Layer, 'slug'), []),
+    ]
+)
+
+register(
+    'nodes',
+    lambda user: Node.objects.published().accessible_to(user),
+    'geometry',
+    [
+        ('name', column_sql(Node, 'name'), []),
+        ('status', slug_sql(Node, 'status', Status), []),
+        ('layer', slug_sql(Node, 'layer', Layer), []),
+    ]
+)
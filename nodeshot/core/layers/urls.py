@@ -7,4 +7,5 @@ urlpatterns = patterns('nodeshot.core.layers.views',
     url(r'^layers/(?P<slug>[-\w]+)/nodes/$', 'nodes_list', name='api_layer_nodes_list'),
     url(r'^layers/(?P<slug>[-\w]+)/nodes.geojson$', 'nodes_geojson_list', name='api_layer_nodes_geojson'),
     url(r'^layers.geojson$', 'layers_geojson_list', name='api_layer_geojson'),
+    url(r'^tiles/(?P<zoom>\d+)/(?P<x>\d+)/(?P<y>\d+)\.mvt$', 'vector_tile', name='api_vector_tile'),
 )
@@ -1,15 +1,22 @@
 from django.http import Http404
 from django.utils.translation import ugettext_lazy as _
 
-from rest_framework import generics, permissions, authentication
+from rest_framework import generics, permissions, authentication, renderers, status
+from rest_framework.exceptions import APIException
+from rest_framework.views import APIView
 from rest_framework.response import Response
 
+# cache
+from rest_framework_extensions.cache.decorators import cache_response
+
 from nodeshot.core.base.utils import Hider
-from nodeshot.core.nodes.views import NodeList
+from nodeshot.core.nodes.views import NodeList, NodeMapMixin, SnapshotMixin
+from nodeshot.core.nodes import snapshots
 from nodeshot.core.nodes.serializers import NodeGeoSerializer, PaginatedGeojsonNodeListSerializer
 
-from .settings import REVERSION_ENABLED
+from .settings import REVERSION_ENABLED, TILES_CACHE_TIMEOUT
 from .models import Layer
+from .tiles import get_tile, tiles_supported, tile_cache_key
 from .serializers import *  # noqa
 
 
@@ -107,20 +114,32 @@ class LayerNodesList(NodeList):
 nodes_list = LayerNodesList.as_view()
 
 
-class LayerNodesGeoJSONList(LayerNodesList):
+class LayerNodesGeoJSONList(SnapshotMixin, NodeMapMixin, LayerNodesList):
     """
     Retrieve list of nodes of the specified layer in GeoJSON format.
 
     Parameters:
 
      * `search=<word>`: search <word> in name, slug, description and address of nodes
+     * `bbox=<min lng>,<min lat>,<max lng>,<max lat>`: retrieve nodes within the specified bounding box
+     * `zoom=<n>`: zoom level of the map, nodes are grouped in clusters
+       up to `NODESHOT_NODES_CLUSTERING_MAX_ZOOM` (clusters have a `count` property)
      * `limit=<n>`: specify number of items per page (show all by default)
+
+    Anonymous requests without parameters are served from a snapshot which supports `If-None-Match`.
     """
     pagination_serializer_class = PaginatedGeojsonNodeListSerializer
     paginate_by_param = 'limit'
     paginate_by = 0
     serializer_class = NodeGeoSerializer
 
+    def get_snapshot_key(self):
+        self.get_layer()
+        # nodes of external layers might be retrieved on the fly by synchronizers
+        if self.layer.is_external or not self.layer.is_published:
+            return None
+        return snapshots.get_key(self.layer.id)
+
     def get(self, request, *args, **kwargs):
         """ Retrieve list of nodes of the specified layer in GeoJSON format. """
         # overwritten just to tweak the docstring for auto documentation purposes
@@ -144,3 +163,43 @@ class LayerGeoJSONList(generics.ListAPIView):
     queryset = Layer.objects.published().exclude(area__isnull=True)
 
 layers_geojson_list = LayerGeoJSONList.as_view()
+
+
+class VectorTileRenderer(renderers.BaseRenderer):
+    media_type = 'application/vnd.mapbox-vector-tile'
+    format = 'mvt'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # error details can't be encoded in a tile
+        if not isinstance(data, bytes):
+            return b''
+        return data
+
+
+class TilesNotSupported(APIException):
+    status_code = status.HTTP_501_NOT_IMPLEMENTED
+    default_detail = _('Vector tiles require PostGIS 2.4 or higher')
+
+
+class VectorTile(APIView):
+    """
+    Retrieve nodes, links and layer areas of the specified tile in Mapbox Vector Tile format.
+
+    Geometries are simplified according to the zoom level,
+    the response is cached by user group until nodes, links or layers change.
+    """
+    authentication_classes = (authentication.SessionAuthentication,)
+    renderer_classes = (VectorTileRenderer,)
+
+    @cache_response(TILES_CACHE_TIMEOUT, key_func=tile_cache_key)
+    def get(self, request, *args, **kwargs):
+        if not tiles_supported():
+            raise TilesNotSupported()
+        zoom, x, y = int(kwargs['zoom']), int(kwargs['x']), int(kwargs['y'])
+        if zoom > 30 or x >= 2 ** zoom or y >= 2 ** zoom:
+            raise Http404(_('Tile not found'))
+        return Response(get_tile(zoom, x, y, request.user))
+
+vector_tile = VectorTile.as_view()
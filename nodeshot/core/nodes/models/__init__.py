@@ -10,13 +10,40 @@ __all__ = [
 ]
 
 
+# ------ Search ------ #
+
+from django.db.models.signals import post_syncdb
+from nodeshot.core.base import search
+from ..settings import SEARCH_HSTORE_KEYS
+
+search.register(Node, ['name', 'slug', 'description', 'address'], SEARCH_HSTORE_KEYS)
+
+
+def create_search_indexes(sender, **kwargs):
+    """ creates the indexes of the fields registered by any app """
+    created = search.ensure_indexes(using=kwargs.get('db') or 'default')
+    if kwargs.get('verbosity', 1) > 0:
+        for name in created:
+            print('Created index %s' % name)
+
+
+post_syncdb.connect(create_search_indexes)
+
+try:
+    from south.signals import post_migrate
+    post_migrate.connect(create_search_indexes)
+except ImportError:
+    pass
+
+
 # ------ Signals ------ #
 
 
 from django.dispatch import receiver
-from django.db.models.signals import pre_delete, post_save
+from django.db.models.signals import pre_delete, post_save, post_delete
 from django.core.cache import cache
 from ..signals import node_status_changed
+from .. import snapshots
 
 
 @receiver(post_save, sender=Status)
@@ -31,3 +58,19 @@ def clear_cache(sender, **kwargs):
     # otherwise clear the entire cache
     else:
         cache.clear()
+
+
+@receiver(post_save, sender=Node, dispatch_uid='outdate_node_snapshots_on_save')
+@receiver(post_delete, sender=Node, dispatch_uid='outdate_node_snapshots_on_delete')
+def outdate_node_snapshots(sender, **kwargs):
+    node = kwargs['instance']
+    layer_id = getattr(node, 'layer_id', None)
+    keys = set([snapshots.get_key(), snapshots.get_key(layer_id), snapshots.get_key(node._current_layer_id)])
+    snapshots.outdate(*keys)
+    node._current_layer_id = layer_id
+
+
+@receiver(post_save, sender=Status, dispatch_uid='outdate_all_snapshots_on_status_save')
+@receiver(post_delete, sender=Status, dispatch_uid='outdate_all_snapshots_on_status_delete')
+def outdate_all_snapshots(sender, **kwargs):
+    snapshots.outdate()
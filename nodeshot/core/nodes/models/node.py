@@ -56,6 +56,10 @@ class Node(BaseAccessLevel):
     # explained here:
     # http://stackoverflow.com/questions/1355150/django-when-saving-how-can-you-check-if-a-field-has-changed
     _current_status = None
+    # needed to outdate the snapshot of the previous layer when a node is moved (see ..snapshots)
+    _current_layer_id = None
+    # needed to redraw the links of a node when it is moved (see nodeshot.networking.links)
+    _current_geometry = None
 
     # needed for extensible validation
     _additional_validation = []
@@ -63,6 +67,8 @@ class Node(BaseAccessLevel):
     class Meta:
         db_table = 'nodes_node'
         app_label = 'nodes'
+        # cursor pagination of the API
+        index_together = [['updated', 'id']]
 
     def __unicode__(self):
         return '%s' % self.name
@@ -73,6 +79,9 @@ class Node(BaseAccessLevel):
         # set current status, but only if it is an existing node
         if self.pk:
             self._current_status = self.status_id
+            self._current_layer_id = getattr(self, 'layer_id', None)
+            # raw value, geometries are parsed only when accessed
+            self._current_geometry = self.__dict__.get('geometry')
 
     def _autofill_slug(self):
         slugified_name = slugify(self.name)
@@ -164,6 +173,7 @@ class Node(BaseAccessLevel):
     if 'grappelli' in settings.INSTALLED_APPS:
         @staticmethod
         def autocomplete_search_fields():
+            # backed by the trigram indexes of nodeshot.core.base.search
             return ('name__icontains', 'slug__icontains', 'address__icontains')
 
     # some more properties are added by the layer app
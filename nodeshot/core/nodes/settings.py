@@ -10,5 +10,19 @@ if HSTORE_SCHEMA:
 else:
     ADDITIONAL_NODE_FIELDS = []
 
+# node GeoJSON lists return clusters of nodes instead of nodes up to this zoom level (included)
+CLUSTERING_MAX_ZOOM = getattr(settings, 'NODESHOT_NODES_CLUSTERING_MAX_ZOOM', 12)
+# number of cells of the clustering grid per side of a map tile
+CLUSTERING_GRID_SIZE = getattr(settings, 'NODESHOT_NODES_CLUSTERING_GRID_SIZE', 4)
+
 ELEVATION_API_KEY = getattr(settings, 'NODESHOT_GOOGLE_ELEVATION_API_KEY', None)
 ELEVATION_DEFAULT_SAMPLING = getattr(settings, 'NODESHOT_GOOGLE_ELEVATION_DEFAULT_SAMPLING', 50)
+
+# hstore keys searched along with name, slug, description and address
+SEARCH_HSTORE_KEYS = getattr(settings, 'NODESHOT_NODES_SEARCH_HSTORE_KEYS', [])
+
+# anonymous requests to the GeoJSON lists of nodes are served from pre-rendered snapshots
+SNAPSHOTS_ENABLED = getattr(settings, 'NODESHOT_NODES_SNAPSHOTS_ENABLED', True)
+# snapshots are rendered again only after this number of seconds without changes
+SNAPSHOTS_DELAY = getattr(settings, 'NODESHOT_NODES_SNAPSHOTS_DELAY', 10)
+SNAPSHOTS_TIMEOUT = getattr(settings, 'NODESHOT_NODES_SNAPSHOTS_TIMEOUT', 86400)
@@ -0,0 +1,97 @@
+"""
+Pre-rendered GeoJSON lists of nodes for anonymous users, which make up most of the traffic
+
+Snapshots are gzipped and stored in the cache with a version (used as ETag).
+They are outdated as soon as nodes change and are rendered again by the first request
+which comes after NODESHOT_NODES_SNAPSHOTS_DELAY seconds without changes,
+in the meantime requests are served dynamically.
+"""
+import gzip
+import time
+import hashlib
+from io import BytesIO
+
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags, quote_etag
+from django.utils.text import compress_string
+
+from .settings import SNAPSHOTS_DELAY, SNAPSHOTS_TIMEOUT
+
+
+__all__ = [
+    'get_key',
+    'outdate',
+    'get_snapshot',
+    'save_snapshot',
+    'snapshot_response'
+]
+
+
+# outdates all the snapshots
+ALL = '*'
+
+
+def _content_key(key):
+    return 'NodeSnapshot:%s' % key
+
+
+def _changed_key(key):
+    return 'NodeSnapshotChanged:%s' % key
+
+
+def get_key(layer_id=None):
+    """ returns key of the snapshot of all nodes or of the nodes of the specified layer """
+    return 'all' if layer_id is None else 'layer-%s' % layer_id
+
+
+def outdate(*keys):
+    """ records that the specified snapshots are outdated, all of them if no key is specified """
+    keys = keys or [ALL]
+    changed = time.time()
+    cache.set_many(dict((_changed_key(key), changed) for key in keys), None)
+
+
+def get_snapshot(key):
+    """
+    :returns: tuple of the up to date snapshot (None if there is not one)
+              and a boolean which indicates whether a new snapshot can be rendered
+    """
+    values = cache.get_many([_content_key(key), _changed_key(key), _changed_key(ALL)])
+    snapshot = values.get(_content_key(key))
+    changed = max([values.get(_changed_key(key)) or 0, values.get(_changed_key(ALL)) or 0])
+    if snapshot is not None and snapshot['rendered'] > changed:
+        return snapshot, False
+    return None, time.time() - changed >= SNAPSHOTS_DELAY
+
+
+def save_snapshot(key, content, rendered):
+    """
+    stores the specified content
+    :param rendered: time in which the data has been retrieved, changes which happen later outdate the snapshot
+    :returns: snapshot
+    """
+    snapshot = {
+        'content': compress_string(content),
+        'etag': hashlib.md5(content).hexdigest(),
+        'rendered': rendered
+    }
+    cache.set(_content_key(key), snapshot, SNAPSHOTS_TIMEOUT)
+    return snapshot
+
+
+def snapshot_response(request, snapshot):
+    """ returns a gzipped response if the client accepts it, 304 if the client already has the snapshot """
+    etag = quote_etag(snapshot['etag'])
+    if snapshot['etag'] in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+        response = HttpResponseNotModified()
+    elif 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+        response = HttpResponse(snapshot['content'], content_type='application/json')
+        response['Content-Encoding'] = 'gzip'
+    else:
+        content = gzip.GzipFile(fileobj=BytesIO(snapshot['content'])).read()
+        response = HttpResponse(content, content_type='application/json')
+    response['ETag'] = etag
+    patch_vary_headers(response, ('Accept', 'Accept-Encoding'))
+    return response
@@ -16,6 +16,7 @@ User = get_user_model()
 from nodeshot.core.base.tests import user_fixtures, BaseTestCase
 
 from .models import Node, Status, Image
+from .settings import CLUSTERING_MAX_ZOOM
 
 
 class NodeModelsTest(TestCase):
@@ -259,6 +260,87 @@ class NodesApiTest(BaseTestCase):
         # GET: 200
         response = self.client.get(url, {"search": "Fusolab"})
         self.assertEqual(response.data['count'], 1)
+        # wildcards are escaped
+        response = self.client.get(url, {"search": "%"})
+        self.assertEqual(response.data['count'], 0)
+
+    def test_node_search_ranking(self):
+        from nodeshot.core.base.search import search
+        Node.objects.create(name='Lab', layer_id=1, geometry='POINT (12.5 41.9)')
+        names = [node.name for node in search(Node.objects.all(), 'lab')]
+        # most similar first
+        self.assertEqual(names, ['Lab', 'Fusolab', 'EigenLab'])
+
+    def test_node_search_hstore_keys(self):
+        from nodeshot.core.base import search
+        node = Node.objects.get(slug='tulug')
+        node.data = {'ssid': 'ninux.org'}
+        node.save()
+        self.assertEqual(search.search(Node.objects.all(), 'ninux').count(), 0)
+        searched = list(search.registry['nodes.node'])
+        search.register(Node, [], ['ssid'])
+        try:
+            self.assertEqual(list(search.search(Node.objects.all(), 'NINUX')), [node])
+            self.assertIn('nodes_node_data_ssid_trgm', search.ensure_indexes())
+        finally:
+            search.registry['nodes.node'] = searched
+
+    def test_search_indexes(self):
+        from django.db import connection
+        from nodeshot.core.base.search import ensure_indexes
+        # created on syncdb and migrate
+        self.assertEqual(ensure_indexes(), [])
+        cursor = connection.cursor()
+        cursor.execute("SELECT indexname FROM pg_indexes WHERE tablename = 'nodes_node'")
+        indexes = [row[0] for row in cursor.fetchall()]
+        for column in ['name', 'slug', 'description', 'address']:
+            self.assertIn('nodes_node_%s_trgm' % column, indexes)
+
+    def test_search_indexes_without_extension_permission(self):
+        """ indexes are skipped if the database user can't create pg_trgm """
+        from django.db import connection
+        from nodeshot.core.base.search import ensure_indexes
+        cursor = connection.cursor()
+        # rolled back at the end of the test
+        cursor.execute('DROP EXTENSION pg_trgm CASCADE')
+        cursor.execute('CREATE ROLE nodeshot_test_unprivileged')
+        cursor.execute('SET ROLE nodeshot_test_unprivileged')
+        try:
+            self.assertEqual(ensure_indexes(), [])
+        finally:
+            cursor.execute('RESET ROLE')
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        self.assertIsNone(cursor.fetchone())
+
+    def test_node_list_cursor_pagination(self):
+        url = reverse('api_node_list')
+        expected = list(Node.objects.published().access_level_up_to('public')
+                                    .order_by('updated', 'id').values_list('slug', flat=True))
+        slugs = []
+        response = self.client.get(url, {'cursor': '', 'limit': 3})
+        self.assertNotIn('count', response.data)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data['results']), 3)
+            slugs += [node['slug'] for node in response.data['results']]
+            if not response.data['next']:
+                break
+            response = self.client.get(response.data['next'])
+        self.assertEqual(slugs, expected)
+        # order by id
+        response = self.client.get(url, {'cursor': '', 'order': 'id', 'limit': 2})
+        next_page = self.client.get(response.data['next'])
+        self.assertEqual([node['slug'] for node in next_page.data['results']],
+                         list(Node.objects.published().access_level_up_to('public')
+                                          .order_by('id').values_list('slug', flat=True)[2:4]))
+        # approximate count
+        response = self.client.get(url, {'cursor': '', 'count': 'approximate'})
+        self.assertIsInstance(response.data['count'], int)
+        # invalid parameters
+        response = self.client.get(url, {'cursor': 'wrong'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(url, {'cursor': '', 'order': 'name'})
+        self.assertEqual(response.status_code, 400)
 
     def test_node_list_filter_layers(self):
         url = reverse('api_node_list')
@@ -293,6 +375,49 @@ class NodesApiTest(BaseTestCase):
         response = self.client.get(url, {"layers": "rome,viterbo,pisa"})
         self.assertEqual(len(response.data['features']), 8)
 
+    def test_node_geojson_list_bbox(self):
+        url = reverse('api_node_gejson_list')
+        count = Node.objects.published().access_level_up_to('public').count()
+        response = self.client.get(url, {'bbox': '-180,-90,180,90'})
+        self.assertEqual(len(response.data['features']), count)
+        # box around a node
+        node = Node.objects.published().access_level_up_to('public').first()
+        x, y = node.point.coords
+        bbox = '%s,%s,%s,%s' % (x - 0.0001, y - 0.0001, x + 0.0001, y + 0.0001)
+        response = self.client.get(url, {'bbox': bbox})
+        self.assertIn(node.slug, [feature['id'] for feature in response.data['features']])
+        self.assertLess(len(response.data['features']), count)
+        # nothing there
+        response = self.client.get(url, {'bbox': '0,0,0.001,0.001'})
+        self.assertEqual(len(response.data['features']), 0)
+        # invalid
+        response = self.client.get(url, {'bbox': '0,0,1'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_node_geojson_list_clusters(self):
+        url = reverse('api_node_gejson_list')
+        count = Node.objects.published().access_level_up_to('public').count()
+        response = self.client.get(url, {'zoom': 0})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['type'], 'FeatureCollection')
+        features = response.data['features']
+        self.assertEqual(sum(feature['properties']['count'] for feature in features), count)
+        for feature in features:
+            self.assertTrue(feature['properties']['cluster'])
+            self.assertEqual(feature['geometry']['type'], 'Point')
+        # filters still apply
+        response = self.client.get(url, {'zoom': 0, 'layers': 'rome'})
+        self.assertEqual(sum(feature['properties']['count'] for feature in response.data['features']), 4)
+        response = self.client.get(url, {'zoom': 0, 'bbox': '0,0,0.001,0.001'})
+        self.assertEqual(response.data['features'], [])
+        # higher zoom levels return nodes
+        response = self.client.get(url, {'zoom': CLUSTERING_MAX_ZOOM + 1})
+        self.assertEqual(len(response.data['features']), count)
+        self.assertNotIn('cluster', response.data['features'][0]['properties'])
+        # invalid
+        self.assertEqual(self.client.get(url, {'zoom': 'a'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'zoom': 31}).status_code, 400)
+
     def test_node_details(self):
         """ test node details """
         url = reverse('api_node_details', args=['fusolab'])
@@ -561,3 +686,78 @@ class NodesApiTest(BaseTestCase):
         self.assertEqual(len(response.data['geometry']['coordinates']), 72)
         self.assertEqual(len(response.data['geometry']['coordinates'][0]), 3)
         self.assertEqual(len(response.data['geometry']['coordinates'][-1]), 3)
+
+
+class NodeSnapshotTest(BaseTestCase):
+    fixtures = [
+        'initial_data.json',
+        user_fixtures,
+        'test_layers.json',
+        'test_status.json',
+        'test_nodes.json'
+    ]
+
+    def setUp(self):
+        from django.core.cache import get_cache
+        from . import snapshots
+        self.snapshots = snapshots
+        # the dummy cache used in development does not store snapshots
+        self._cache = snapshots.cache
+        self._delay = snapshots.SNAPSHOTS_DELAY
+        snapshots.cache = get_cache('django.core.cache.backends.locmem.LocMemCache')
+        snapshots.SNAPSHOTS_DELAY = 0
+
+    def tearDown(self):
+        self.snapshots.cache = self._cache
+        self.snapshots.SNAPSHOTS_DELAY = self._delay
+
+    def test_snapshot(self):
+        url = reverse('api_node_gejson_list')
+        # rendered by the first request, which is served dynamically
+        first = self.client.get(url)
+        self.assertNotIn('ETag', first)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('ETag', response)
+        self.assertEqual(json.loads(response.content), json.loads(first.content))
+        count = Node.objects.published().access_level_up_to('public').count()
+        self.assertEqual(len(json.loads(response.content)['features']), count)
+        # conditional request
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        # gzip
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+
+    def test_snapshot_outdated(self):
+        url = reverse('api_node_gejson_list')
+        self.client.get(url)
+        etag = self.client.get(url)['ETag']
+        node = Node.objects.get(slug='fusolab')
+        node.name = 'Fusolab renamed'
+        node.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Fusolab renamed', response.content)
+        self.assertNotEqual(self.client.get(url)['ETag'], etag)
+
+    def test_snapshot_debounce(self):
+        url = reverse('api_node_gejson_list')
+        self.snapshots.SNAPSHOTS_DELAY = 60
+        Node.objects.get(slug='fusolab').save()
+        # nodes changed less than a minute ago: served dynamically
+        self.client.get(url)
+        response = self.client.get(url)
+        self.assertNotIn('ETag', response)
+
+    def test_snapshot_dynamic_path(self):
+        url = reverse('api_layer_nodes_geojson', args=['rome'])
+        self.client.get(url)
+        self.assertIn('ETag', self.client.get(url))
+        # parameters
+        self.assertNotIn('ETag', self.client.get(url, {'limit': 1}))
+        # non public access levels
+        self.client.login(username='admin', password='tester')
+        response = self.client.get(url)
+        self.assertNotIn('ETag', response)
+        self.assertIn('Hidden Node Rome', response.content)
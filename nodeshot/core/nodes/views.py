@@ -1,15 +1,24 @@
+import json
+import time
+from collections import OrderedDict
+
 from django.http import Http404
 from django.utils.translation import ugettext_lazy as _
 from django.utils.decorators import method_decorator
 from django.views.decorators.cache import cache_page
+from django.db import connections
 from django.db.models import Q
 
 from rest_framework import permissions, authentication, generics
+from rest_framework.response import Response
+from rest_framework.exceptions import ParseError
 
-from nodeshot.core.base.mixins import ACLMixin, CustomDataMixin
-from nodeshot.core.base.utils import Hider
+from nodeshot.core.base.mixins import ACLMixin, CustomDataMixin, CursorPaginationMixin
+from nodeshot.core.base.utils import Hider, parse_bbox
+from nodeshot.core.base.search import search as search_queryset
 
-from .settings import REVERSION_ENABLED
+from .settings import REVERSION_ENABLED, CLUSTERING_MAX_ZOOM, CLUSTERING_GRID_SIZE, SNAPSHOTS_ENABLED
+from . import snapshots
 from .permissions import IsOwnerOrReadOnly
 from .serializers import *  # noqa
 from .models import Node, Status, Image
@@ -44,15 +53,18 @@ def get_queryset_or_404(queryset, kwargs):
     return obj
 
 
-class NodeList(NodeListBase):
+class NodeList(CursorPaginationMixin, NodeListBase):
     """
     Retrieve list of all published nodes.
 
     Parameters:
 
-     * `search=<word>`: search <word> in name, slug, description and address of nodes
+     * `search=<word>`: search <word> in name, slug, description and address of nodes (most relevant first)
      * `layers=<layer1>,<layer2>`: retrieve nodes of specified layers (comma separated)
      * `limit=<n>`: specify number of items per page (defaults to 50)
+     * `cursor=`: use cursor pagination, the response contains the `next` URL;
+       faster than `page=<n>` on deep pages, items are ordered by `updated` (or by `id` with `order=id`)
+     * `count=approximate`: add the estimated number of items to cursor paginated responses
 
     ### POST
 
@@ -83,14 +95,8 @@ class NodeList(NodeListBase):
         search = self.request.QUERY_PARAMS.get('search', None)
         layers = self.request.QUERY_PARAMS.get('layers', None)
         if search is not None:
-            search_query = (
-                Q(name__icontains=search) |
-                Q(slug__icontains=search) |
-                Q(description__icontains=search) |
-                Q(address__icontains=search)
-            )
-            # add instructions for search to queryset
-            queryset = queryset.filter(search_query)
+            # name, slug, description, address and NODESHOT_NODES_SEARCH_HSTORE_KEYS
+            queryset = search_queryset(queryset, search)
         if layers is not None:
             # look for nodes that are assigned to the specified layers
             queryset = queryset.filter(Q(layer__slug__in=layers.split(',')))
@@ -120,7 +126,105 @@ class NodeDetail(NodeDetailBase):
 node_details = NodeDetail.as_view()
 
 
-class NodeGeoJSONList(NodeList):
+class NodeMapMixin(object):
+    """
+    Adds bbox and zoom parameters to the lists of nodes in GeoJSON format,
+    at low zoom levels nodes are grouped in clusters
+    """
+    def get_queryset(self):
+        queryset = super(NodeMapMixin, self).get_queryset()
+        bbox = self.request.QUERY_PARAMS.get('bbox')
+        if bbox:
+            try:
+                bbox = parse_bbox(bbox)
+            except ValueError:
+                raise ParseError(_('bbox: expected 4 comma separated numbers'))
+            # "&&" operator, uses the spatial index
+            queryset = queryset.filter(geometry__bboverlaps=bbox)
+        return queryset
+
+    def get_zoom(self):
+        zoom = self.request.QUERY_PARAMS.get('zoom')
+        if zoom is None:
+            return None
+        try:
+            zoom = int(zoom)
+            if not 0 <= zoom <= 30:
+                raise ValueError()
+        except ValueError:
+            raise ParseError(_('zoom: expected an integer between 0 and 30'))
+        return zoom
+
+    def get_clusters(self, queryset, zoom):
+        """
+        groups the nodes in the cells of a grid whose size depends on the zoom level, 1 query
+        :returns: GeoJSON FeatureCollection of points (centroid of the nodes of each cell)
+                  with the number of nodes among their properties
+        """
+        # width of a map tile in degrees divided by the number of cells per tile
+        size = 360.0 / 2 ** zoom / CLUSTERING_GRID_SIZE
+        subquery, params = queryset.order_by().values('pk').query.sql_with_params()
+        connection = connections[queryset.db]
+        quote = connection.ops.quote_name
+        geometry = '%s.%s' % (quote(Node._meta.db_table), quote(Node._meta.get_field('geometry').column))
+        cursor = connection.cursor()
+        cursor.execute(
+            'SELECT COUNT(*), ST_AsGeoJSON(ST_Centroid(ST_Collect(ST_Centroid({geometry})))) '
+            'FROM {table} WHERE {pk} IN ({subquery}) '
+            'GROUP BY ST_SnapToGrid(ST_Centroid({geometry}), %s) '
+            'ORDER BY 1 DESC'.format(geometry=geometry,
+                                     table=quote(Node._meta.db_table),
+                                     pk=quote(Node._meta.pk.column),
+                                     subquery=subquery),
+            list(params) + [size]
+        )
+        features = [OrderedDict((
+            ('type', 'Feature'),
+            ('geometry', json.loads(centroid)),
+            ('properties', {'cluster': True, 'count': count})
+        )) for count, centroid in cursor.fetchall()]
+        return OrderedDict((
+            ('type', 'FeatureCollection'),
+            ('features', features)
+        ))
+
+    def list(self, request, *args, **kwargs):
+        zoom = self.get_zoom()
+        if zoom is not None and zoom <= CLUSTERING_MAX_ZOOM:
+            return Response(self.get_clusters(self.get_queryset(), zoom))
+        return super(NodeMapMixin, self).list(request, *args, **kwargs)
+
+
+class SnapshotMixin(object):
+    """
+    Serves anonymous JSON requests without parameters from a pre-rendered snapshot
+    (see nodeshot.core.nodes.snapshots), other requests are served dynamically
+    """
+    def get_snapshot_key(self):
+        """ returns None if the snapshot must not be used """
+        return snapshots.get_key()
+
+    def get(self, request, *args, **kwargs):
+        if not SNAPSHOTS_ENABLED or not request.user.is_anonymous() or request.QUERY_PARAMS or \
+           request.accepted_renderer.format != 'json':
+            return super(SnapshotMixin, self).get(request, *args, **kwargs)
+        key = self.get_snapshot_key()
+        if key is None:
+            return super(SnapshotMixin, self).get(request, *args, **kwargs)
+        snapshot, renderable = snapshots.get_snapshot(key)
+        if snapshot is not None:
+            return snapshots.snapshot_response(request, snapshot)
+        # changes which happen while the data is being retrieved outdate the new snapshot
+        rendered = time.time()
+        response = super(SnapshotMixin, self).get(request, *args, **kwargs)
+        if renderable and response.status_code == 200:
+            content = request.accepted_renderer.render(response.data, request.accepted_media_type,
+                                                       self.get_renderer_context())
+            snapshots.save_snapshot(key, content, rendered)
+        return response
+
+
+class NodeGeoJSONList(SnapshotMixin, NodeMapMixin, NodeList):
     """
     Retrieve list of all published nodes in GeoJSON format.
 
@@ -128,8 +232,13 @@ class NodeGeoJSONList(NodeList):
 
      * `search=<word>`: search <word> in name, slug, description and address of nodes
      * `layers=<layer1>,<layer2>`: retrieve nodes of specified layers
+     * `bbox=<min lng>,<min lat>,<max lng>,<max lat>`: retrieve nodes within the specified bounding box
+     * `zoom=<n>`: zoom level of the map, nodes are grouped in clusters
+       up to `NODESHOT_NODES_CLUSTERING_MAX_ZOOM` (clusters have a `count` property)
      * `limit=<n>`: specify number of items per page (show all by default)
      * `page=<n>`: show page n
+
+    Anonymous requests without parameters are served from a snapshot which supports `If-None-Match`.
     """
     pagination_serializer_class = PaginatedGeojsonNodeListSerializer
     paginate_by_param = 'limit'
@@ -258,7 +367,6 @@ status_list = StatusList.as_view()
 # --------- Utils ---------#
 
 from rest_framework.decorators import api_view
-from rest_framework.response import Response
 from geojson_elevation.backends.google import elevation
 
 from .settings import ELEVATION_API_KEY, ELEVATION_DEFAULT_SAMPLING
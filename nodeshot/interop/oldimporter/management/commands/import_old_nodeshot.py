@@ -23,7 +23,7 @@ from nodeshot.community.profiles.settings import EMAIL_CONFIRMATION
 if EMAIL_CONFIRMATION:
     from nodeshot.community.profiles.models import EmailAddress
 
-from nodeshot.core.base.utils import pause_disconnectable_signals, resume_disconnectable_signals
+from nodeshot.core.base.utils import pause_disconnectable_signals, resume_disconnectable_signals, SlugAllocator
 from nodeshot.core.nodes.models import Node, Status
 from nodeshot.networking.net.models import *  # noqa
 from nodeshot.networking.net.models.choices import INTERFACE_TYPES
@@ -389,6 +389,12 @@ choose (enter the number of) one of the following layers:
         self.message('saving users into local DB')
 
         saved_users = self.saved_admins
+        # usernames are already slugified, numbers are appended to the ones which are taken
+        username_allocator = SlugAllocator(
+            User.objects.values_list('username', flat=True),
+            name_format='%s%d',
+            slugify=lambda username: username
+        )
 
         # loop over all extracted unique email addresses
         for email in self.email_set:
@@ -434,16 +440,9 @@ choose (enter the number of) one of the following layers:
             oldest_node = OldNode.objects.filter(email=email).order_by('added')[0]
             user.date_joined = oldest_node.added
 
-            # be sure username is unique
-            counter = 1
-            original_username = username
-            while True:
-                # do this check only if user is new
-                if not user.pk and User.objects.filter(username=user.username).count() > 0:
-                    counter += 1
-                    user.username = '%s%d' % (original_username, counter)
-                else:
-                    break
+            # be sure username is unique, do this check only if user is new
+            if not user.pk:
+                user.username = username_allocator.allocate(username)[0]
 
             try:
                 # validate data and save
@@ -1,5 +1,14 @@
+import sys
+import signal
+import threading
+import traceback
+from collections import OrderedDict
+from cStringIO import StringIO
+from multiprocessing import Pool, current_process
+
 from django.core.management.base import BaseCommand, CommandError
 from django.core.exceptions import ImproperlyConfigured, ObjectDoesNotExist
+from django.db import connections, transaction
 from django.db.models import Q
 from django.utils.module_loading import import_by_path
 
@@ -23,6 +32,23 @@ class Command(BaseCommand):
                  e.g. --exclude=layer1-slug,layer2-slug,layer3-slug\n\
                  (works only if no layer has been specified)'
         ),
+        make_option(
+            '--workers',
+            action='store',
+            dest='workers',
+            default=1,
+            help='Number of layers synchronized in parallel by a pool of processes\n\
+                 e.g. --workers=4 (default: 1, no parallelism)\n\
+                 (ignored in daemonic processes, eg: celery workers)'
+        ),
+        make_option(
+            '--timeout',
+            action='store',
+            dest='timeout',
+            default=0,
+            help='Maximum number of seconds the synchronization of each layer can take\n\
+                 e.g. --timeout=300 (default: 0, no timeout)'
+        ),
     )
 
     def retrieve_layers(self, *args, **options):
@@ -81,6 +107,8 @@ class Command(BaseCommand):
         """ execute sync command """
         # store verbosity level in instance attribute for later use
         self.verbosity = int(options.get('verbosity'))
+        workers = int(options.get('workers') or 1)
+        timeout = int(options.get('timeout') or 0)
 
         # blank line
         self.stdout.write('\r\n')
@@ -94,38 +122,165 @@ class Command(BaseCommand):
         else:
             self.verbose('going to process %d layers...' % len(layers))
 
-        # loop over
-        for layer in layers:
-            # retrieve interop class if available
-            try:
-                synchronizer_path = layer.external.synchronizer_path
-            except (ObjectDoesNotExist, AttributeError):
-                self.stdout.write('External Layer %s does not have a synchronizer class specified\n\r' % layer.name)
-                continue
+        # daemonic processes (eg: celery workers) are not allowed to have children
+        if workers > 1 and current_process().daemon:
+            self.stdout.write('--workers ignored: this process is not allowed to start a pool of processes\n\r')
+            workers = 1
 
-            # if no synchronizer_path jump to next layer
-            if synchronizer_path == 'None':
-                self.stdout.write('External Layer %s does not have a synchronizer class specified\n\r' % layer.name)
-                continue
+        if workers > 1:
+            results = self.sync_layers_in_parallel(layers, workers, timeout)
+        else:
+            results = ((layer, self.sync_layer_safely(layer, timeout)) for layer in layers)
 
-            if layer.external.config is None:
-                self.stdout.write('Layer %s does not have a config yet\n\r' % layer.name)
-                continue
+        self.write_summary(results)
 
-            # retrieve class
-            Synchronizer = import_by_path(synchronizer_path)
-            self.stdout.write('imported module %s\r\n' % Synchronizer.__name__)
+        self.stdout.write('\r\n')
 
-            # try running
-            try:
+    def sync_layer(self, layer, timeout=0):
+        """
+        synchronize a single layer, returns one of the following statuses:
+        "synchronized", "skipped", "failed", "timeout"
+        changes of layers which time out are rolled back
+        """
+        if timeout and not timeout_supported():
+            self.stdout.write('Warning: --timeout ignored, timeouts work only in the main thread\r\n')
+            timeout = 0
+
+        # retrieve interop class if available
+        try:
+            synchronizer_path = layer.external.synchronizer_path
+        except (ObjectDoesNotExist, AttributeError):
+            self.stdout.write('External Layer %s does not have a synchronizer class specified\n\r' % layer.name)
+            return 'skipped'
+
+        # if no synchronizer_path jump to next layer
+        if synchronizer_path == 'None':
+            self.stdout.write('External Layer %s does not have a synchronizer class specified\n\r' % layer.name)
+            return 'skipped'
+
+        if layer.external.config is None:
+            self.stdout.write('Layer %s does not have a config yet\n\r' % layer.name)
+            return 'skipped'
+
+        # retrieve class
+        Synchronizer = import_by_path(synchronizer_path)
+        self.stdout.write('imported module %s\r\n' % Synchronizer.__name__)
+
+        if timeout:
+            signal.signal(signal.SIGALRM, raise_layer_timeout)
+            signal.alarm(timeout)
+
+        # try running
+        try:
+            with transaction.atomic():
                 instance = Synchronizer(layer, verbosity=self.verbosity)
                 self.stdout.write('Processing layer "%s"\r\n' % layer.slug)
                 messages = instance.sync()
-            except ImproperlyConfigured, e:
-                self.stdout.write('Validation error: %s\r\n' % e)
-                continue
+                if timeout:
+                    signal.alarm(0)
+        except ImproperlyConfigured, e:
+            self.stdout.write('Validation error: %s\r\n' % e)
+            return 'failed'
+        except LayerTimeout:
+            self.stdout.write('Layer "%s" timed out after %d seconds\r\n' % (layer.slug, timeout))
+            return 'timeout'
+        finally:
+            if timeout:
+                signal.alarm(0)
 
-            for message in messages:
-                self.stdout.write('%s\n\r' % message)
+        for message in messages:
+            self.stdout.write('%s\n\r' % message)
 
-        self.stdout.write('\r\n')
+        return 'synchronized'
+
+    def sync_layer_safely(self, layer, timeout=0):
+        """ same as sync_layer but errors are reported and do not stop the synchronization of other layers """
+        try:
+            return self.sync_layer(layer, timeout)
+        except Exception:
+            self.stdout.write('Layer "%s" failed, got exception:\n\r%s\n\r' % (layer.slug, traceback.format_exc()))
+            return 'failed'
+
+    def sync_layers_in_parallel(self, layers, workers, timeout=0):
+        """
+        synchronize layers in a pool of processes
+        the output of each layer is written as soon as the layer
+        and the ones which precede it are done
+        yields (layer, status) tuples
+        """
+        # each child process must open its own database connection
+        for connection in connections.all():
+            connection.close()
+
+        pool = Pool(processes=min(workers, len(layers)))
+        results = [
+            pool.apply_async(sync_layer_in_subprocess, [layer.slug, self.verbosity, timeout])
+            for layer in layers
+        ]
+        pool.close()
+
+        for layer, result in zip(layers, results):
+            try:
+                status, output = result.get()
+            except Exception as e:
+                status, output = 'failed', 'Layer "%s" failed: %s\r\n' % (layer.slug, e)
+            self.stdout.write(output)
+            yield layer, status
+
+        pool.join()
+
+    def write_summary(self, results):
+        """ consumes (layer, status) tuples and writes how many layers ended with each status """
+        summary = OrderedDict([
+            ('synchronized', []),
+            ('skipped', []),
+            ('failed', []),
+            ('timeout', [])
+        ])
+
+        for layer, status in results:
+            summary[status].append(layer.slug)
+
+        self.stdout.write('\r\n%d layers synchronized, %d skipped, %d failed, %d timed out\r\n' % tuple(
+            len(slugs) for slugs in summary.values()
+        ))
+        for status in ['failed', 'timeout']:
+            if summary[status]:
+                self.stdout.write('%s: %s\r\n' % (status, ', '.join(summary[status])))
+
+
+class LayerTimeout(Exception):
+    pass
+
+
+def timeout_supported():
+    """ SIGALRM handlers can be installed only by the main thread """
+    return isinstance(threading.current_thread(), threading._MainThread)
+
+
+def raise_layer_timeout(signum, frame):
+    raise LayerTimeout()
+
+
+def sync_layer_in_subprocess(layer_slug, verbosity, timeout):
+    """
+    synchronize a layer in a child process of "sync --workers"
+    returns a tuple containing the status and the output of the layer
+    """
+    output = StringIO()
+    command = Command()
+    command.verbosity = verbosity
+    command.stdout = output
+    # synchronizers use print statements too
+    sys.stdout = output
+
+    try:
+        layer = Layer.objects.select_related('external').get(slug=layer_slug)
+        status = command.sync_layer_safely(layer, timeout)
+    except Exception:
+        output.write('Layer "%s" failed, got exception:\n\r%s\n\r' % (layer_slug, traceback.format_exc()))
+        status = 'failed'
+    finally:
+        sys.stdout = sys.__stdout__
+
+    return status, output.getvalue()
@@ -11,10 +11,11 @@ check_dependencies(
 
 
 from .layer_external import LayerExternal
+from .layer_external_cache import LayerExternalCache
 from .node_external import NodeExternal
 
 
-__all__ = ['LayerExternal', 'NodeExternal']
+__all__ = ['LayerExternal', 'LayerExternalCache', 'NodeExternal']
 
 
 # ------ patch LayerNodesList view to support external layers ------ #
@@ -34,3 +35,42 @@ def get_nodes(self, request, *args, **kwargs):
         return (self.list(request, *args, **kwargs)).data
 
 LayerNodesList.get_nodes = get_nodes
+
+
+# ------ indexes of the external ids declared by synchronizers ------ #
+
+from django.db.models.signals import post_syncdb
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_by_path
+
+from nodeshot.core.base import external_ids
+from ..settings import SYNCHRONIZERS
+
+
+def register_external_ids():
+    """ registers the hstore keys declared in the EXTERNAL_IDS attribute of synchronizers """
+    for path, name in SYNCHRONIZERS:
+        try:
+            synchronizer = import_by_path(path)
+        # eg: missing optional dependency
+        except ImproperlyConfigured:
+            continue
+        for model, key in synchronizer.EXTERNAL_IDS:
+            external_ids.register(model, key)
+
+
+def create_external_id_indexes(sender, **kwargs):
+    register_external_ids()
+    created = external_ids.ensure_indexes(using=kwargs.get('db') or 'default')
+    if kwargs.get('verbosity', 1) > 0:
+        for name in created:
+            print('Created index %s' % name)
+
+
+post_syncdb.connect(create_external_id_indexes)
+
+try:
+    from south.signals import post_migrate
+    post_migrate.connect(create_external_id_indexes)
+except ImportError:
+    pass
@@ -0,0 +1,27 @@
+from django.db import models
+from django.utils.translation import ugettext_lazy as _
+
+
+class LayerExternalCache(models.Model):
+    """
+    HTTP cache validators and content digest of the data
+    retrieved during the last synchronization of an external layer
+    """
+    layer_external = models.OneToOneField('sync.LayerExternal', verbose_name=_('external layer'), related_name='cache')
+    url = models.CharField(_('url'), max_length=255, blank=True)
+    etag = models.CharField(_('ETag'), max_length=255, blank=True)
+    last_modified = models.CharField(_('Last-Modified'), max_length=64, blank=True)
+    digest = models.CharField(_('content digest'), max_length=40, blank=True)
+    local_digest = models.CharField(_('local digest'), max_length=40, blank=True,
+                                    help_text=_('digest of the configuration and of the local nodes of the layer'))
+    item_count = models.PositiveIntegerField(_('external records'), default=0)
+    updated = models.DateTimeField(_('updated on'), auto_now=True)
+
+    class Meta:
+        app_label = 'sync'
+        db_table = 'layers_external_cache'
+        verbose_name = _('external layer cache')
+        verbose_name_plural = _('external layer cache')
+
+    def __unicode__(self):
+        return '%s cache' % self.url
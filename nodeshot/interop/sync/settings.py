@@ -12,3 +12,11 @@ if 'nodeshot.networking.links' in settings.INSTALLED_APPS:
     DEFAULT_SYNCHRONIZERS.append(('nodeshot.interop.sync.synchronizers.Cnml', 'CNML (periodic sync)'))
 
 SYNCHRONIZERS = DEFAULT_SYNCHRONIZERS + getattr(settings, 'NODESHOT_SYNCHRONIZERS', [])
+
+# write nodes with bulk queries instead of saving them one by one,
+# faster but most of the side effects of Node.save are lost (see GenericGisSynchronizer._bulk_write)
+BULK_SYNC = getattr(settings, 'NODESHOT_SYNC_BULK', False)
+# max number of nodes written with a single bulk query
+BULK_BATCH_SIZE = getattr(settings, 'NODESHOT_SYNC_BULK_BATCH_SIZE', 500)
+# send conditional HTTP requests and skip layers whose data has not changed since last sync
+CONDITIONAL_REQUESTS = getattr(settings, 'NODESHOT_SYNC_CONDITIONAL_REQUESTS', True)
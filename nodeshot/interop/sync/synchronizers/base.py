@@ -1,16 +1,29 @@
 from __future__ import absolute_import
 
+import json
+import hashlib
 import requests
-from xml.dom import minidom
+from xml.dom import minidom, pulldom
 from dateutil import parser as DateParser
 
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max
+from django.contrib.gis.geos.collections import GeometryCollection
 from django.template.defaultfilters import slugify
 from django.utils.translation import ugettext_lazy as _
 from django.contrib.auth import get_user_model
 User = get_user_model()
 
-from nodeshot.core.base.utils import pause_disconnectable_signals, resume_disconnectable_signals
+from nodeshot.core.base.utils import pause_disconnectable_signals, resume_disconnectable_signals, now, SlugAllocator
+from nodeshot.core.base.cache import cache_delete_pattern_or_all
+from nodeshot.core.layers.tiles import clear_tile_cache
 from nodeshot.core.nodes.models import Node, Status
+from nodeshot.core.nodes.signals import node_status_changed
+from nodeshot.core.nodes import snapshots
+
+from ..models import LayerExternalCache
+from ..settings import BULK_SYNC, BULK_BATCH_SIZE, CONDITIONAL_REQUESTS
 
 
 __all__ = [
@@ -37,6 +50,11 @@ class BaseSynchronizer(object):
         * log messages with different levels of verbosity
     """
     SCHEMA = None
+    # hstore keys used to store identifiers of imported objects, eg: [('nodes.Node', 'cnml_id')]
+    # an expression index is maintained for each one of them, see nodeshot.core.base.external_ids
+    EXTERNAL_IDS = []
+    # set to True by "retrieve_data" if external data has not changed since last synchronization
+    not_modified = False
 
     def __init__(self, layer, *args, **kwargs):
         """
@@ -76,12 +94,18 @@ class BaseSynchronizer(object):
         Steps:
             0. Call "before_start" method (which might be implemented by children classes)
             1. Retrieve data from external source
+               (stop here if data has not changed since last synchronization)
             2. Parse the data
             3. Save the data locally
             4. Call "after_complete" method (which might be implemented by children classes)
         """
         self.before_start()
         self.retrieve_data()
+
+        if self.not_modified:
+            self.message = self.get_not_modified_message()
+            return [self.message]
+
         self.parse()
 
         # TRICK: disable new_nodes_allowed_for_layer validation
@@ -92,21 +116,27 @@ class BaseSynchronizer(object):
         # avoid sending zillions of notifications
         pause_disconnectable_signals()
 
-        self.save()
-
-        # Re-enable new_nodes_allowed_for_layer validation
+        # restore validation and signals even if save is interrupted (eg: sync --timeout)
         try:
-            Node._additional_validation.insert(0, 'new_nodes_allowed_for_layer')
-        except ValueError as e:
-            print "WARNING! got exception: %s" % e
-        # reconnect signals
-        resume_disconnectable_signals()
+            self.save()
+        finally:
+            # Re-enable new_nodes_allowed_for_layer validation
+            try:
+                Node._additional_validation.insert(0, 'new_nodes_allowed_for_layer')
+            except ValueError as e:
+                print "WARNING! got exception: %s" % e
+            # reconnect signals
+            resume_disconnectable_signals()
 
         self.after_complete()
 
         # return message as a list because more than one messages might be returned
         return [self.message]
 
+    def get_not_modified_message(self):
+        """ message returned when the synchronization is skipped because nothing changed """
+        return 'layer skipped because external data has not changed since last synchronization'
+
     def retrieve_data(self):
         """ retrieve data """
         raise NotImplementedError("BaseSynchronizer child class does not implement a retrieve_data method")
@@ -125,23 +155,184 @@ class BaseSynchronizer(object):
 
 
 class HttpRetrieverMixin(object):
-    """ Retrieve external data through HTTP """
+    """
+    Retrieve external data through HTTP
+
+    If the "streaming" config key is enabled the response body is not
+    downloaded entirely, a file-like object is stored in "self.stream" instead
+
+    ETag, Last-Modified and a digest of the content are stored after each synchronization
+    and used to skip parsing and saving when the external data has not changed.
+    They are ignored if the configuration of the layer or its local nodes
+    have changed since then (see "get_local_digest").
+
+    In streaming mode the digest is known only after the data has been saved,
+    hence it is not used to skip the synchronization: only the HTTP validators are.
+    """
+    STREAMING_FIELD = {
+        'name': 'streaming',
+        'class': 'BooleanField',
+        'kwargs': {
+            'default': False,
+            'help_text': _('Parse data while it is being downloaded, recommended for big files')
+        }
+    }
+    streaming = False
+    # validators of the data retrieved, stored after the synchronization is complete
+    retrieved = None
+
+    def load_config(self, config=None):
+        super(HttpRetrieverMixin, self).load_config(config)
+        self.streaming = self.config.get('streaming', False)
+        # ensure correct boolean
+        self.streaming = self.streaming is True or self.streaming == 'True'
+
+    @property
+    def cache(self):
+        """ LayerExternalCache instance of this layer or None """
+        if not hasattr(self, '_cache'):
+            try:
+                self._cache = LayerExternalCache.objects.get(layer_external=self.layer.external)
+            except LayerExternalCache.DoesNotExist:
+                self._cache = None
+        return self._cache
+
+    def get_local_digest(self):
+        """
+        digest of what determines the result of a synchronization besides the external data:
+        the configuration of the external layer and the local nodes of the layer,
+        which might have been edited, added or deleted since the last synchronization
+        """
+        nodes = Node.objects.filter(layer=self.layer).aggregate(count=Count('id'), updated=Max('updated'))
+        state = [
+            self.layer.external.synchronizer_path,
+            self.config,
+            nodes['count'],
+            nodes['updated'].isoformat() if nodes['updated'] else None
+        ]
+        return hashlib.sha1(json.dumps(state, sort_keys=True, default=unicode)).hexdigest()
 
     def retrieve_data(self):
         """ retrieve data from an HTTP URL """
         # shortcuts for readability
         url = self.config.get('url')
+        cache = self.cache
+        # validators are meaningful only for the same url, configuration and local nodes
+        if not CONDITIONAL_REQUESTS or (cache and (cache.url != url or
+                                                   cache.local_digest != self.get_local_digest())):
+            cache = None
+
+        headers = {}
+        if cache and cache.etag:
+            headers['If-None-Match'] = cache.etag
+        if cache and cache.last_modified:
+            headers['If-Modified-Since'] = cache.last_modified
+
+        # streaming parsers read the response body while it is being downloaded
+        response = requests.get(url, verify=self.verify_ssl, headers=headers, stream=self.streaming)
+
+        if cache and response.status_code == 304:
+            self.not_modified = True
+            self.verbose('HTTP 304: external data not modified')
+            return
+
+        self.retrieved = {
+            'url': url,
+            'etag': response.headers.get('ETag', ''),
+            'last_modified': response.headers.get('Last-Modified', '')
+        }
+
+        if self.streaming:
+            # decode gzip/deflate transfer encodings
+            response.raw.decode_content = True
+            # digest is calculated while data is being read and stored when the
+            # synchronization is complete, it can't be compared before nodes are written
+            self.stream = DigestReader(response.raw)
+            return
+
+        # store content
+        self.data = response.content
+        self.retrieved['digest'] = hashlib.sha1(self.data).hexdigest()
+
+        if cache and cache.digest == self.retrieved['digest']:
+            self.not_modified = True
+            self.verbose('external data identical to the one of last synchronization')
+            # validators might have changed even if content has not
+            self.retrieved['local_digest'] = cache.local_digest
+            self.store_retrieved()
+
+    def after_complete(self, *args, **kwargs):
+        super(HttpRetrieverMixin, self).after_complete(*args, **kwargs)
+        if self.retrieved is None:
+            return
+        if self.streaming:
+            self.retrieved['digest'] = self.stream.hexdigest()
+        # nodes have just been written
+        self.retrieved['local_digest'] = self.get_local_digest()
+        self.store_retrieved()
+
+    def store_retrieved(self):
+        """ store validators of the retrieved data for the next synchronization """
+        cache = self.cache or LayerExternalCache(layer_external=self.layer.external)
+        for key, value in self.retrieved.items():
+            setattr(cache, key, value)
+        cache.item_count = getattr(self, 'item_count', cache.item_count)
+        cache.save()
+        self._cache = cache
 
-        # do HTTP request and store content
-        self.data = requests.get(url, verify=self.verify_ssl).content
+
+class DigestReader(object):
+    """ file-like wrapper which calculates the sha1 digest of the data read """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.sha1 = hashlib.sha1()
+
+    def read(self, *args, **kwargs):
+        data = self.stream.read(*args, **kwargs)
+        self.sha1.update(data)
+        return data
+
+    def hexdigest(self):
+        return self.sha1.hexdigest()
 
 
 class XMLParserMixin(object):
-    """ XML Parsing utility methods """
+    """
+    XML Parsing utility methods
+
+    In streaming mode (see HttpRetrieverMixin) the document is parsed incrementally
+    and only the elements listed in "item_tags" are passed to "parse_item",
+    one at a time, each one is discarded once processed.
+    """
+    # tag names of the elements which represent items in streaming mode
+    item_tags = []
 
     def parse(self):
         """ parse data """
-        self.parsed_data = minidom.parseString(self.data)
+        if not self.streaming:
+            self.parsed_data = minidom.parseString(self.data)
+            return
+
+        self.events = pulldom.parse(self.stream)
+        # read up to the root element, subclasses might need it to detect the format
+        self.root_tag = None
+        for event, node in self.events:
+            if event == pulldom.START_ELEMENT:
+                self.root_tag = node.tagName
+                break
+        self.parsed_data = self.iter_items()
+
+    def iter_items(self):
+        """ yields the elements listed in "item_tags" one by one """
+        for event, node in self.events:
+            if event == pulldom.START_ELEMENT and node.tagName in self.item_tags:
+                self.events.expandNode(node)
+                # merge text which has been split in several nodes by the SAX parser
+                node.normalize()
+                yield node
+                # free memory used by processed element
+                node.unlink()
 
     @staticmethod
     def get_text(item, tag, default=False):
@@ -169,6 +360,8 @@ class GenericGisSynchronizer(HttpRetrieverMixin, BaseSynchronizer):
 
     You must implement a "parse_item" method to support different formats.
     """
+    bulk = BULK_SYNC
+    batch_size = BULK_BATCH_SIZE
     SCHEMA = [
         {
             'name': 'url',
@@ -348,13 +541,7 @@ class GenericGisSynchronizer(HttpRetrieverMixin, BaseSynchronizer):
             item['status'] = self.default_status
 
         # get status or get default status or None
-        try:
-            item['status'] = Status.objects.get(slug__iexact=item['status'])
-        except Status.DoesNotExist:
-            try:
-                item['status'] = Status.objects.filter(is_default=True)[0]
-            except IndexError:
-                item['status'] = None
+        item['status'] = self._get_status(item['status'])
 
         # slugify slug
         item['slug'] = slugify(item['name'])
@@ -366,10 +553,7 @@ class GenericGisSynchronizer(HttpRetrieverMixin, BaseSynchronizer):
             item['is_published'] = ''
 
         # get user or None
-        try:
-            item['user'] = User.objects.get(username=item['user'])
-        except User.DoesNotExist:
-            item['user'] = None
+        item['user'] = self._get_user(item['user'])
 
         if not item['elev']:
             item['elev'] = None
@@ -382,11 +566,11 @@ class GenericGisSynchronizer(HttpRetrieverMixin, BaseSynchronizer):
 
         # convert dates to python datetime
         try:
-            item['added'] = DateParser.parse(item['added'])
+            item['added'] = self._parse_date(item['added'])
         except Exception as e:
             print "Exception while parsing 'added' date: %s" % e
         try:
-            item['updated'] = DateParser.parse(item['updated'])
+            item['updated'] = self._parse_date(item['updated'])
         except Exception as e:
             print "Exception while parsing 'updated' date: %s" % e
 
@@ -412,6 +596,41 @@ class GenericGisSynchronizer(HttpRetrieverMixin, BaseSynchronizer):
 
         return result
 
+    def _reset_lookup_caches(self):
+        """ lookups performed by _convert_item are memoized for the duration of a synchronization """
+        self._statuses = None
+        self._default_status = None
+        self._users = {}
+        self._dates = {}
+
+    def _get_status(self, slug):
+        """ returns status by slug (case insensitive), default status or None """
+        # load all statuses with one query
+        if self._statuses is None:
+            statuses = list(Status.objects.all())
+            self._statuses = dict((status.slug.lower(), status) for status in statuses)
+            default_statuses = [status for status in statuses if status.is_default]
+            self._default_status = default_statuses[0] if default_statuses else None
+        try:
+            return self._statuses[slug.lower()]
+        except (KeyError, AttributeError):
+            return self._default_status
+
+    def _get_user(self, username):
+        """ returns user by username or None, missing users are remembered too """
+        if username not in self._users:
+            try:
+                self._users[username] = User.objects.get(username=username)
+            except User.DoesNotExist:
+                self._users[username] = None
+        return self._users[username]
+
+    def _parse_date(self, value):
+        """ converts a string to a datetime, many items usually share the same dates """
+        if value not in self._dates:
+            self._dates[value] = DateParser.parse(value)
+        return self._dates[value]
+
     def key_mapping(self):
         key_map = self.field_mapping
         self.keys = {
@@ -441,8 +660,13 @@ class GenericGisSynchronizer(HttpRetrieverMixin, BaseSynchronizer):
          * ensure new nodes do not take a name/slug which is already used
          * validate through django before saving
          * use good defaults
+
+        if bulk mode is enabled (NODESHOT_SYNC_BULK) new and changed nodes are
+        written in batches of "batch_size" once all the items are processed,
+        see "_bulk_write" for the side effects of Node.save which are not replicated
         """
         self.key_mapping()
+        self._reset_lookup_caches()
         # retrieve all items
         items = self.parsed_data
 
@@ -450,87 +674,57 @@ class GenericGisSynchronizer(HttpRetrieverMixin, BaseSynchronizer):
         added_nodes = []
         changed_nodes = []
         unmodified_nodes = []
+        # (node, changed fields) tuples waiting to be written in bulk mode
+        bulk_updates = []
 
-        # retrieve a list of all the slugs of this layer
-        layer_nodes_slug_list = Node.objects.filter(layer=self.layer).values_list('slug', flat=True)
-        # keep a list of all the nodes of other layers
-        other_layers_slug_list = Node.objects.exclude(layer=self.layer).values_list('slug', flat=True)
-        # init empty list of slug of external nodes that will be needed to perform delete operations
-        processed_slug_list = []
-        deleted_nodes_count = 0
+        # retrieve all the nodes of this layer in a dict keyed by slug
+        layer_nodes = dict(
+            (node.slug, node) for node in
+            Node.objects.filter(layer=self.layer).select_related('status', 'user')
+        )
+        # slugs of the nodes of other layers and of the processed items cannot be reused
+        slug_allocator = SlugAllocator(Node.objects.exclude(layer=self.layer).values_list('slug', flat=True))
+        # init empty set of slug of external nodes that will be needed to perform delete operations
+        processed_slug_set = set()
 
         # loop over every item
         for item in items:
 
             item = self._convert_item(item)
 
-            number = 1
+            # items might have the same name... so we add a number..
             original_name = item['name']
-            needed_different_name = False
-
-            while True:
-                # items might have the same name... so we add a number..
-                if item['slug'] in processed_slug_list or item['slug'] in other_layers_slug_list:
-                    needed_different_name = True
-                    number = number + 1
-                    item['name'] = "%s - %d" % (original_name, number)
-                    item['slug'] = slugify(item['name'])
-                else:
-                    if needed_different_name:
-                        self.verbose('needed a different name for %s, trying "%s"' % (original_name, item['name']))
-                    break
-
-            # default values
-            added = False
-            changed = False
+            item['name'], item['slug'] = slug_allocator.allocate(original_name)
+            if item['name'] != original_name:
+                self.verbose('needed a different name for %s, trying "%s"' % (original_name, item['name']))
 
-            try:
-                # edit existing node
-                node = Node.objects.get(slug=item['slug'], layer=self.layer)
-            except Node.DoesNotExist:
-                # add a new node
+            # edit existing node or add a new one
+            node = layer_nodes.get(item['slug'])
+            added = node is None
+            if added:
                 node = Node()
                 node.layer = self.layer
-                added = True
-
-            # loop over fields and store data only if necessary
-            for field in Node._meta.fields:
-                # geometry is a special case, skip
-                if field.name == 'geometry':
-                    continue
-                # skip if field is not present in values
-                if field.name not in item.keys():
-                    continue
-                # shortcut for value
-                value = item[field.name]
-                # if value is different than what we have
-                if value is not None and getattr(node, field.name) != value:
-                    # set value
-                    setattr(node, field.name, value)
-                    # indicates that a DB query is necessary
-                    changed = True
-
-            if added or (node.geometry.equals(item['geometry']) is False
-                         and node.geometry.equals_exact(item['geometry']) is False):
-                node.geometry = item['geometry']
-                changed = True
-
-            node.data = node.data or {}
-
-            # store any additional key/value in HStore data field
-            for key, value in item['data'].items():
-                if node.data[key] != value:
-                    node.data[key] = value
-                    changed = True
+
+            changed_fields = self._update_node(node, item, added)
+            changed = len(changed_fields) > 0
 
             # perform save or update only if necessary
             if added or changed:
                 try:
-                    node.full_clean()
-                    if None not in [node.added, node.updated]:
-                        node.save(auto_update=False)
+                    if self.bulk:
+                        # uniqueness of slug (hence of name) is ensured by the loop above
+                        node.full_clean(validate_unique=False)
+                        if None in [node.added, node.updated]:
+                            node.updated = now()
+                            changed_fields.add('updated')
+                        if not added:
+                            bulk_updates.append((node, changed_fields))
                     else:
-                        node.save()
+                        node.full_clean()
+                        if None not in [node.added, node.updated]:
+                            node.save(auto_update=False)
+                        else:
+                            node.save()
                 except Exception as e:
                     raise Exception('error while processing "%s": %s' % (node.name, e))
 
@@ -544,24 +738,33 @@ class GenericGisSynchronizer(HttpRetrieverMixin, BaseSynchronizer):
                 unmodified_nodes.append(node)
                 self.verbose('node "%s" unmodified' % node.name)
 
-            # fill node list container
-            processed_slug_list.append(node.slug)
-
-        # delete old nodes
-        for local_node in layer_nodes_slug_list:
-            # if local node not found in external nodes
-            if local_node not in processed_slug_list:
-                # retrieve from DB and delete
-                node = Node.objects.get(slug=local_node)
-                # store node name to print it later
-                node_name = node.name
-                node.delete()
-                # then increment count that will be included in message
-                deleted_nodes_count = deleted_nodes_count + 1
-                self.verbose('node "%s" deleted' % node_name)
+            # fill node set container
+            processed_slug_set.add(node.slug)
+
+        if self.bulk:
+            self._bulk_write(added_nodes, bulk_updates)
+
+        # delete old nodes with one query
+        deleted_slug_list = list(set(layer_nodes.keys()) - processed_slug_set)
+        if deleted_slug_list:
+            Node.objects.filter(layer=self.layer, slug__in=deleted_slug_list).delete()
+        for slug in deleted_slug_list:
+            self.verbose('node "%s" deleted' % layer_nodes[slug].name)
+
+        self.item_count = len(added_nodes) + len(changed_nodes) + len(unmodified_nodes)
 
         # message that will be returned
-        self.message = """
+        self.message = self.report(
+            added=len(added_nodes),
+            changed=len(changed_nodes),
+            deleted=len(deleted_slug_list),
+            unmodified=len(unmodified_nodes),
+            external=self.item_count
+        )
+
+    def report(self, added, changed, deleted, unmodified, external):
+        """ returns the report of the synchronization """
+        return """
             %s nodes added
             %s nodes changed
             %s nodes deleted
@@ -569,14 +772,143 @@ class GenericGisSynchronizer(HttpRetrieverMixin, BaseSynchronizer):
             %s total external records processed
             %s total local nodes for this layer
         """ % (
-            len(added_nodes),
-            len(changed_nodes),
-            deleted_nodes_count,
-            len(unmodified_nodes),
-            len(items),
+            added,
+            changed,
+            deleted,
+            unmodified,
+            external,
             Node.objects.filter(layer=self.layer).count()
         )
 
+    def get_not_modified_message(self):
+        """ nothing changed: all the records of the last synchronization are unmodified """
+        message = super(GenericGisSynchronizer, self).get_not_modified_message()
+        return '\n            %s%s' % (message, self.report(
+            added=0,
+            changed=0,
+            deleted=0,
+            unmodified=self.cache.item_count,
+            external=self.cache.item_count
+        ))
+
+    def _update_node(self, node, item, added):
+        """
+        copy the values of a converted item on a node instance
+        returns the set of the names of the fields which have changed
+        """
+        changed_fields = set()
+
+        # loop over fields and store data only if necessary
+        for field in Node._meta.fields:
+            # geometry is a special case, skip
+            if field.name == 'geometry':
+                continue
+            # skip if field is not present in values
+            if field.name not in item.keys():
+                continue
+            # shortcut for value
+            value = item[field.name]
+            # if value is different than what we have
+            if value is not None and getattr(node, field.name) != value:
+                # set value
+                setattr(node, field.name, value)
+                # indicates that a DB query is necessary
+                changed_fields.add(field.name)
+
+        if added or (node.geometry.equals(item['geometry']) is False
+                     and node.geometry.equals_exact(item['geometry']) is False):
+            node.geometry = item['geometry']
+            changed_fields.add('geometry')
+
+        node.data = node.data or {}
+
+        # store any additional key/value in HStore data field
+        for key, value in item['data'].items():
+            if node.data.get(key) != value:
+                node.data[key] = value
+                changed_fields.add('data')
+
+        return changed_fields
+
+    def _bulk_write(self, new_nodes, updates):
+        """
+        insert new nodes and update changed ones in batches of "batch_size"
+
+        Node.save is bypassed, hence no post_save signal is sent:
+        node_status_changed is sent for each node whose status has changed,
+        the links of moved nodes are drawn again and the caches maintained
+        by post_save receivers are invalidated explicitly,
+        while the following effects of saving nodes one by one are lost:
+         * rating counts and participation settings of new nodes are not created
+           (nodeshot.community.participation)
+         * changes are not pushed back to the external layer
+         * no post_save receiver added by other apps is called
+        for this reason bulk mode is disabled by default (NODESHOT_SYNC_BULK)
+
+        :param new_nodes: list of unsaved node instances
+        :param updates: list of (node, changed field names) tuples
+        """
+        for node in new_nodes:
+            # same as Node.save: a collection of 1 item becomes that item
+            if isinstance(node.geometry, GeometryCollection) and 0 < len(node.geometry) < 2:
+                node.geometry = node.geometry[0]
+
+        Node.objects.bulk_create(new_nodes, batch_size=self.batch_size)
+        self._bulk_update(updates)
+        self._send_status_changed(updates)
+        self._redraw_links(updates)
+
+        # post_save is not sent by bulk queries, clear cached pages once
+        if new_nodes or updates:
+            cache_delete_pattern_or_all('views.decorators.cache.cache*')
+            clear_tile_cache()
+            snapshots.outdate(snapshots.get_key(), snapshots.get_key(self.layer.id))
+
+    def _send_status_changed(self, updates):
+        """
+        sends node_status_changed for the updated nodes whose status has changed, like Node.save does
+
+        :param updates: list of (node, changed field names) tuples
+        """
+        # statuses loaded by _get_status
+        statuses = dict((status.id, status) for status in (self._statuses or {}).values())
+        for node, changed_fields in updates:
+            if 'status' not in changed_fields or not node._current_status or node.status_id == node._current_status:
+                continue
+            old_status = statuses.get(node._current_status) or Status.objects.get(pk=node._current_status)
+            node_status_changed.send(sender=Node, instance=node, old_status=old_status, new_status=node.status)
+            node._current_status = node.status_id
+
+    def _redraw_links(self, updates):
+        """
+        draws again the lines of the links of the updated nodes which have been moved,
+        like the post_save receiver of nodeshot.networking.links does
+
+        :param updates: list of (node, changed field names) tuples
+        """
+        if 'nodeshot.networking.links' not in settings.INSTALLED_APPS:
+            return
+        from nodeshot.networking.links.models import Link
+        from nodeshot.networking.links.cache import clear_geojson_cache
+        redrawn = [Link.redraw(node) for node, changed_fields in updates if 'geometry' in changed_fields]
+        if any(redrawn):
+            clear_geojson_cache()
+
+    def _bulk_update(self, updates):
+        """
+        write changed fields only, one transaction every "batch_size" rows
+        the "updated" date is set to the current time unless it is among the changed fields, like BaseDate.save does
+
+        :param updates: list of (instance, changed field names) tuples
+        """
+        for i in range(0, len(updates), self.batch_size):
+            with transaction.atomic():
+                for instance, changed_fields in updates[i:i + self.batch_size]:
+                    values = dict((name, getattr(instance, name)) for name in changed_fields)
+                    if 'updated' not in values and hasattr(instance, 'updated'):
+                        instance.updated = values['updated'] = now()
+                    instance.__class__.objects.filter(pk=instance.pk).update(**values)
+
 
 class XmlSynchronizer(HttpRetrieverMixin, XMLParserMixin, BaseSynchronizer):
     """ XML HTTP syncrhonizer """
@@ -1,5 +1,6 @@
 from __future__ import absolute_import
 
+from django.db import transaction
 from django.contrib.gis.geos import Point
 
 try:
@@ -8,10 +9,11 @@ try:
 except ImportError:
     raise ImportError('libcnml not installed, install it with "pip install libcnml"')
 
-from nodeshot.core.base.utils import check_dependencies
+from nodeshot.core.base.utils import check_dependencies, now
 from nodeshot.core.nodes.models import Node, Status
 from nodeshot.networking.net.models import Device, Interface, Ethernet, Wireless, Ip
 from nodeshot.networking.links.models import Link
+from nodeshot.networking.links.cache import clear_geojson_cache
 from nodeshot.networking.net.models.choices import INTERFACE_TYPES
 from nodeshot.networking.links.models.choices import LINK_TYPES, LINK_STATUS
 
@@ -31,6 +33,13 @@ class Cnml(GenericGisSynchronizer):
     """ CNML synchronizer """
     SCHEMA = GenericGisSynchronizer.SCHEMA[0:2]
 
+    EXTERNAL_IDS = [
+        ('nodes.Node', 'cnml_id'),
+        ('net.Device', 'cnml_id'),
+        ('net.Interface', 'cnml_id'),
+        ('links.Link', 'cnml_id')
+    ]
+
     STATUS_MAPPING = {
         'planned': {
             'is_default': True,
@@ -174,8 +183,17 @@ class Cnml(GenericGisSynchronizer):
         return d
 
     def save(self):
+        # computed before writing anything, rows deleted in cascade are not included
+        self.stale = self.get_stale()
+        self.verbose('STALE ROWS: %s' % ', '.join(
+            '%d %s' % (len(self.stale[key]), key) for key in ['devices', 'interfaces', 'links']
+        ))
         self.verbose('PARSING NODES')
         self.save_nodes()
+        # parent lookups of devices, interfaces and links are resolved
+        # in memory through these maps, which are keyed by cnml_id
+        self.node_map = self._cnml_map(Node.objects.filter(layer=self.layer, data__contains=['cnml_id'])
+                                                   .select_related('user'))
         self.verbose('PARSING DEVICES')
         self.save_devices()
         self.verbose('PARSING INTERFACES')
@@ -186,25 +204,130 @@ class Cnml(GenericGisSynchronizer):
     def save_nodes(self):
         super(Cnml, self).save()
 
+    def get_stale(self):
+        """
+        determines which devices, interfaces and links are not in the CNML anymore
+        by comparing the cnml_id of the rows of this layer with the ids of the CNML;
+        rows which are going to be deleted in cascade because their node, device or
+        interface is deleted are not included, nothing is written to the database,
+        hence the length of each set can be used as a dry-run count
+
+        :returns: dictionary of sets of primary keys, keys are "nodes", "devices", "interfaces", "links"
+        """
+        cnml_ids = {
+            'nodes': set(str(item.id) for item in self.cnml.getNodes()),
+            'devices': set(str(item.id) for item in self.cnml.getDevices()),
+            'interfaces': set(str(item.id) for item in self.cnml.getInterfaces()),
+            'links': set(str(item.id) for item in self.cnml.getLinks())
+        }
+        stale = {}
+
+        nodes = Node.objects.filter(layer=self.layer, data__contains=['cnml_id']).values_list('data', 'id')
+        stale['nodes'] = set(pk for data, pk in nodes if data['cnml_id'] not in cnml_ids['nodes'])
+
+        devices = Device.objects.filter(data__contains=['cnml_id'], node__layer=self.layer) \
+                                .values_list('data', 'id', 'node_id')
+        stale['devices'] = set()
+        deleted_devices = set()
+        for data, pk, node_id in devices:
+            if node_id in stale['nodes']:
+                deleted_devices.add(pk)
+            elif data['cnml_id'] not in cnml_ids['devices']:
+                stale['devices'].add(pk)
+        deleted_devices |= stale['devices']
+
+        interfaces = Interface.objects.filter(data__contains=['cnml_id'], device__node__layer=self.layer) \
+                                      .values_list('data', 'id', 'device_id')
+        stale['interfaces'] = set()
+        deleted_interfaces = set()
+        for data, pk, device_id in interfaces:
+            if device_id in deleted_devices:
+                deleted_interfaces.add(pk)
+            elif data['cnml_id'] not in cnml_ids['interfaces']:
+                stale['interfaces'].add(pk)
+        deleted_interfaces |= stale['interfaces']
+
+        links = Link.objects.filter(data__contains=['cnml_id'], layer=self.layer) \
+                            .values_list('data', 'id', 'node_a_id', 'node_b_id', 'interface_a_id', 'interface_b_id')
+        stale['links'] = set()
+        for data, pk, node_a_id, node_b_id, interface_a_id, interface_b_id in links:
+            if node_a_id in stale['nodes'] or node_b_id in stale['nodes'] or \
+               interface_a_id in deleted_interfaces or interface_b_id in deleted_interfaces:
+                continue
+            if data['cnml_id'] not in cnml_ids['links']:
+                stale['links'].add(pk)
+
+        return stale
+
+    def delete_stale(self, model, pks):
+        """
+        deletes the rows of model with a single query (and the related rows in cascade);
+        non critical signals are already paused by "sync"
+        """
+        if not pks:
+            return
+        with transaction.atomic():
+            model.objects.filter(pk__in=list(pks)).delete()
+
+    def _cnml_map(self, queryset):
+        """ returns a dictionary which maps the cnml_id of each object to the object itself """
+        return dict((obj.data['cnml_id'], obj) for obj in queryset)
+
+    def _update_fields(self, instance, values):
+        """
+        set the values which differ from the current ones
+
+        :param instance: model instance
+        :param values: dictionary of field names and new values
+        :returns: set of changed field names
+        """
+        changed_fields = set()
+        for name, value in values.items():
+            field = instance._meta.get_field(name)
+            # compare relations by primary key to avoid fetching them
+            if field.rel:
+                current = getattr(instance, field.attname)
+                value_pk = value.pk if value is not None else None
+                if current != value_pk:
+                    setattr(instance, name, value)
+                    changed_fields.add(name)
+                continue
+            value = field.to_python(value)
+            if getattr(instance, name) != value:
+                setattr(instance, name, value)
+                changed_fields.add(name)
+        return changed_fields
+
+    def _set_shortcuts(self, instance, node):
+        """ same shortcuts filled in by Device.save and Interface.save """
+        instance.shortcuts = {'layer': self.layer}
+        if node.user:
+            instance.shortcuts['user'] = node.user
+        if instance.__class__ is not Device:
+            instance.shortcuts['node'] = node
+
+    def _fill_link(self, link):
+        """
+        same as Link.save but without writing to the database,
+        nodes and interfaces are already loaded and the layer is known
+        :returns: set of changed field names
+        """
+        changed_fields = set()
+        if link.layer_id is None:
+            link.layer = self.layer
+            changed_fields.add('layer')
+        return changed_fields | link.fill()
+
     def save_devices(self):
         added_devices = []
-        deleted_devices = []
+        changed_devices = []
         cnml_devices = self.cnml.getDevices()
-        current_devices = Device.objects.filter(data__contains=['cnml_id'], node__layer=self.layer)
+        current_devices = self._cnml_map(Device.objects.filter(data__contains=['cnml_id'], node__layer=self.layer))
 
         total_n = len(cnml_devices)
         for n, cnml_device in enumerate(cnml_devices, 1):
-            try:
-                device = Device.objects.get(data={'cnml_id':  cnml_device.id})
-                added = False
-            except Device.DoesNotExist:
-                device = Device()
-                added = True
             self.verbose('[%d/%d] parsing device "%s" (node: %s)' % (n, total_n, cnml_device.title, cnml_device.parentNode.id))
-            node = Node.objects.get(data={'cnml_id': cnml_device.parentNode.id})
-            device.name = cnml_device.title,
-            device.node = node
-            device.type = cnml_device.type
+            node = self.node_map[str(cnml_device.parentNode.id)]
             if cnml_device.firmware:
                 try:
                     os, os_version = cnml_device.firmware.split('v')
@@ -215,171 +338,248 @@ class Cnml(GenericGisSynchronizer):
                 os = cnml_device.firmware
                 os_version = ''
 
-            device.os = os
-            device.os_version = os_version
-            device.data['cnml_id'] = cnml_device.id
-            device.full_clean()
-            device.save()
-
-            if added:
+            values = {
+                'name': cnml_device.title,
+                'node': node,
+                'type': cnml_device.type,
+                'os': os,
+                'os_version': os_version
+            }
+            device = current_devices.get(str(cnml_device.id))
+
+            if device is None:
+                device = Device(data={'cnml_id': str(cnml_device.id)}, **values)
+                device.location = node.point
+                device.elev = node.elev
+                self._set_shortcuts(device, node)
+                device.added = device.updated = now()
+                # node is known to exist, skip the query done to validate it
+                device.full_clean(exclude=['node'])
                 added_devices.append(device)
+                continue
+
+            changed_fields = self._update_fields(device, values)
+            if 'node' in changed_fields:
+                self._set_shortcuts(device, node)
+                changed_fields.add('shortcuts')
+            if changed_fields:
+                device.updated = now()
+                changed_fields.add('updated')
+                device.full_clean(exclude=['node'])
+                changed_devices.append((device, changed_fields))
+
+        Device.objects.bulk_create(added_devices, batch_size=self.batch_size)
+        self._bulk_update(changed_devices)
 
         # delete devices that are not in CNML anymore
-        total_n = len(current_devices)
-        for n, current_device in enumerate(current_devices, 1):
-            self.verbose('[%d/%d] deleting old devices' % (n, total_n))
-            try:
-                self.cnml.getDevice(int(current_device.data['cnml_id']))
-            except KeyError:
-                deleted_devices.append(current_device)
-                current_device.delete()
+        self.delete_stale(Device, self.stale['devices'])
+
+        # bulk_create does not set primary keys, read them back in one query
+        self.device_map = self._cnml_map(Device.objects.filter(data__contains=['cnml_id'], node__layer=self.layer)
+                                                       .select_related('node', 'node__user'))
 
         self.message += """
             %s devices added
             %s devices deleted
         """ % (
             len(added_devices),
-            len(deleted_devices)
+            len(self.stale['devices'])
         )
 
     def save_interfaces(self):
         added_interfaces = []
-        deleted_interfaces = []
+        changed_interfaces = []
         cnml_interfaces = self.cnml.getInterfaces()
-        current_interfaces = Interface.objects.filter(data__contains=['cnml_id'], device__node__layer=self.layer)
+        current_interfaces = {}
+        for Model in [Wireless, Ethernet]:
+            current_interfaces[Model] = self._cnml_map(Model.objects.filter(data__contains=['cnml_id'],
+                                                                            device__node__layer=self.layer))
+        # in CNML interfaces have always only 1 IP
+        addresses = [cnml_interface.ipv4 for cnml_interface in cnml_interfaces if cnml_interface.ipv4]
+        current_ips = dict((str(ip.address), ip) for ip in Ip.objects.filter(address__in=addresses))
+        ip_values = []
+        # used by save_links
+        self.interface_map = {}
 
         total_n = len(cnml_interfaces)
         for n, cnml_interface in enumerate(cnml_interfaces, 1):
             self.verbose('[%d/%d] parsing interface "%s" (%s)' % (n, total_n, cnml_interface.id, cnml_interface.ipv4))
             if hasattr(cnml_interface.parentRadio, 'parentDevice'):
                 Model = Wireless
-            else:
-                Model = Ethernet
-            try:
-                interface = Model.objects.get(data={'cnml_id':  cnml_interface.id})
-                added = False
-            except Model.DoesNotExist:
-                interface = Model()
-                added = True
-            if Model is Wireless:
                 parent = cnml_interface.parentRadio.parentDevice.id
+                values = {}
             else:
+                Model = Ethernet
                 parent = cnml_interface.parentRadio.id
-                interface.duplex = 'full'
-                interface.standard = 'fast'
-            device = Device.objects.get(data={'cnml_id': parent})
-            interface.type = INTERFACE_TYPES.get(Model.__name__.lower())
-            interface.device = device
-            interface.data['cnml_id'] = cnml_interface.id
-            interface.full_clean()
-            interface.save()
-
+                values = {'duplex': 'full', 'standard': 'fast'}
+            device = self.device_map[str(parent)]
+            values['device'] = device
+            interface = current_interfaces[Model].get(str(cnml_interface.id))
+
+            if interface is None:
+                interface = Model(data={'cnml_id': str(cnml_interface.id)}, **values)
+                interface.type = INTERFACE_TYPES.get(Model.__name__.lower())
+                self._set_shortcuts(interface, device.node)
+                interface.added = interface.updated = now()
+                interface.full_clean(exclude=['device'])
+                added_interfaces.append(interface)
+            else:
+                changed_fields = self._update_fields(interface, values)
+                if 'device' in changed_fields:
+                    self._set_shortcuts(interface, device.node)
+                    changed_fields.add('shortcuts')
+                if changed_fields:
+                    interface.updated = now()
+                    changed_fields.add('updated')
+                    interface.full_clean(exclude=['device'])
+                    changed_interfaces.append((interface, changed_fields))
+
+            self.interface_map[str(cnml_interface.id)] = interface
             if cnml_interface.ipv4:
-                # in CNML interfaces have always only 1 IP
-                try:
-                    ip = Ip.objects.get(address=cnml_interface.ipv4)
-                except Ip.DoesNotExist:
-                    ip = Ip()
-                ip.interface = interface
-                ip.address = cnml_interface.ipv4
-                ip.netmask = cnml_interface.mask
-                ip.full_clean()
-                ip.save()
+                ip_values.append((interface, cnml_interface.ipv4, cnml_interface.mask))
+
+        existing_pks = set(interface.pk for Model in current_interfaces
+                           for interface in current_interfaces[Model].values())
+        self._bulk_create_interfaces(added_interfaces, existing_pks)
+        self._bulk_update(changed_interfaces)
+
+        added_ips = []
+        changed_ips = []
+        for interface, address, netmask in ip_values:
+            values = {'interface': interface, 'netmask': netmask}
+            ip = current_ips.get(address)
+            # uniqueness of address is guaranteed by current_ips
+            if ip is None:
+                ip = Ip(address=address, **values)
+                ip.full_clean(exclude=['interface'], validate_unique=False)
+                ip.protocol = 'ipv%d' % ip.address.version
+                ip.added = ip.updated = now()
+                added_ips.append(ip)
+                current_ips[address] = ip
+                continue
+            changed_fields = self._update_fields(ip, values)
+            if changed_fields:
+                ip.updated = now()
+                changed_fields.add('updated')
+                ip.full_clean(exclude=['interface'], validate_unique=False)
+                changed_ips.append((ip, changed_fields))
 
-            if added:
-                added_interfaces.append(interface)
+        Ip.objects.bulk_create(added_ips, batch_size=self.batch_size)
+        self._bulk_update(changed_ips)
 
         # delete interfaces that are not in CNML anymore
-        total_n = len(current_interfaces)
-        for n, current_interface in enumerate(current_interfaces, 1):
-            self.verbose('[%d/%d] deleting old interfaces' % (n, total_n))
-            try:
-                self.cnml.getInterface(int(current_interface.data['cnml_id']))
-            except KeyError:
-                deleted_interfaces.append(current_interface)
-                current_interface.delete()
+        self.delete_stale(Interface, self.stale['interfaces'])
 
         self.message += """
             %s interfaces added
             %s interfaces deleted
         """ % (
             len(added_interfaces),
-            len(deleted_interfaces)
+            len(self.stale['interfaces'])
         )
 
+    def _bulk_create_interfaces(self, interfaces, existing_pks):
+        """
+        inserts new interfaces with a few queries per batch: bulk_create does not
+        support multi-table inheritance, hence the rows of the Interface table are
+        inserted first, their primary keys are read back and then the rows of the
+        tables of Wireless and Ethernet are inserted
+
+        :param interfaces: list of unsaved Wireless and Ethernet instances
+        :param existing_pks: primary keys of the interfaces which were already in the database
+        """
+        parent_fields = [field for field in Interface._meta.concrete_fields if not field.primary_key]
+        for i in range(0, len(interfaces), self.batch_size):
+            batch = interfaces[i:i + self.batch_size]
+            with transaction.atomic():
+                Interface.objects.bulk_create([
+                    Interface(**dict((field.attname, getattr(interface, field.attname)) for field in parent_fields))
+                    for interface in batch
+                ])
+                rows = Interface.objects.filter(device__in=set(interface.device_id for interface in batch),
+                                                data__contains=['cnml_id']) \
+                                        .exclude(pk__in=existing_pks) \
+                                        .values_list('id', 'device_id', 'data')
+                pks = dict(((device_id, data['cnml_id']), pk) for pk, device_id, data in rows)
+                for Model in [Wireless, Ethernet]:
+                    children = [interface for interface in batch if interface.__class__ is Model]
+                    if not children:
+                        continue
+                    for interface in children:
+                        interface.id = interface.interface_ptr_id = pks[(interface.device_id, interface.data['cnml_id'])]
+                        existing_pks.add(interface.id)
+                    Model._base_manager._insert(children, fields=Model._meta.local_concrete_fields,
+                                                using=Model._base_manager.db)
+
     def save_links(self):
         added_links = []
-        deleted_links = []
+        changed_links = []
         cnml_links = self.cnml.getLinks()
-        current_links = Link.objects.filter(data__contains=['cnml_id'], layer=self.layer)
-        # keep a list of link cnml_id
-        # TODO: hstore seems to not work properly, something is wrong
-        cnml_id_list = []
-        cnml_id_mapping = {}
-        for current_link in current_links:
-            cnml_id_list.append(current_link.data['cnml_id'])
-            cnml_id_mapping[current_link.data['cnml_id']] = current_link.id
+        current_links = self._cnml_map(Link.objects.filter(data__contains=['cnml_id'], layer=self.layer))
 
         total_n = len(cnml_links)
         for n, cnml_link in enumerate(cnml_links, 1):
-            if str(cnml_link.id) in cnml_id_list:
-                try:
-                    link_id = cnml_id_mapping[str(cnml_link.id)]
-                # probably a link between a node of another zone
-                except KeyError:
-                    continue
-                link = Link.objects.get(id=link_id)
-                added = False
-            else:
-                link = Link()
-                added = True
             # link between a node which is not of this CNML zone
             if isinstance(cnml_link.nodeA, int) or isinstance(cnml_link.nodeB, int):
                 continue
-            node_a = Node.objects.get(data={'cnml_id': cnml_link.nodeA.id})
-            node_b = Node.objects.get(data={'cnml_id': cnml_link.nodeB.id})
-            link.node_a = node_a
-            link.node_b = node_b
-            link.type = LINK_TYPES.get(self.LINK_TYPE_MAPPING[cnml_link.type])
-            link.status = LINK_STATUS.get(self.LINK_STATUS_MAPPING[cnml_link.status])
+            node_a = self.node_map[str(cnml_link.nodeA.id)]
+            node_b = self.node_map[str(cnml_link.nodeB.id)]
             self.verbose('[%d/%d] parsing link "%s" (%s<-->%s)' % (n, total_n, cnml_link.id, node_a, node_b))
+            values = {
+                'node_a': node_a,
+                'node_b': node_b,
+                'type': LINK_TYPES.get(self.LINK_TYPE_MAPPING[cnml_link.type]),
+                'status': LINK_STATUS.get(self.LINK_STATUS_MAPPING[cnml_link.status]),
+                'interface_a': None,
+                'interface_b': None
+            }
             # set interface_a and interface_b only if not planned
             # because there might be inconsistencies in the CNML from guifi.net
-            if link.get_status_display() != 'planned':
+            if values['status'] != LINK_STATUS.get('planned'):
                 if cnml_link.interfaceA:
-                    interface_a = Interface.objects.get(data={'cnml_id': cnml_link.interfaceA.id})
-                    link.interface_a = interface_a
+                    values['interface_a'] = self.interface_map[str(cnml_link.interfaceA.id)]
                 if cnml_link.interfaceB:
-                    interface_b = Interface.objects.get(data={'cnml_id': cnml_link.interfaceB.id})
-                    link.interface_b = interface_b
+                    values['interface_b'] = self.interface_map[str(cnml_link.interfaceB.id)]
+
+            link = current_links.get(str(cnml_link.id))
+            added = link is None
+
+            if added:
+                link = Link(data={'cnml_id': str(cnml_link.id)}, **values)
+                changed_fields = set(values.keys())
             else:
-                link.interface_a = None
-                link.interface_b = None
-            link.data['cnml_id'] = cnml_link.id
+                changed_fields = self._update_fields(link, values)
+
+            changed_fields |= self._fill_link(link)
+            if not changed_fields:
+                continue
             try:
-                link.full_clean()
+                link.full_clean(exclude=['node_a', 'node_b', 'interface_a', 'interface_b', 'layer', 'topology'])
             except Exception as e:
                 print(e)
                 continue
-            link.save()
 
+            link.updated = now()
             if added:
+                link.added = link.updated
                 added_links.append(link)
+            else:
+                changed_fields.add('updated')
+                changed_links.append((link, changed_fields))
+
+        Link.objects.bulk_create(added_links, batch_size=self.batch_size)
+        self._bulk_update(changed_links)
+        # bulk queries do not send post_save
+        if added_links or changed_links:
+            clear_geojson_cache()
 
         # delete links that are not in CNML anymore
-        total_n = len(current_links)
-        for n, current_link in enumerate(current_links, 1):
-            self.verbose('[%d/%d] deleting old links' % (n, total_n))
-            try:
-                self.cnml.getLink(int(current_link.data['cnml_id']))
-            except KeyError:
-                deleted_links.append(current_link)
-                current_link.delete()
+        self.delete_stale(Link, self.stale['links'])
 
         self.message += """
             %s links added
             %s links deleted
         """ % (
             len(added_links),
-            len(deleted_links)
+            len(self.stale['links'])
         )
@@ -1,15 +1,123 @@
 from __future__ import absolute_import
 
 import simplejson as json
-from django.contrib.gis.geos import GEOSGeometry
+from django.contrib.gis.geos import (GEOSGeometry, Point, LineString, Polygon, MultiPoint,
+                                     MultiLineString, MultiPolygon, GeometryCollection)
 from .base import GenericGisSynchronizer
 
 
+__all__ = ['JsonStream', 'geometry_from_geojson', 'GeoJson']
+
+
+class JsonStream(object):
+    """
+    Minimal incremental JSON reader
+    Reads a file-like object in chunks and decodes one value at a time
+    """
+    WHITESPACE = ' \t\n\r'
+
+    def __init__(self, stream, chunk_size=65536):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.position = 0
+        self.eof = False
+
+    def read(self):
+        """ read another chunk, returns False if the stream is over """
+        chunk = self.stream.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        # drop data which has already been consumed
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
+        return True
+
+    def peek(self):
+        """ returns the next non whitespace character without consuming it, empty string if stream is over """
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position] in self.WHITESPACE:
+                self.position += 1
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self.read():
+                return ''
+
+    def expect(self, char):
+        """ consume the next non whitespace character, which must be the one specified """
+        if self.peek() != char:
+            raise ValueError('expected "%s", got "%s"' % (char, self.peek()))
+        self.position += 1
+
+    def skip(self, char):
+        """ consume the next non whitespace character only if it is the one specified """
+        if self.peek() == char:
+            self.position += 1
+
+    def value(self):
+        """ decode and return the next JSON value """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+            except ValueError:
+                # value might be incomplete, try again with more data
+                if not self.read():
+                    raise
+                continue
+            # a number at the end of the buffer might be truncated
+            if end == len(self.buffer) and not self.eof and self.read():
+                continue
+            self.position = end
+            return value
+
+
+def geometry_from_geojson(geometry, srid=4326):
+    """
+    build a GEOSGeometry object straight from the coordinates of a GeoJSON geometry
+
+    :param geometry: python dictionary representing a GeoJSON geometry
+    """
+    geom_type = geometry['type']
+
+    if geom_type == 'GeometryCollection':
+        return GeometryCollection([geometry_from_geojson(g, srid) for g in geometry['geometries']], srid=srid)
+
+    coordinates = geometry['coordinates']
+
+    if geom_type == 'Point':
+        return Point(coordinates, srid=srid)
+    elif geom_type == 'LineString':
+        return LineString(coordinates, srid=srid)
+    elif geom_type == 'Polygon':
+        return Polygon(*coordinates, srid=srid)
+    elif geom_type == 'MultiPoint':
+        return MultiPoint([Point(c) for c in coordinates], srid=srid)
+    elif geom_type == 'MultiLineString':
+        return MultiLineString([LineString(c) for c in coordinates], srid=srid)
+    elif geom_type == 'MultiPolygon':
+        return MultiPolygon([Polygon(*c) for c in coordinates], srid=srid)
+    # let GEOS deal with anything else
+    return GEOSGeometry(json.dumps(geometry))
+
+
 class GeoJson(GenericGisSynchronizer):
-    """ GeoJSON synchronizer """
+    """
+    GeoJSON synchronizer
+
+    In streaming mode the "features" array is walked incrementally
+    and features are passed to "parse_item" one at a time.
+    """
+    SCHEMA = GenericGisSynchronizer.SCHEMA + [GenericGisSynchronizer.STREAMING_FIELD]
 
     def parse(self):
         """ parse geojson and ensure is collection """
+        if self.streaming:
+            self.parsed_data = self.iter_features()
+            return
+
         try:
             self.parsed_data = json.loads(self.data)
         except Exception as e:
@@ -20,6 +128,36 @@ class GeoJson(GenericGisSynchronizer):
 
         self.parsed_data = self.parsed_data['features']
 
+    def iter_features(self):
+        """ yields the features of the collection read from self.stream one by one """
+        reader = JsonStream(self.stream)
+        collection_type = None
+
+        try:
+            reader.expect('{')
+            while reader.peek() != '}':
+                key = reader.value()
+                reader.expect(':')
+                if key == 'features':
+                    if collection_type not in [None, 'FeatureCollection']:
+                        break
+                    reader.expect('[')
+                    while reader.peek() != ']':
+                        yield reader.value()
+                        reader.skip(',')
+                    reader.expect(']')
+                # other keys hold small values (type, crs, bbox)
+                elif key == 'type':
+                    collection_type = reader.value()
+                else:
+                    reader.value()
+                reader.skip(',')
+        except ValueError as e:
+            raise Exception('Error while converting response from JSON to python. %s' % e)
+
+        if collection_type != 'FeatureCollection':
+            raise Exception('GeoJson synchronizer expects a FeatureCollection object at root level')
+
     def parse_item(self, item):
         result = {
             "name": item['properties'].pop(self.keys['name'], ''),
@@ -27,7 +165,7 @@ class GeoJson(GenericGisSynchronizer):
             "address": item['properties'].pop(self.keys['address'], ''),
             "is_published": item['properties'].pop(self.keys['is_published'], True),
             "user": item['properties'].pop(self.keys['user'], None),
-            "geometry": GEOSGeometry(json.dumps(item['geometry'])),
+            "geometry": geometry_from_geojson(item['geometry']),
             "elev": item['properties'].pop(self.keys['elev'], None),
             "description": item['properties'].pop(self.keys['description'], ''),
             "notes": item['properties'].pop(self.keys['notes'], ''),
@@ -134,13 +134,20 @@ class GeoRss(XMLParserMixin, GenericGisSynchronizer):
                 'verbose_name': _('updated field'),
                 'help_text': _('corresponding updated field on external source')
             }
-        }
+        },
+        GenericGisSynchronizer.STREAMING_FIELD
     ]
 
     def key_mapping(self, ):
         key_map = self.field_mapping
 
-        if 'summary' in self.data:
+        # ATOM feeds (whose root element is "feed") use summary
+        if self.streaming:
+            is_atom = self.root_tag == 'feed'
+        else:
+            is_atom = 'summary' in self.data
+
+        if is_atom:
             description_default_key = 'summary'
         else:
             description_default_key = 'description'
@@ -164,6 +171,10 @@ class GeoRss(XMLParserMixin, GenericGisSynchronizer):
         super(GeoRss, self).parse()
 
         # support RSS and ATOM
+        if self.streaming:
+            self.item_tags = ['entry'] if self.root_tag == 'feed' else ['item']
+            return
+
         tag_name = 'item' if '<item>' in self.data else 'entry'
 
         self.parsed_data = self.parsed_data.getElementsByTagName(tag_name)
@@ -6,10 +6,14 @@ from .base import XMLParserMixin, GenericGisSynchronizer
 
 class OpenWisp(XMLParserMixin, GenericGisSynchronizer):
     """ OpenWisp GeoRSS synchronizer class """
+    SCHEMA = GenericGisSynchronizer.SCHEMA + [GenericGisSynchronizer.STREAMING_FIELD]
+    item_tags = ['item']
 
     def parse(self):
         """ parse data """
         super(OpenWisp, self).parse()
+        if self.streaming:
+            return
         self.parsed_data = self.parsed_data.getElementsByTagName('item')
 
     def parse_item(self, item):
@@ -7,7 +7,9 @@ from django.core import management
 def synchronize_external_layers(*args, **kwargs):
     """
     runs "python manage.py synchronize"
+    "workers" is ignored: celery workers are not allowed to start a pool of processes
     """
+    kwargs.pop('workers', None)
     management.call_command('sync', *args, **kwargs)
 
 
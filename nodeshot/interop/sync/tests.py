@@ -1,8 +1,16 @@
+import os
 import sys
+import time
+import tempfile
+import threading
+import simplejson as json
 
 from cStringIO import StringIO
+from unittest import skipUnless
 
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from django.core import management
 from django.core.urlresolvers import reverse
 from django.core.exceptions import ValidationError
@@ -11,10 +19,12 @@ from django.contrib.gis.geos import Point, GEOSGeometry
 from nodeshot.core.layers.models import Layer
 from nodeshot.core.nodes.models import Node, Status
 from nodeshot.core.base.tests import user_fixtures
+from nodeshot.core.base.utils import SlugAllocator
 
-from .models import LayerExternal, NodeExternal
+from .models import LayerExternal, LayerExternalCache, NodeExternal
 from .settings import settings, SYNCHRONIZERS
 from .tasks import synchronize_external_layers
+from .synchronizers import GeoJson
 
 
 TEST_FILES_PATH = '%snodeshot/testing' % settings.STATIC_URL
@@ -33,6 +43,80 @@ def capture_output(command, args=[], kwargs={}):
     return output.getvalue()
 
 
+def write_cnml(n):
+    """
+    writes a CNML file with n nodes, each one has a device with a wireless and
+    an ethernet interface, wireless interfaces of couples of nodes are linked
+
+    :returns: path of the file
+    """
+    nodes = []
+    for i in range(n):
+        peer = i + 1 if i % 2 == 0 else i - 1
+        nodes.append(
+            '<node id="{node}" title="node{i}" lat="43.{i:06d}" lon="-2.{i:06d}" antenna_elevation="15" '
+            'status="Working" created="20130115 0131" updated="20130117 0534">'
+            '<device id="{device}" title="device{i}" type="radio" status="Working" created="20130117 0429" '
+            'firmware="RouterOSv5.x" name="Routerboard 600">'
+            '<radio id="0" device_id="{device}" ssid="ssid{i}" mode="ap" protocol="802.11n" channel="5000" '
+            'antenna_angle="6" antenna_gain="25" clients_accepted="No" snmp_name="wlan1">'
+            '<interface id="{wireless}" type="wds/p2p" mac="00:00:00:00:00:01" ipv4="10.{a}.{b}.1" mask="255.255.255.248">'
+            '<link id="{link}" linked_device_id="{peer_device}" linked_node_id="{peer_node}" '
+            'linked_interface_id="{peer_wireless}" link_type="wds" link_status="Working"/>'
+            '</interface></radio>'
+            '<interface id="{ethernet}" type="Lan" mac="00:00:00:00:00:02" ipv4="10.{a}.{b}.2" mask="255.255.255.248"/>'
+            '</device></node>'.format(i=i, node=100000 + i, device=200000 + i, wireless=300000 + i,
+                                      ethernet=400000 + i, link=500000 + i // 2, a=i // 250, b=i % 250,
+                                      peer_node=100000 + peer, peer_device=200000 + peer,
+                                      peer_wireless=300000 + peer)
+        )
+    handle, path = tempfile.mkstemp(suffix='.xml')
+    with os.fdopen(handle, 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>'
+                '<cnml version="0.1" server_id="1" server_url="http://guifi.net" generated="20130210 0814">'
+                '<class network_description="detail" mapping="y"/><network>'
+                '<zone id="55284" parent_id="44279" title="Benchmark" created="20130113 0558" updated="20130116 0521">'
+                '%s</zone></network></cnml>' % ''.join(nodes))
+    return path
+
+
+class SlowGeoJson(GeoJson):
+    """ takes longer than the timeout used in tests """
+    def retrieve_data(self):
+        time.sleep(5)
+
+
+class InterruptedGeoJson(GeoJson):
+    """ saves the nodes, then takes longer than the timeout used in tests """
+    def save(self):
+        super(InterruptedGeoJson, self).save()
+        time.sleep(5)
+
+
+class BrokenGeoJson(GeoJson):
+    """ fails with an unexpected error """
+    def retrieve_data(self):
+        raise RuntimeError('broken synchronizer')
+
+
+def set_external(layer, synchronizer_path, url, test_synchronizer_path=None):
+    """
+    configures layer as an external layer,
+    test_synchronizer_path is a subclass of synchronizer_path which is not among the choices of the field
+    """
+    layer.is_external = True
+    layer.new_nodes_allowed = False
+    layer.save()
+    external = LayerExternal(layer=layer)
+    external.synchronizer_path = synchronizer_path
+    external._reload_schema()
+    external.url = url
+    external.full_clean()
+    external.save()
+    if test_synchronizer_path:
+        LayerExternal.objects.filter(pk=external.pk).update(synchronizer_path=test_synchronizer_path)
+
+
 class SyncTest(TestCase):
     fixtures = [
         'initial_data.json',
@@ -92,6 +176,96 @@ class SyncTest(TestCase):
         )
         self.assertIn('no layers to process', output)
 
+    def test_management_command_workers(self):
+        """ test --workers and --timeout """
+        output = capture_output(
+            management.call_command,
+            ['sync'],
+            {'exclude': 'vienna,test', 'workers': 4}
+        )
+        self.assertIn('no layers to process', output)
+
+        from .management.commands.sync import Command
+        command = Command()
+        command.verbosity = 0
+        command.stdout = StringIO()
+        status = command.sync_layer(Layer.objects.get(slug='vienna'), timeout=60)
+        self.assertEqual(status, 'skipped')
+        self.assertIn('does not have a synchronizer class specified', command.stdout.getvalue())
+
+    def test_management_command_timeout(self):
+        """ test --timeout """
+        set_external(Layer.objects.get(slug='vienna'),
+                     'nodeshot.interop.sync.synchronizers.GeoJson',
+                     '%s/geojson1.json' % TEST_FILES_PATH,
+                     test_synchronizer_path='nodeshot.interop.sync.tests.SlowGeoJson')
+        start = time.time()
+        output = capture_output(
+            management.call_command,
+            ['sync', 'vienna'],
+            {'timeout': 1, 'verbosity': 0}
+        )
+        self.assertLess(time.time() - start, 5)
+        self.assertIn('Layer "vienna" timed out after 1 seconds', output)
+        self.assertIn('0 layers synchronized, 0 skipped, 0 failed, 1 timed out', output)
+        self.assertIn('timeout: vienna', output)
+
+    def test_management_command_timeout_rollback(self):
+        """ changes of layers which time out are rolled back """
+        layer = Layer.objects.get(slug='vienna')
+        set_external(layer,
+                     'nodeshot.interop.sync.synchronizers.GeoJson',
+                     '%s/geojson1.json' % TEST_FILES_PATH,
+                     test_synchronizer_path='nodeshot.interop.sync.tests.InterruptedGeoJson')
+        count = layer.node_set.count()
+        output = capture_output(
+            management.call_command,
+            ['sync', 'vienna'],
+            {'timeout': 1, 'verbosity': 0}
+        )
+        self.assertIn('Layer "vienna" timed out after 1 seconds', output)
+        self.assertEqual(layer.node_set.count(), count)
+
+    def test_management_command_timeout_in_thread(self):
+        """ timeouts are ignored outside of the main thread """
+        from .management.commands.sync import Command
+        command = Command()
+        command.verbosity = 0
+        command.stdout = StringIO()
+        layer = Layer.objects.get(slug='vienna')
+        statuses = []
+
+        def sync_layer():
+            try:
+                statuses.append(command.sync_layer(layer, timeout=60))
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=sync_layer)
+        thread.start()
+        thread.join()
+        self.assertEqual(statuses, ['skipped'])
+        self.assertIn('--timeout ignored', command.stdout.getvalue())
+
+    def test_management_command_failure(self):
+        """ errors of a layer are reported in the summary, the remaining layers are synchronized """
+        set_external(Layer.objects.get(slug='vienna'),
+                     'nodeshot.interop.sync.synchronizers.GeoJson',
+                     '%s/geojson1.json' % TEST_FILES_PATH,
+                     test_synchronizer_path='nodeshot.interop.sync.tests.BrokenGeoJson')
+        set_external(Layer.objects.get(slug='rome'),
+                     'nodeshot.interop.sync.synchronizers.GeoRss',
+                     '%s/georss-simple.xml' % TEST_FILES_PATH)
+        output = capture_output(
+            management.call_command,
+            ['sync', 'vienna', 'rome'],
+            {'verbosity': 0}
+        )
+        self.assertIn('broken synchronizer', output)
+        self.assertIn('3 nodes added', output)
+        self.assertIn('1 layers synchronized, 0 skipped, 1 failed, 0 timed out', output)
+        self.assertIn('failed: vienna', output)
+
     def test_celery_task(self):
         """ ensure celery task works as expected """
         output = capture_output(synchronize_external_layers.apply)
@@ -108,6 +282,15 @@ class SyncTest(TestCase):
         )
         self.assertIn('no layers to process', output)
 
+    def test_celery_task_with_workers(self):
+        """ celery workers can't start a pool of processes, layers are synchronized one at a time """
+        output = capture_output(
+            synchronize_external_layers.apply,
+            kwargs={'kwargs': {'workers': 2}}
+        )
+        self.assertIn('does not have a synchronizer class specified', output)
+        self.assertIn('0 layers synchronized, 1 skipped', output)
+
     def test_celery_task_with_error(self):
         try:
             synchronize_external_layers.apply(['wrongvalue'])
@@ -370,6 +553,261 @@ class SyncTest(TestCase):
         self.assertIn('2 total external', output)
         self.assertIn('2 total local', output)
 
+    def test_geojson_streaming(self):
+        """ test GeoJSON sync with streaming parser """
+        layer = Layer.objects.external()[0]
+        layer.new_nodes_allowed = False
+        layer.save()
+        layer = Layer.objects.get(pk=layer.pk)
+
+        external = LayerExternal(layer=layer)
+        external.synchronizer_path = 'nodeshot.interop.sync.synchronizers.GeoJson'
+        external._reload_schema()
+        external.url = '%s/geojson1.json' % TEST_FILES_PATH
+        external.streaming = True
+        external.full_clean()
+        external.save()
+
+        output = capture_output(
+            management.call_command,
+            ['sync', 'vienna'],
+            kwargs={'verbosity': 0}
+        )
+
+        self.assertIn('2 nodes added', output)
+        self.assertIn('2 total external', output)
+        self.assertIn('2 total local', output)
+
+        node = Node.objects.get(slug='simplegeojson')
+        self.assertIn('simplegeojson', node.address)
+        self.assertEqual(node.geometry.geom_type, 'Polygon')
+        self.assertEqual(node.elev, 10.0)
+
+        # repeat with the non streaming parser, nothing should change
+        external.streaming = False
+        external.full_clean()
+        external.save()
+
+        output = capture_output(
+            management.call_command,
+            ['sync', 'vienna'],
+            kwargs={'verbosity': 0}
+        )
+
+        self.assertIn('2 nodes unmodified', output)
+        self.assertIn('0 nodes changed', output)
+
+    def test_geojson_not_modified(self):
+        """ second sync of identical data is skipped """
+        layer = Layer.objects.external()[0]
+        layer.new_nodes_allowed = False
+        layer.save()
+        layer = Layer.objects.get(pk=layer.pk)
+
+        external = LayerExternal(layer=layer)
+        external.synchronizer_path = 'nodeshot.interop.sync.synchronizers.GeoJson'
+        external._reload_schema()
+        external.url = '%s/geojson1.json' % TEST_FILES_PATH
+        external.full_clean()
+        external.save()
+
+        output = capture_output(
+            management.call_command,
+            ['sync', 'vienna'],
+            kwargs={'verbosity': 0}
+        )
+        self.assertIn('2 nodes added', output)
+        self.assertNotIn('layer skipped', output)
+
+        cache = LayerExternalCache.objects.get(layer_external=external)
+        self.assertEqual(cache.url, external.url)
+        self.assertEqual(len(cache.digest), 40)
+        self.assertEqual(cache.item_count, 2)
+
+        output = capture_output(
+            management.call_command,
+            ['sync', 'vienna'],
+            kwargs={'verbosity': 0}
+        )
+        self.assertIn('layer skipped', output)
+        self.assertIn('2 nodes unmodified', output)
+        self.assertIn('2 total external', output)
+        self.assertIn('2 total local', output)
+
+        # configuration changed: data must be applied again
+        external.default_status = 'active'
+        external.full_clean()
+        external.save()
+        output = capture_output(
+            management.call_command,
+            ['sync', 'vienna'],
+            kwargs={'verbosity': 0}
+        )
+        self.assertNotIn('layer skipped', output)
+
+        # nodes edited locally: data must be applied again
+        node = Node.objects.get(slug='simplegeojson')
+        node.name = 'edited locally'
+        node.save()
+        output = capture_output(
+            management.call_command,
+            ['sync', 'vienna'],
+            kwargs={'verbosity': 0}
+        )
+        self.assertNotIn('layer skipped', output)
+        self.assertTrue(Node.objects.filter(slug='simplegeojson').exists())
+
+        # nothing changed since the last synchronization
+        output = capture_output(
+            management.call_command,
+            ['sync', 'vienna'],
+            kwargs={'verbosity': 0}
+        )
+        self.assertIn('layer skipped', output)
+
+    def test_convert_item_lookup_caches(self):
+        from .synchronizers import GeoJson
+        layer = Layer.objects.external()[0]
+        external = LayerExternal(layer=layer)
+        external.synchronizer_path = 'nodeshot.interop.sync.synchronizers.GeoJson'
+        external._reload_schema()
+        external.url = '%s/geojson1.json' % TEST_FILES_PATH
+        external.full_clean()
+        external.save()
+
+        synchronizer = GeoJson(layer)
+        synchronizer._reset_lookup_caches()
+
+        # statuses are loaded with one query
+        with self.assertNumQueries(1):
+            self.assertEqual(synchronizer._get_status('ACTIVE').slug, 'active')
+            self.assertEqual(synchronizer._get_status('planned').slug, 'planned')
+            self.assertEqual(synchronizer._get_status('wrong').slug, 'potential')
+            self.assertEqual(synchronizer._get_status(None).slug, 'potential')
+
+        # missing users are remembered too
+        with self.assertNumQueries(2):
+            for i in range(3):
+                self.assertEqual(synchronizer._get_user('admin').username, 'admin')
+                self.assertIsNone(synchronizer._get_user('idonotexist'))
+
+        date = synchronizer._parse_date('2013-07-10T12:00:00Z')
+        self.assertIs(synchronizer._parse_date('2013-07-10T12:00:00Z'), date)
+
+    def test_geojson_json_stream(self):
+        from .synchronizers.geojson import JsonStream, geometry_from_geojson
+        reader = JsonStream(StringIO('  {"a": [1, 23.5, "text"], "b": null}'), chunk_size=2)
+        reader.expect('{')
+        self.assertEqual(reader.value(), 'a')
+        reader.expect(':')
+        self.assertEqual(reader.value(), [1, 23.5, 'text'])
+        reader.skip(',')
+        self.assertEqual(reader.value(), 'b')
+        reader.expect(':')
+        self.assertIsNone(reader.value())
+        reader.expect('}')
+        self.assertEqual(reader.peek(), '')
+
+        for geometry in [
+            {"type": "Point", "coordinates": [12.5, 41.9]},
+            {"type": "LineString", "coordinates": [[12.5, 41.9], [12.6, 41.8]]},
+            {"type": "Polygon", "coordinates": [[[12.5, 41.9], [12.6, 41.8], [12.4, 41.8], [12.5, 41.9]]]},
+            {"type": "MultiPoint", "coordinates": [[12.5, 41.9], [12.6, 41.8]]},
+            {"type": "MultiLineString", "coordinates": [[[12.5, 41.9], [12.6, 41.8]]]},
+            {"type": "MultiPolygon", "coordinates": [[[[12.5, 41.9], [12.6, 41.8], [12.4, 41.8], [12.5, 41.9]]]]},
+            {"type": "GeometryCollection", "geometries": [{"type": "Point", "coordinates": [12.5, 41.9]}]}
+        ]:
+            expected = GEOSGeometry(json.dumps(geometry))
+            self.assertTrue(geometry_from_geojson(geometry).equals_exact(expected))
+
+    def _test_geojson_sync_mode(self, bulk, batch_size):
+        """ run GeoJSON sync twice with the specified bulk settings """
+        from .synchronizers import GeoJson
+        layer = Layer.objects.external()[0]
+        layer.new_nodes_allowed = False
+        layer.save()
+        layer = Layer.objects.get(pk=layer.pk)
+
+        external = LayerExternal(layer=layer)
+        external.synchronizer_path = 'nodeshot.interop.sync.synchronizers.GeoJson'
+        external._reload_schema()
+        external.url = '%s/geojson1.json' % TEST_FILES_PATH
+        external.full_clean()
+        external.save()
+
+        original_bulk, original_batch_size = GeoJson.bulk, GeoJson.batch_size
+        GeoJson.bulk, GeoJson.batch_size = bulk, batch_size
+
+        try:
+            output = capture_output(
+                management.call_command,
+                ['sync', 'vienna'],
+                kwargs={'verbosity': 0}
+            )
+            self.assertIn('2 nodes added', output)
+            self.assertIn('2 total local', output)
+            self.assertEqual(layer.node_set.count(), 2)
+
+            external.url = '%s/geojson2.json' % TEST_FILES_PATH
+            external.full_clean()
+            external.save()
+            updated = Node.objects.get(slug='simplegeojson').updated
+
+            output = capture_output(
+                management.call_command,
+                ['sync', 'vienna'],
+                kwargs={'verbosity': 0}
+            )
+            self.assertIn('1 nodes unmodified', output)
+            self.assertIn('1 nodes changed', output)
+            self.assertIn('0 nodes deleted', output)
+            self.assertIn('2 total local', output)
+            # the external data does not contain dates
+            self.assertGreater(Node.objects.get(slug='simplegeojson').updated, updated)
+        finally:
+            GeoJson.bulk, GeoJson.batch_size = original_bulk, original_batch_size
+
+    def test_geojson_sync_bulk_small_batches(self):
+        self._test_geojson_sync_mode(bulk=True, batch_size=1)
+
+    def test_geojson_sync_without_bulk(self):
+        self._test_geojson_sync_mode(bulk=False, batch_size=1)
+
+    def test_geojson_sync_status_changed(self):
+        """ node_status_changed is sent in bulk mode too """
+        from nodeshot.core.nodes.signals import node_status_changed
+
+        for bulk in [True, False]:
+            Node.objects.filter(layer__slug='vienna').delete()
+            LayerExternal.objects.filter(layer__slug='vienna').delete()
+            set_external(Layer.objects.get(slug='vienna'),
+                         'nodeshot.interop.sync.synchronizers.GeoJson',
+                         '%s/geojson1.json' % TEST_FILES_PATH)
+            original_bulk = GeoJson.bulk
+            GeoJson.bulk = bulk
+            changes = []
+
+            def status_changed(sender, **kwargs):
+                changes.append((kwargs['instance'].slug, kwargs['old_status'].slug, kwargs['new_status'].slug))
+
+            try:
+                capture_output(management.call_command, ['sync', 'vienna'], {'verbosity': 0})
+                node_status_changed.connect(status_changed, dispatch_uid='test_sync_status_changed')
+                external = LayerExternal.objects.get(layer__slug='vienna')
+                external.default_status = 'active'
+                external.full_clean()
+                external.save()
+                output = capture_output(management.call_command, ['sync', 'vienna'], {'verbosity': 0})
+            finally:
+                node_status_changed.disconnect(dispatch_uid='test_sync_status_changed')
+                GeoJson.bulk = original_bulk
+
+            self.assertIn('2 nodes changed', output)
+            self.assertEqual(sorted(changes), [
+                ('simplegeojson', 'potential', 'active'),
+                ('simplegeojson2', 'potential', 'active')
+            ])
+
     def test_preexisting_name(self):
         """ test preexisting names """
         layer = Layer.objects.external()[0]
@@ -522,6 +960,69 @@ class SyncTest(TestCase):
         self.assertIn('3 total external', output)
         self.assertIn('3 total local', output)
 
+    def test_georss_streaming(self):
+        """ test GeoRSS simple with streaming parser """
+        layer = Layer.objects.external()[0]
+        layer.new_nodes_allowed = False
+        layer.save()
+        layer = Layer.objects.get(pk=layer.pk)
+
+        url = '%s/georss-simple.xml' % TEST_FILES_PATH
+
+        external = LayerExternal(layer=layer)
+        external.synchronizer_path = 'nodeshot.interop.sync.synchronizers.GeoRss'
+        external._reload_schema()
+        external.config = {"url": url, "streaming": True}
+        external.full_clean()
+        external.save()
+
+        output = capture_output(
+            management.call_command,
+            ['sync', 'vienna'],
+            kwargs={'verbosity': 0}
+        )
+
+        # ensure following text is in output
+        self.assertIn('3 nodes added', output)
+        self.assertIn('0 nodes changed', output)
+        self.assertIn('3 total external', output)
+        self.assertIn('3 total local', output)
+
+        node = Node.objects.get(slug='item-2')
+        self.assertEqual(node.name, 'item 2')
+        self.assertEqual(node.updated.strftime('%Y-%m-%d'), '2006-08-17')
+        geometry = GEOSGeometry('POINT (-70.92 44.256)')
+        self.assertTrue(node.geometry.equals_exact(geometry) or node.geometry.equals(geometry))
+
+    def test_openwisp_streaming(self):
+        """ test OpenWisp synchronizer with streaming parser """
+        layer = Layer.objects.external()[0]
+        layer.new_nodes_allowed = False
+        layer.save()
+        layer = Layer.objects.get(pk=layer.pk)
+
+        external = LayerExternal(layer=layer)
+        external.synchronizer_path = 'nodeshot.interop.sync.synchronizers.OpenWisp'
+        external._reload_schema()
+        external.url = '%s/openwisp-georss.xml' % TEST_FILES_PATH
+        external.streaming = True
+        external.full_clean()
+        external.save()
+
+        output = capture_output(
+            management.call_command,
+            ['sync', 'vienna'],
+            kwargs={'verbosity': 0}
+        )
+
+        self.assertIn('43 nodes added', output)
+        self.assertIn('43 total external', output)
+        self.assertIn('43 total local', output)
+
+        node = Node.objects.get(slug='podesta1-ced')
+        self.assertEqual(node.address, 'Test WISP')
+        self.assertTrue(node.geometry.equals(Point(8.96166, 44.4185)))
+
     def test_georss_w3c(self):
         """ test GeoRSS w3c """
         layer = Layer.objects.external()[0]
@@ -711,10 +1212,17 @@ class SyncTest(TestCase):
         # check interfaces
         device = Device.objects.get(data={'cnml_id': 49635})
         self.assertEqual(device.interface_set.count(), 3)
+        self.assertFalse(device.name.startswith('('))
+        self.assertEqual(device.shortcuts['layer'], layer)
+        self.assertEqual(device.location, device.node.point)
         self.assertIn('21 interfaces added', output)
         self.assertEqual(Ip.objects.count(), ip_count + 21)
         # check links
         self.assertEqual(Link.objects.count(), link_count + 9)
+        link = Link.objects.filter(layer=layer)[0]
+        self.assertIsNotNone(link.line)
+        self.assertEqual(link.data['layer_slug'], layer.slug)
+        self.assertEqual(link.data['node_a_name'], link.node_a.name)
 
         # --- repeat with different XML --- #
 
@@ -723,6 +1231,15 @@ class SyncTest(TestCase):
         external.full_clean()
         external.save()
 
+        # dry-run counts, nothing is deleted yet
+        synchronizer = Cnml(layer, verbosity=0)
+        synchronizer.parse()
+        stale = synchronizer.get_stale()
+        self.assertEqual(len(stale['nodes']), 0)
+        self.assertEqual(len(stale['devices']), 2)
+        self.assertEqual(len(stale['interfaces']), 1)
+        self.assertEqual(Device.objects.filter(node__layer=layer).count(), 12)
+
         output = capture_output(
             management.call_command,
             ['sync', 'vienna'],
@@ -745,3 +1262,115 @@ class SyncTest(TestCase):
         self.assertIn('0 interfaces added', output)
         self.assertIn('1 interfaces deleted', output)
         self.assertEqual(Ip.objects.count(), ip_count + 18)
+
+    @skipUnless(os.environ.get('NODESHOT_BENCHMARK'), 'set NODESHOT_BENCHMARK=1 to run benchmarks')
+    def test_cnml_benchmark(self):
+        """ imports 2000 nodes with 2 interfaces each, then imports them again without changes """
+        from nodeshot.interop.sync.synchronizers import Cnml
+        from nodeshot.networking.net.models import Interface
+        n = 2000
+        path = write_cnml(n)
+        layer = Layer.objects.external()[0]
+        layer.new_nodes_allowed = False
+        layer.save()
+        external = LayerExternal(layer=layer)
+        external.synchronizer_path = 'nodeshot.interop.sync.synchronizers.Cnml'
+        external._reload_schema()
+        external.config = {'url': path}
+        external.full_clean()
+        external.save()
+
+        try:
+            for label in ['first import', 'second import']:
+                synchronizer = Cnml(Layer.objects.get(pk=layer.pk), verbosity=0)
+                synchronizer.parse()
+                synchronizer.before_start()
+                start = time.time()
+                with CaptureQueriesContext(connection) as queries:
+                    synchronizer.save()
+                print('\n%s of %d nodes: %.3fs, %d queries' % (label, n, time.time() - start, len(queries)))
+        finally:
+            os.remove(path)
+
+        self.assertEqual(Interface.objects.filter(device__node__layer=layer).count(), n * 2)
+
+    def test_external_id_indexes(self):
+        from django.db import connection
+        from nodeshot.core.base import external_ids
+        from nodeshot.networking.net.models import Device
+        from .models import register_external_ids
+        register_external_ids()
+        self.assertIn(('data', 'cnml_id'), external_ids.registry['net.device'])
+        external_ids.ensure_indexes()
+        cursor = connection.cursor()
+        cursor.execute('SELECT indexname FROM pg_indexes')
+        indexes = [row[0] for row in cursor.fetchall()]
+        self.assertIn('net_device_data_cnml_id_idx', indexes)
+        self.assertIn('net_device_data_gin', indexes)
+        self.assertIn('nodes_node_data_cnml_id_idx', indexes)
+        # calling it again does not do anything
+        self.assertEqual(external_ids.ensure_indexes(), [])
+        # lookup by external id
+        node = Node.objects.all()[0]
+        node.data['cnml_id'] = '55349'
+        node.save()
+        self.assertEqual(list(Node.objects.by_external_id('cnml_id', 55349)), [node])
+        self.assertEqual(Node.objects.filter(layer=node.layer).by_external_id('cnml_id', '55349').count(), 1)
+        self.assertEqual(Node.objects.by_external_id('cnml_id', 1).count(), 0)
+        self.assertEqual(Device.objects.by_external_id('cnml_id', 1).count(), 0)
+        # chainable on querysets of every hstore manager
+        from nodeshot.networking.connectors.models import DeviceConnector
+        self.assertEqual(DeviceConnector.objects.filter(pk__gt=0).by_external_id('cnml_id', 1).count(), 0)
+
+
+class SlugAllocatorTest(TestCase):
+    def test_allocate(self):
+        allocator = SlugAllocator(['taken'])
+        self.assertEqual(allocator.allocate('free'), ('free', 'free'))
+        self.assertEqual(allocator.allocate('free'), ('free - 2', 'free-2'))
+        self.assertEqual(allocator.allocate('Taken'), ('Taken - 2', 'taken-2'))
+        self.assertIn('taken-2', allocator)
+        allocator.add('free-3')
+        self.assertEqual(allocator.allocate('free'), ('free - 4', 'free-4'))
+
+    def test_allocate_flat_cost(self):
+        """ the number of slugs tried per item must not grow with the number of items """
+        calls = []
+
+        def counting_slugify(value):
+            calls.append(value)
+            return value.lower().replace(' ', '-')
+
+        for n in [1000, 100000]:
+            del calls[:]
+            allocator = SlugAllocator(slugify=counting_slugify)
+            for i in range(n):
+                allocator.allocate('duplicated name')
+            self.assertEqual(len(allocator.taken), n)
+            self.assertLessEqual(len(calls) / float(n), 2)
+
+
+class SyncWorkersTest(TransactionTestCase):
+    """ layers are synchronized by child processes which must see the data of the test """
+    fixtures = SyncTest.fixtures
+
+    def test_management_command_workers_pool(self):
+        """ test --workers with two layers """
+        set_external(Layer.objects.get(slug='vienna'),
+                     'nodeshot.interop.sync.synchronizers.GeoJson',
+                     '%s/geojson1.json' % TEST_FILES_PATH)
+        set_external(Layer.objects.get(slug='rome'),
+                     'nodeshot.interop.sync.synchronizers.GeoRss',
+                     '%s/georss-simple.xml' % TEST_FILES_PATH)
+        output = capture_output(
+            management.call_command,
+            ['sync', 'vienna', 'rome'],
+            {'workers': 2, 'verbosity': 0}
+        )
+        self.assertIn('Processing layer "vienna"', output)
+        self.assertIn('2 nodes added', output)
+        self.assertIn('Processing layer "rome"', output)
+        self.assertIn('3 nodes added', output)
+        self.assertIn('2 layers synchronized, 0 skipped, 0 failed, 0 timed out', output)
+        self.assertEqual(Node.objects.filter(layer__slug='vienna').count(), 2)
+        self.assertEqual(Node.objects.filter(layer__slug='rome').count(), 3)
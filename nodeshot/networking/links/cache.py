@@ -0,0 +1,20 @@
+"""
+caching of the link GeoJSON list and of the vector tiles
+"""
+from nodeshot.core.base.cache import get_generation, bump_generation
+from nodeshot.core.layers.tiles import clear_tile_cache
+
+
+def get_geojson_generation():
+    """ generation of the cached link GeoJSON lists, part of their cache keys """
+    return get_generation('LinkGeoJSONList')
+
+
+def clear_geojson_cache():
+    """
+    outdates the cached GeoJSON lists, other cached items are not affected,
+    must be called whenever links are changed with bulk queries, which do not send signals
+    """
+    bump_generation('LinkGeoJSONList')
+    # links are drawn in the vector tiles too
+    clear_tile_cache()
@@ -0,0 +1,261 @@
+"""
+In-memory representation of the network made of active links
+
+Nodes are represented by their ids, the weight of each edge is
+the metric value of the link (the lowest one if the nodes are
+connected by more than one link).
+
+Access levels of links and nodes are kept in the graph: algorithms accept
+a "max_level" argument which excludes the links and nodes with a higher
+access level (and unpublished nodes), None means no restriction.
+
+The graph is loaded lazily from the database, kept up to date on link
+saves and deletions and reloaded after NODESHOT_LINKS_GRAPH_TTL seconds,
+since links can also be changed by other processes or by bulk queries.
+"""
+import time
+import heapq
+from threading import RLock
+
+from .models.choices import LINK_STATUS
+from .settings import GRAPH_TTL
+
+
+__all__ = ['NetworkGraph', 'network_graph']
+
+
+class NetworkGraph(object):
+    # weight used for links which do not have a metric value
+    DEFAULT_WEIGHT = 1.0
+
+    def __init__(self, ttl=GRAPH_TTL):
+        self.ttl = ttl
+        self.lock = RLock()
+        self.loaded_at = None
+        self.clear()
+
+    def clear(self):
+        # node id: set of neighbour node ids
+        self.adjacency = {}
+        # node id: access level, None if the node is not published
+        self.nodes = {}
+        # link id: (node a id, node b id)
+        self.links = {}
+        # (lower node id, higher node id): {link id: (weight, access level)}
+        self.edges = {}
+        # max level: set of node ids
+        self._articulation_points = {}
+
+    def invalidate(self):
+        """ the graph will be reloaded on next access """
+        self.loaded_at = None
+
+    def ensure_loaded(self):
+        if self.loaded_at is None or time.time() - self.loaded_at > self.ttl:
+            self.load()
+
+    def load(self):
+        """ loads all the active links and the access levels of their nodes with a single query """
+        from .models import Link  # avoid circular dependency
+        queryset = Link.objects.filter(status=LINK_STATUS['active'],
+                                       node_a__isnull=False,
+                                       node_b__isnull=False) \
+                               .values_list('id', 'node_a_id', 'node_b_id', 'metric_value', 'access_level',
+                                            'node_a__access_level', 'node_a__is_published',
+                                            'node_b__access_level', 'node_b__is_published')
+        with self.lock:
+            self.clear()
+            for row in queryset:
+                link_id, node_a_id, node_b_id, metric_value, access_level = row[0:5]
+                self.nodes[node_a_id] = self._node_level(*row[5:7])
+                self.nodes[node_b_id] = self._node_level(*row[7:9])
+                self._add(link_id, node_a_id, node_b_id, metric_value, access_level)
+            self.loaded_at = time.time()
+
+    def _node_level(self, access_level, is_published):
+        return access_level if is_published else None
+
+    def _is_accessible(self, access_level, max_level):
+        return max_level is None or (access_level is not None and access_level <= max_level)
+
+    def _add(self, link_id, node_a_id, node_b_id, metric_value, access_level=0):
+        # loops are meaningless for routing
+        if node_a_id == node_b_id:
+            return
+        weight = metric_value if metric_value is not None else self.DEFAULT_WEIGHT
+        self.links[link_id] = (node_a_id, node_b_id)
+        self.edges.setdefault(self._key(node_a_id, node_b_id), {})[link_id] = (weight, access_level)
+        self._update_edge(node_a_id, node_b_id)
+
+    def _remove(self, link_id):
+        if link_id not in self.links:
+            return
+        node_a_id, node_b_id = self.links.pop(link_id)
+        key = self._key(node_a_id, node_b_id)
+        del self.edges[key][link_id]
+        if not self.edges[key]:
+            del self.edges[key]
+        self._update_edge(node_a_id, node_b_id)
+
+    def _key(self, node_a_id, node_b_id):
+        return (min(node_a_id, node_b_id), max(node_a_id, node_b_id))
+
+    def _update_edge(self, node_a_id, node_b_id):
+        """ adds the nodes to the adjacency of each other or removes them if they are not linked anymore """
+        links = self.edges.get(self._key(node_a_id, node_b_id))
+        for source, target in [(node_a_id, node_b_id), (node_b_id, node_a_id)]:
+            if links:
+                self.adjacency.setdefault(source, set()).add(target)
+            elif source in self.adjacency:
+                self.adjacency[source].discard(target)
+                if not self.adjacency[source]:
+                    del self.adjacency[source]
+        self._articulation_points = {}
+
+    def _neighbours(self, node, max_level):
+        """
+        yields (neighbour, weight) tuples of the accessible neighbours of node,
+        the weight is the lowest one of the accessible links
+        """
+        for neighbour in self.adjacency[node]:
+            if not self._is_accessible(self.nodes.get(neighbour, 0), max_level):
+                continue
+            weights = [weight for weight, access_level in self.edges[self._key(node, neighbour)].itervalues()
+                       if self._is_accessible(access_level, max_level)]
+            if weights:
+                yield neighbour, min(weights)
+
+    def update_link(self, link):
+        """ updates the graph incrementally after a link has been saved """
+        if self.loaded_at is None:
+            return
+        active = link.status == LINK_STATUS['active'] and link.node_a_id and link.node_b_id
+        missing = [node_id for node_id in (link.node_a_id, link.node_b_id) if node_id not in self.nodes]
+        if active and missing:
+            from nodeshot.core.nodes.models import Node
+            levels = Node.objects.filter(id__in=missing).values_list('id', 'access_level', 'is_published')
+        else:
+            levels = []
+        with self.lock:
+            for node_id, access_level, is_published in levels:
+                self.nodes[node_id] = self._node_level(access_level, is_published)
+            self._remove(link.pk)
+            if active:
+                self._add(link.pk, link.node_a_id, link.node_b_id, link.metric_value, link.access_level)
+
+    def update_node(self, node):
+        """ updates the access level of a node after it has been saved """
+        if self.loaded_at is None or node.pk not in self.nodes:
+            return
+        with self.lock:
+            self.nodes[node.pk] = self._node_level(node.access_level, node.is_published)
+            self._articulation_points = {}
+
+    def remove_link(self, link_id):
+        """ updates the graph incrementally after a link has been deleted """
+        if self.loaded_at is None:
+            return
+        with self.lock:
+            self._remove(link_id)
+
+    def shortest_path(self, source, target, max_level=None):
+        """
+        Dijkstra's algorithm
+        :returns: tuple of list of node ids and total cost, (None, None) if target is not reachable
+        """
+        self.ensure_loaded()
+        with self.lock:
+            if source not in self.adjacency or target not in self.adjacency:
+                return None, None
+            distances = {source: 0}
+            previous = {}
+            queue = [(0, source)]
+            visited = set()
+            while queue:
+                distance, node = heapq.heappop(queue)
+                if node in visited:
+                    continue
+                if node == target:
+                    break
+                visited.add(node)
+                for neighbour, weight in self._neighbours(node, max_level):
+                    new_distance = distance + weight
+                    if neighbour not in distances or new_distance < distances[neighbour]:
+                        distances[neighbour] = new_distance
+                        previous[neighbour] = node
+                        heapq.heappush(queue, (new_distance, neighbour))
+            if target not in distances:
+                return None, None
+            path = [target]
+            while path[-1] != source:
+                path.append(previous[path[-1]])
+            path.reverse()
+            return path, distances[target]
+
+    def reachable(self, source, max_level=None):
+        """ returns set of node ids reachable from source (source excluded) """
+        self.ensure_loaded()
+        with self.lock:
+            if source not in self.adjacency:
+                return set()
+            visited = set([source])
+            stack = [source]
+            while stack:
+                for neighbour, weight in self._neighbours(stack.pop(), max_level):
+                    if neighbour not in visited:
+                        visited.add(neighbour)
+                        stack.append(neighbour)
+            visited.remove(source)
+            return visited
+
+    def articulation_points(self, max_level=None):
+        """
+        returns the set of node ids whose failure would split the network (iterative Tarjan's algorithm),
+        the result is cached for each max_level until the graph changes
+        """
+        self.ensure_loaded()
+        with self.lock:
+            if max_level in self._articulation_points:
+                return self._articulation_points[max_level]
+            points = set()
+            discovery = {}
+            low = {}
+            counter = 0
+
+            def neighbours(node):
+                return (neighbour for neighbour, weight in self._neighbours(node, max_level))
+
+            for root in self.adjacency:
+                if root in discovery or not self._is_accessible(self.nodes.get(root, 0), max_level):
+                    continue
+                discovery[root] = low[root] = counter
+                counter += 1
+                root_children = 0
+                stack = [(root, None, neighbours(root))]
+                while stack:
+                    node, parent, neighbours = stack[-1]
+                    for neighbour in neighbours:
+                        if neighbour == parent:
+                            continue
+                        if neighbour in discovery:
+                            low[node] = min(low[node], discovery[neighbour])
+                            continue
+                        discovery[neighbour] = low[neighbour] = counter
+                        counter += 1
+                        if node == root:
+                            root_children += 1
+                        stack.append((neighbour, node, neighbours(neighbour)))
+                        break
+                    else:
+                        stack.pop()
+                        if parent is not None:
+                            low[parent] = min(low[parent], low[node])
+                            if parent != root and low[node] >= discovery[parent]:
+                                points.add(parent)
+                if root_children > 1:
+                    points.add(root)
+            self._articulation_points[max_level] = points
+            return points
+
+
+network_graph = NetworkGraph()
@@ -17,10 +17,12 @@ check_dependencies(
 
 from .link import Link
 from .topology import Topology
+from .link_sample import LinkSample
 
 __all__ = [
     'Link',
-    'Topology'
+    'Topology',
+    'LinkSample'
 ]
 
 # ------ Add relationship to NodeDetailSerializer ------ #
@@ -32,3 +34,69 @@ ExtensibleNodeSerializer.add_relationship(**{
     'view_name': 'api_node_links',
     'lookup_field': 'slug'
 })
+
+
+# ------ Add links to the vector tiles ------ #
+
+from nodeshot.core.layers.models import Layer
+from nodeshot.core.layers.tiles import register, column_sql, slug_sql
+from .choices import LINK_STATUS
+
+register(
+    'links',
+    lambda user: Link.objects.accessible_to(user),
+    'line',
+    [
+        ('status', 'CASE %s %s END' % (column_sql(Link, 'status'), ' '.join(['WHEN %s THEN %s'] * len(LINK_STATUS))),
+         [value for item in LINK_STATUS.items() for value in reversed(item)]),
+        ('layer', slug_sql(Link, 'layer', Layer), []),
+    ]
+)
+
+
+# ------ Keep in-memory network graph and cached GeoJSON and tiles up to date ------ #
+
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.contrib.gis.geos import GEOSGeometry
+
+from nodeshot.core.nodes.models import Node
+
+from ..graph import network_graph
+from ..cache import clear_geojson_cache
+
+
+@receiver(post_save, sender=Link, dispatch_uid='update_network_graph')
+def update_network_graph(sender, **kwargs):
+    network_graph.update_link(kwargs['instance'])
+
+
+@receiver(post_delete, sender=Link, dispatch_uid='remove_link_from_network_graph')
+def remove_link_from_network_graph(sender, **kwargs):
+    network_graph.remove_link(kwargs['instance'].pk)
+
+
+@receiver(post_save, sender=Node, dispatch_uid='update_node_in_network_graph')
+def update_node_in_network_graph(sender, **kwargs):
+    network_graph.update_node(kwargs['instance'])
+
+
+@receiver(post_save, sender=Node, dispatch_uid='redraw_links_of_moved_node')
+def redraw_links_of_moved_node(sender, **kwargs):
+    node = kwargs['instance']
+    previous = node._current_geometry
+    node._current_geometry = node.geometry
+    if kwargs['created'] or previous is None or node.geometry is None:
+        return
+    if not isinstance(previous, GEOSGeometry):
+        previous = GEOSGeometry(previous)
+    if previous.equals_exact(node.geometry):
+        return
+    if Link.redraw(node):
+        clear_geojson_cache()
+
+
+@receiver(post_save, sender=Link, dispatch_uid='clear_link_geojson_cache_on_save')
+@receiver(post_delete, sender=Link, dispatch_uid='clear_link_geojson_cache_on_delete')
+def clear_link_geojson_cache(sender, **kwargs):
+    clear_geojson_cache()
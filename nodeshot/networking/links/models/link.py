@@ -2,6 +2,7 @@ from django.contrib.gis.db import models
 from django.contrib.gis.geos import LineString
 from django.utils.translation import ugettext_lazy as _
 from django.core.exceptions import ValidationError
+from django.db import connections
 from django.db.models import Q
 
 from django_hstore.fields import DictionaryField, ReferencesField
@@ -20,6 +21,7 @@ from nodeshot.networking.net.models.choices import INTERFACE_TYPES
 from .choices import METRIC_TYPES, LINK_STATUS, LINK_TYPES
 from .topology import Topology
 from ..exceptions import LinkDataNotFound, LinkNotFound
+from ..quality import get_quality, get_quality_sql
 
 
 class Link(BaseAccessLevel):
@@ -65,6 +67,9 @@ class Link(BaseAccessLevel):
     metric_type = models.CharField(_('metric type'), max_length=6,
                                    choices=choicify(METRIC_TYPES), blank=True, null=True)
     metric_value = models.FloatField(_('metric value'), blank=True, null=True)
+    # denormalized, see nodeshot.networking.links.quality
+    quality = models.SmallIntegerField(_('quality'), default=0, editable=False,
+                                       help_text=_('from 1 (worst) to 6 (best), 0 means unknown'))
     max_rate = models.IntegerField(_('Maximum BPS'), null=True, default=None, blank=True)
     min_rate = models.IntegerField(_('Minimum BPS'), null=True, default=None, blank=True)
 
@@ -82,6 +87,13 @@ class Link(BaseAccessLevel):
 
     class Meta:
         app_label = 'links'
+        # cursor pagination of the API
+        index_together = [['updated', 'id']]
+
+    def __init__(self, *args, **kwargs):
+        """ keep track of the relations of existing links """
+        super(Link, self).__init__(*args, **kwargs)
+        self._current_relations = self._get_relations() if self.pk else None
 
     def __unicode__(self):
         return _(u'%s <> %s') % (self.node_a_name, self.node_b_name)
@@ -116,53 +128,142 @@ class Link(BaseAccessLevel):
             * automatically fill 'node_a' and 'node_b' fields if necessary
             * draw line between two nodes
             * fill shortcut properties node_a_name and node_b_name
+            * calculate quality
+        """
+        self.fill()
+        super(Link, self).save(*args, **kwargs)
+        self._current_relations = self._get_relations()
+
+    def _get_relations(self):
+        return (self.interface_a_id, self.interface_b_id, self.node_a_id, self.node_b_id, self.layer_id)
+
+    def fill(self):
+        """
+        Fills the fields which are computed automatically (see save).
+        Related objects are used only if the relations have changed
+        or if the information they provide is missing, objects
+        which are already loaded are not retrieved again.
+
+        Bulk writes can call this method on each link
+        and then use bulk_create or update instead of save.
+
+        :returns: set of names of the changed fields
         """
-        if not self.type:
+        changed = set()
+        # None for new links
+        initial = self._current_relations
+
+        if not self.type and self.interface_a_id:
             if self.interface_a.type == INTERFACE_TYPES.get('wireless'):
                 self.type = LINK_TYPES.get('radio')
             elif self.interface_a.type == INTERFACE_TYPES.get('ethernet'):
                 self.type = LINK_TYPES.get('ethernet')
             else:
                 self.type = LINK_TYPES.get('virtual')
-
-        if self.interface_a_id:
-            self.interface_a = Interface.objects.get(pk=self.interface_a_id)
-        if self.interface_b_id:
-            self.interface_b = Interface.objects.get(pk=self.interface_b_id)
+            changed.add('type')
 
         # fill in node_a and node_b
-        if self.node_a is None and self.interface_a is not None:
-            self.node_a = self.interface_a.node
-        if self.node_b is None and self.interface_b is not None:
-            self.node_b = self.interface_b.node
+        if self.node_a_id is None and self.interface_a_id:
+            self.node_a = self._get_interface_node(self.interface_a)
+            changed.add('node_a')
+        if self.node_b_id is None and self.interface_b_id:
+            self.node_b = self._get_interface_node(self.interface_b)
+            changed.add('node_b')
 
         # fill layer from node_a
-        if self.layer is None:
+        if self.layer_id is None:
             self.layer = self.node_a.layer
+            changed.add('layer')
+
+        relations = self._get_relations()
+        nodes_changed = initial is None or initial[2:4] != relations[2:4]
 
-        # draw linestring
-        if not self.line:
+        # draw linestring, again if nodes have changed
+        if not self.line or (initial is not None and nodes_changed):
             self.line = LineString(self.node_a.point, self.node_b.point)
+            changed.add('line')
 
         # fill properties
-        if self.data.get('node_a_name', None) is None:
-            self.data['node_a_name'] = self.node_a.name
-            self.data['node_b_name'] = self.node_b.name
-
-        if self.data.get('node_a_slug', None) is None or self.data.get('node_b_slug', None) is None:
-            self.data['node_a_slug'] = self.node_a.slug
-            self.data['node_b_slug'] = self.node_b.slug
-
-        if self.interface_a and self.data.get('interface_a_mac', None) is None:
-            self.data['interface_a_mac'] = self.interface_a.mac
-
-        if self.interface_b and self.data.get('interface_b_mac', None) is None:
-            self.data['interface_b_mac'] = self.interface_b.mac
+        data = dict(self.data or {})
+        if nodes_changed or None in [data.get('node_a_name'), data.get('node_b_name'),
+                                     data.get('node_a_slug'), data.get('node_b_slug')]:
+            data['node_a_name'] = self.node_a.name
+            data['node_b_name'] = self.node_b.name
+            data['node_a_slug'] = self.node_a.slug
+            data['node_b_slug'] = self.node_b.slug
+
+        for index, end in enumerate(['a', 'b']):
+            key = 'interface_%s_mac' % end
+            if relations[index] and (initial is None or initial[index] != relations[index] or data.get(key) is None):
+                data[key] = getattr(self, 'interface_%s' % end).mac
+
+        if initial is None or initial[4] != relations[4] or data.get('layer_slug') is None:
+            data['layer_slug'] = self.layer.slug
+
+        if data != self.data:
+            self.data = data
+            changed.add('data')
+
+        quality = get_quality(self.metric_type, self.metric_value)
+        if quality != self.quality:
+            self.quality = quality
+            changed.add('quality')
+
+        return changed
+
+    def _get_interface_node(self, interface):
+        """
+        returns the node of interface through its device if it has already
+        been loaded (eg: with select_related), otherwise through the shortcuts
+        """
+        if hasattr(interface, interface._meta.get_field('device').get_cache_name()):
+            return interface.device.node
+        return interface.node
 
-        if self.data.get('layer_slug') != self.layer.slug:
-            self.data['layer_slug'] = self.layer.slug
+    @classmethod
+    def redraw(cls, node):
+        """
+        draws again the lines of the links of node, to be called when the node is moved;
+        lines are written with an update query per link, post_save is not sent
+        :returns: number of redrawn links
+        """
+        links = cls.objects.filter(Q(node_a=node) | Q(node_b=node)).select_related('node_a', 'node_b')
+        count = 0
+        for link in links:
+            # the instance which has just been saved is more recent than the loaded one
+            node_a = node if link.node_a_id == node.pk else link.node_a
+            node_b = node if link.node_b_id == node.pk else link.node_b
+            line = LineString(node_a.point, node_b.point)
+            if link.line and link.line.equals_exact(line):
+                continue
+            cls.objects.filter(pk=link.pk).update(line=line)
+            count += 1
+        return count
 
-        super(Link, self).save(*args, **kwargs)
+    @classmethod
+    def update_quality(cls, queryset=None):
+        """
+        recalculates the quality of the links of queryset (all links if not specified)
+        with a single UPDATE query, to be used after bulk updates of metric values
+        :returns: number of updated links
+        """
+        if queryset is None:
+            queryset = cls.objects.all()
+        connection = connections[queryset.db]
+        quote = connection.ops.quote_name
+        meta = cls._meta
+        case, params = get_quality_sql(quote(meta.get_field('metric_type').column),
+                                       quote(meta.get_field('metric_value').column))
+        subquery, subquery_params = queryset.values('pk').query.sql_with_params()
+        cursor = connection.cursor()
+        cursor.execute('UPDATE %s SET %s = %s WHERE %s IN (%s)' % (
+            quote(meta.db_table),
+            quote(meta.get_field('quality').column),
+            case,
+            quote(meta.pk.column),
+            subquery
+        ), params + list(subquery_params))
+        return cursor.rowcount
 
     @classmethod
     def get_link(cls, source, target, topology=None):
@@ -265,18 +366,6 @@ class Link(BaseAccessLevel):
     def layer_slug(self):
         return self.data.get('layer_slug', None)
 
-    @property
-    def quality(self):
-        """
-        Quality is a number between 1 and 6 that rates the quality of the link.
-        The way quality is calculated might be overridden by settings.
-        0 means unknown
-        """
-        if self.metric_value is None:
-            return 0
-        # PLACEHOLDER
-        return 6
-
     def ensure(self, status, weight):
         """
         ensure link properties correspond to the specified ones
@@ -0,0 +1,115 @@
+from datetime import datetime, timedelta
+
+from django.db import models, transaction
+from django.db.models import Avg, Min
+from django.utils.timezone import utc
+from django.utils.translation import ugettext_lazy as _
+
+from nodeshot.core.base.utils import now, choicify
+
+from .choices import LINK_STATUS
+from ..settings import LINK_METRICS_RESOLUTION
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=utc)
+
+
+class LinkSample(models.Model):
+    """
+    Value of the metric and status of a link at a given time
+    Raw samples are appended at each topology update (resolution 0)
+    and periodically downsampled in averages of "resolution" seconds
+    """
+    link = models.ForeignKey('links.Link', verbose_name=_('link'), related_name='samples')
+    timestamp = models.DateTimeField(_('timestamp'))
+    metric_value = models.FloatField(_('metric value'), blank=True, null=True)
+    status = models.SmallIntegerField(_('status'), choices=choicify(LINK_STATUS))
+    # 0 means raw sample, otherwise the number of seconds of the averaged period
+    resolution = models.PositiveIntegerField(_('resolution'), default=0)
+
+    class Meta:
+        app_label = 'links'
+        db_table = 'links_link_sample'
+        # series are always retrieved by link, resolution and time range
+        index_together = [['link', 'resolution', 'timestamp']]
+
+    def __unicode__(self):
+        return u'%s %s' % (self.link_id, self.timestamp)
+
+    @staticmethod
+    def _bucket(interval):
+        """ SQL expression which truncates the timestamp to the period of interval seconds it belongs to """
+        interval = int(interval)
+        return 'to_timestamp(floor(extract(epoch from "links_link_sample"."timestamp") / %d) * %d)' % (interval, interval)
+
+    @classmethod
+    def record(cls, links, timestamp=None, batch_size=1000):
+        """
+        appends a raw sample for each one of the specified links
+        :param links: Link queryset
+        :returns: number of samples recorded
+        """
+        timestamp = timestamp or now()
+        samples = [cls(link_id=pk, timestamp=timestamp, metric_value=metric_value, status=status)
+                   for pk, metric_value, status in links.values_list('id', 'metric_value', 'status')]
+        cls.objects.bulk_create(samples, batch_size=batch_size)
+        return len(samples)
+
+    @classmethod
+    def series(cls, link_ids, since, until, interval):
+        """
+        returns the samples of the specified links averaged in periods of interval seconds
+        the status of each period is the worst one (lowest value)
+
+        raw samples and the ones downsampled by the periodic task cover different periods, hence
+        both are used whatever the interval is (downsampled samples are the only ones of older periods);
+        filtering on resolution allows the time range to be looked up in the
+        (link, resolution, timestamp) index instead of scanning the whole history of the links
+
+        :returns: dict in which keys are link ids and values are lists of dicts (time, metric_value, status)
+        """
+        rows = cls.objects.filter(link__in=link_ids,
+                                  resolution__in=[0, LINK_METRICS_RESOLUTION],
+                                  timestamp__gte=since,
+                                  timestamp__lte=until) \
+                          .extra(select={'time': cls._bucket(interval)}) \
+                          .values('link', 'time') \
+                          .annotate(avg_metric_value=Avg('metric_value'), min_status=Min('status')) \
+                          .order_by('link', 'time')
+        status_names = dict((value, key) for key, value in LINK_STATUS.items())
+        series = dict((link_id, []) for link_id in link_ids)
+        for row in rows:
+            series[row['link']].append({
+                'time': row['time'],
+                'metric_value': row['avg_metric_value'],
+                'status': status_names.get(row['min_status'])
+            })
+        return series
+
+    @classmethod
+    def downsample(cls, older_than, resolution, retention=None):
+        """
+        replaces raw samples older than the specified date with their averages
+        in periods of resolution seconds; downsampled data older than retention is deleted
+        :param older_than: datetime, truncated to a multiple of resolution
+        :param resolution: seconds
+        :param retention: optional datetime
+        :returns: number of raw samples which have been downsampled
+        """
+        # buckets which are only partially older than "older_than" are left for the next run
+        seconds = (older_than - EPOCH).total_seconds()
+        older_than -= timedelta(seconds=seconds % resolution)
+        raw = cls.objects.filter(resolution=0, timestamp__lt=older_than)
+        rows = raw.extra(select={'time': cls._bucket(resolution)}) \
+                  .values('link', 'time') \
+                  .annotate(avg_metric_value=Avg('metric_value'), min_status=Min('status')) \
+                  .order_by()
+        with transaction.atomic():
+            samples = [cls(link_id=row['link'], timestamp=row['time'], metric_value=row['avg_metric_value'],
+                           status=row['min_status'], resolution=resolution) for row in rows]
+            count = raw.count()
+            raw.delete()
+            cls.objects.bulk_create(samples, batch_size=1000)
+            if retention:
+                cls.objects.filter(resolution__gt=0, timestamp__lt=retention).delete()
+        return count
@@ -3,16 +3,20 @@ from collections import OrderedDict
 
 from netdiff import NetJsonParser
 from netdiff import diff
+from netaddr import IPAddress, EUI, valid_ipv4, valid_ipv6, valid_mac
 
+from django.db import transaction
 from django.contrib.gis.db import models
 from django.utils.translation import ugettext_lazy as _
 from django.utils.module_loading import import_by_path
 from django.core.exceptions import ValidationError
 
 from nodeshot.core.base.models import BaseDate
+from nodeshot.core.base.utils import now
 
-from ..settings import PARSERS
+from ..settings import PARSERS, LINK_METRICS_HISTORY
 from ..exceptions import LinkDataNotFound
+from .choices import LINK_STATUS
 
 logger = logging.getLogger('nodeshot.networking')
 
@@ -48,34 +52,44 @@ class Topology(BaseDate):
     def latest(self):
         return self.parser(self.url, timeout=5)
 
-    def diff(self):
-        """ shortcut to netdiff.diff """
-        latest = self.latest
+    def diff(self, latest=None):
+        """
+        shortcut to netdiff.diff
+
+        :param latest: parser instance returned by "latest", retrieved now if not specified
+        """
+        if latest is None:
+            latest = self.latest
         current = NetJsonParser(self.json())
         return diff(current, latest)
 
     def json(self):
-        """ returns a dict that represents a NetJSON NetworkGraph object """
+        """
+        returns a dict that represents a NetJSON NetworkGraph object
+
+        Links, interfaces and ip addresses are retrieved with
+        a constant number of queries regardless of the number of links
+        """
+        if self.is_layer2:
+            endpoints = self._get_mac_endpoints()
+        else:
+            endpoints = self._get_ip_endpoints()
+
         nodes = []
         links = []
+        node_ids = set()
 
-        for link in self.link_set.all():
-            if self.is_layer2:
-                source = link.interface_a.mac
-                destination = link.interface_b.mac
-            else:
-                source = str(link.interface_a.ip_set.first().address)
-                destination = str(link.interface_b.ip_set.first().address)
-            nodes.append({
-                'id': source
-            })
-            nodes.append({
-                'id': destination
-            })
+        for source, destination, weight in endpoints:
+            for node_id in (source, destination):
+                if node_id not in node_ids:
+                    node_ids.add(node_id)
+                    nodes.append({
+                        'id': node_id
+                    })
             links.append(OrderedDict((
                 ('source', source),
                 ('target', destination),
-                ('weight', link.metric_value)
+                ('weight', weight)
             )))
 
         return OrderedDict((
@@ -87,34 +101,213 @@ class Topology(BaseDate):
             ('links', links)
         ))
 
-    def update(self):
+    def _get_mac_endpoints(self):
+        """ returns a list of (mac of interface_a, mac of interface_b, metric value) tuples, 1 query """
+        from nodeshot.networking.net.models import Interface
+        to_python = Interface._meta.get_field('mac').to_python
+        links = self.link_set.filter(interface_a__isnull=False, interface_b__isnull=False).order_by('pk') \
+                             .values_list('interface_a__mac', 'interface_b__mac', 'metric_value')
+        return [(to_python(mac_a), to_python(mac_b), weight) for mac_a, mac_b, weight in links]
+
+    def _get_ip_endpoints(self):
+        """
+        returns a list of (first ip of interface_a, first ip of interface_b, metric value) tuples;
+        links of which one interface has no ip address are skipped, 3 queries
+        """
+        from nodeshot.networking.net.models import Ip
+        to_python = Ip._meta.get_field('address').to_python
+        links = list(self.link_set.filter(interface_a__isnull=False, interface_b__isnull=False).order_by('pk')
+                                  .values_list('interface_a_id', 'interface_b_id', 'metric_value'))
+        # first ip address (lowest primary key) of each interface, like ip_set.first()
+        addresses = {}
+        for lookup in ['interface__link_interface_from__topology', 'interface__link_interface_to__topology']:
+            queryset = Ip.objects.filter(**{lookup: self}).order_by('pk').values_list('interface_id', 'address')
+            for interface_id, address in queryset:
+                addresses.setdefault(interface_id, str(to_python(address)))
+        return [(addresses[interface_a_id], addresses[interface_b_id], weight)
+                for interface_a_id, interface_b_id, weight in links
+                if interface_a_id in addresses and interface_b_id in addresses]
+
+    def update(self, latest=None):
         """
         Updates topology
         Links are not deleted straightaway but set as "disconnected"
+
+        :param latest: parser instance returned by "latest", retrieved now if not specified
+        :returns: see apply_diff
+        """
+        return self.apply_diff(self.diff(latest))
+
+    def apply_diff(self, diff):
+        """
+        Writes the differences returned by "diff" (or pushed by a collector) in a single transaction
+
+        Addresses are resolved to interfaces with 1 query for ip addresses and 1 for mac addresses,
+        existing links are retrieved with 1 query and changes are written with bulk updates
+
+        :param diff: dict with "added", "removed" and "changed" keys, each one
+                     is either None or a NetJSON NetworkGraph dict containing "links"
+        :returns: dict with the number of links processed for each key and the list of errors
         """
         from .link import Link  # avoid circular dependency
-        diff = self.diff()
+        from .link_sample import LinkSample
 
         status = {
             'added': 'active',
             'removed': 'disconnected',
             'changed': 'active'
         }
+        result = OrderedDict((
+            ('added', 0),
+            ('removed', 0),
+            ('changed', 0),
+            ('errors', [])
+        ))
 
+        entries = []
         for section in ['added', 'removed', 'changed']:
             # section might be empty
-            if not diff[section]:
+            if not diff.get(section):
                 continue
             for link_dict in diff[section]['links']:
+                entries.append((section, link_dict))
+
+        with transaction.atomic():
+            addresses = set()
+            for section, link_dict in entries:
+                addresses.update([link_dict['source'], link_dict['target']])
+            interfaces = self._get_interfaces(addresses)
+            links = self._get_links(interfaces.values())
+            new_links = OrderedDict()
+            changed_links = OrderedDict()
+
+            for section, link_dict in entries:
                 try:
-                    link = Link.get_or_create(source=link_dict['source'],
-                                              target=link_dict['target'],
-                                              weight=link_dict['weight'],
-                                              topology=self)
-                except (LinkDataNotFound, ValidationError) as e:
+                    link = self._get_or_create_link(link_dict, interfaces, links)
+                except (LinkDataNotFound, ValidationError, ValueError) as e:
                     msg = 'Exception while updating {0}'.format(self.__repr__())
                     logger.exception(msg)
                     print('{0}\n{1}\n'.format(msg, e))
+                    result['errors'].append('{0} - {1}: {2}'.format(link_dict['source'], link_dict['target'], e))
                     continue
-                link.ensure(status=status[section],
-                            weight=link_dict['weight'])
+                result[section] += 1
+                # same as Link.ensure but changes are written all together afterwards
+                status_id = LINK_STATUS[status[section]]
+                if link.pk is None:
+                    link.status = status_id
+                    link.metric_value = link_dict['weight']
+                    new_links[(link.interface_a_id, link.interface_b_id)] = link
+                elif link.status != status_id or link.metric_value != link_dict['weight']:
+                    link.status = status_id
+                    link.metric_value = link_dict['weight']
+                    changed_links[link.pk] = link
+
+            # new links are inserted with a single query, post_save is not sent
+            for link in new_links.values():
+                link.fill()
+                link.added = link.updated = now()
+            Link.objects.bulk_create(new_links.values())
+
+            # links which end up with the same values are updated with a single query
+            groups = OrderedDict()
+            for link in changed_links.values():
+                groups.setdefault((link.status, link.metric_value), []).append(link.pk)
+            for (status_id, weight), pks in groups.items():
+                Link.objects.filter(pk__in=pks).update(status=status_id, metric_value=weight, updated=now())
+            # quality depends on metric value
+            if groups:
+                Link.update_quality(Link.objects.filter(pk__in=changed_links.keys()))
+
+            # append a sample of every link of the topology to the history
+            if LINK_METRICS_HISTORY:
+                LinkSample.record(self.link_set.all())
+
+        # bulk queries do not send post_save
+        if new_links or groups:
+            from ..graph import network_graph
+            from ..cache import clear_geojson_cache
+            network_graph.invalidate()
+            clear_geojson_cache()
+
+        return result
+
+    @staticmethod
+    def _normalize_address(address):
+        """ returns the canonical representation of an ip or mac address, None if not valid """
+        if valid_ipv4(address) or valid_ipv6(address):
+            return str(IPAddress(address))
+        if valid_mac(address):
+            return str(EUI(address))
+        return None
+
+    def _get_interfaces(self, addresses):
+        """
+        returns a dict which maps the normalized ip and mac addresses to their interfaces
+        performs at most 2 queries: 1 for ip addresses and 1 for mac addresses
+        """
+        from nodeshot.networking.net.models import Interface, Ip
+        ips = [address for address in addresses if valid_ipv4(address) or valid_ipv6(address)]
+        macs = [address for address in addresses if valid_mac(address)]
+        interfaces = {}
+        if ips:
+            # nodes and layers are needed by Link.fill
+            for ip in Ip.objects.filter(address__in=ips).select_related('interface__device__node__layer'):
+                interfaces[self._normalize_address(str(ip.address))] = ip.interface
+        if macs:
+            for interface in Interface.objects.filter(mac__in=macs).select_related('device__node__layer'):
+                interfaces[self._normalize_address(str(interface.mac))] = interface
+        return interfaces
+
+    def _get_links(self, interfaces):
+        """
+        returns a dict which maps (interface_a_id, interface_b_id) tuples to the links
+        of this topology between the specified interfaces (inverse order is also ok), 1 query
+        """
+        from .link import Link  # avoid circular dependency
+        pks = set(interface.pk for interface in interfaces)
+        links = {}
+        if not pks:
+            return links
+        queryset = Link.objects.filter(topology=self, interface_a__in=pks, interface_b__in=pks).order_by('pk')
+        for link in queryset:
+            # like Link.get_link, the first link found wins
+            links.setdefault((link.interface_a_id, link.interface_b_id), link)
+            links.setdefault((link.interface_b_id, link.interface_a_id), link)
+        return links
+
+    def _get_or_create_link(self, link_dict, interfaces, links):
+        """
+        same as Link.get_or_create, but interfaces and links are looked up
+        in the dicts returned by _get_interfaces and _get_links;
+        new links are validated but not saved
+        """
+        from .link import Link  # avoid circular dependency
+        source = link_dict['source']
+        target = link_dict['target']
+        a = source
+        b = target
+        # ensure parameters are coherent
+        if not (valid_ipv4(a) and valid_ipv4(b)) and not (valid_ipv6(a) and valid_ipv6(b)) and not (valid_mac(a) and valid_mac(b)):
+            raise ValueError('Expecting valid ipv4, ipv6 or mac address')
+        a = interfaces.get(self._normalize_address(a))
+        b = interfaces.get(self._normalize_address(b))
+        # raise LinkDataNotFound if an interface is not found
+        not_found = []
+        if a is None:
+            not_found.append(source)
+        if b is None:
+            not_found.append(target)
+        if not_found:
+            msg = 'the following interfaces could not be found: {0}'.format(', '.join(not_found))
+            raise LinkDataNotFound(msg)
+        link = links.get((a.pk, b.pk))
+        if link is None:
+            link = Link(interface_a=a,
+                        interface_b=b,
+                        status=LINK_STATUS['active'],
+                        metric_value=link_dict['weight'],
+                        topology=self)
+            # interfaces are already loaded, do not check their existence again
+            link.full_clean(exclude=['interface_a', 'interface_b', 'node_a', 'node_b', 'layer', 'topology'])
+            links[(a.pk, b.pk)] = links[(b.pk, a.pk)] = link
+        return link
@@ -0,0 +1,64 @@
+"""
+Quality of links
+
+Quality is a number between 1 (worst) and 6 (best) which rates a link
+according to its metric value, 0 means unknown.
+The thresholds of each metric type can be customized with
+NODESHOT_LINK_QUALITY_THRESHOLDS.
+
+The same rules are available as a python function, used when a single
+link is saved, and as an SQL expression, used to update whole querysets
+with a single query.
+"""
+from .settings import LINK_QUALITY_THRESHOLDS, LINK_QUALITY_DEFAULT_METRIC
+
+
+__all__ = [
+    'UNKNOWN',
+    'get_quality',
+    'get_quality_sql'
+]
+
+
+UNKNOWN = 0
+
+
+def get_quality(metric_type, metric_value):
+    """
+    :param metric_type: one of the values of METRIC_TYPES or None
+    :param metric_value: float or None
+    :returns: int
+    """
+    thresholds = LINK_QUALITY_THRESHOLDS.get(metric_type or LINK_QUALITY_DEFAULT_METRIC)
+    if metric_value is None or thresholds is None:
+        return UNKNOWN
+    best = len(thresholds) + 1
+    for i, threshold in enumerate(thresholds):
+        if metric_value <= threshold:
+            return best - i
+    return 1
+
+
+def get_quality_sql(metric_type_column, metric_value_column):
+    """
+    returns SQL CASE expression equivalent to get_quality and its params
+    :param metric_type_column: quoted column name
+    :param metric_value_column: quoted column name
+    :returns: tuple (sql, params)
+    """
+    sql = ['CASE WHEN %s IS NULL THEN %d' % (metric_value_column, UNKNOWN)]
+    params = []
+    for metric_type, thresholds in sorted(LINK_QUALITY_THRESHOLDS.items()):
+        if metric_type == LINK_QUALITY_DEFAULT_METRIC:
+            # like get_quality, blank metric types (saved by the admin) fall back on the default metric
+            condition = "(%s = %%s OR %s IS NULL OR %s = '')" % ((metric_type_column,) * 3)
+        else:
+            condition = '%s = %%s' % metric_type_column
+        best = len(thresholds) + 1
+        for i, threshold in enumerate(thresholds):
+            sql.append('WHEN %s AND %s <= %%s THEN %d' % (condition, metric_value_column, best - i))
+            params += [metric_type, threshold]
+        sql.append('WHEN %s THEN 1' % condition)
+        params.append(metric_type)
+    sql.append('ELSE %d END' % UNKNOWN)
+    return ' '.join(sql), params
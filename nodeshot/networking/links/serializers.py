@@ -31,7 +31,7 @@ class LinkListSerializer(gis_serializers.GeoModelSerializer):
             'layer',
             'node_a_name', 'node_b_name',
             'status', 'type', 'line',
-            'metric_type', 'metric_value',
+            'quality', 'metric_type', 'metric_value',
         ]
 
 
@@ -12,6 +12,33 @@ DEFAULT_PARSERS = [
 PARSERS = DEFAULT_PARSERS + getattr(settings, 'NODESHOT_NETDIFF_PARSERS', [])
 
 TOPOLOGY_UPDATE_INTERVAL = getattr(settings, 'NODESHOT_TOPOLOGY_UPDATE_INTERVAL', 3)
+# seconds after which the in-memory network graph is reloaded from the database
+GRAPH_TTL = getattr(settings, 'NODESHOT_LINKS_GRAPH_TTL', 60)
+# max number of topologies retrieved concurrently by update_topology
+TOPOLOGY_FETCH_WORKERS = getattr(settings, 'NODESHOT_TOPOLOGY_FETCH_WORKERS', 10)
+
+# upper bounds of the metric value of each quality level, from the best (6) to the worst but one (2),
+# links whose metric value exceeds the last threshold have quality 1
+LINK_QUALITY_THRESHOLDS = getattr(settings, 'NODESHOT_LINK_QUALITY_THRESHOLDS', {
+    'etx': [1.1, 1.5, 2, 3, 5],
+    'etc': [1.1, 1.5, 2, 3, 5],
+    'hop': [1, 2, 3, 4, 5]
+})
+# metric type assumed for links which do not specify it
+LINK_QUALITY_DEFAULT_METRIC = getattr(settings, 'NODESHOT_LINK_QUALITY_DEFAULT_METRIC', 'etx')
+
+# seconds for which the link GeoJSON list is cached (it is invalidated whenever links change)
+GEOJSON_CACHE_TIMEOUT = getattr(settings, 'NODESHOT_LINKS_GEOJSON_CACHE_TIMEOUT', 86400)
+
+# store a sample of metric value and status of each link at every topology update
+LINK_METRICS_HISTORY = getattr(settings, 'NODESHOT_LINK_METRICS_HISTORY', True)
+# raw samples older than this are replaced by their averages over periods of LINK_METRICS_RESOLUTION seconds
+LINK_METRICS_RAW_RETENTION = getattr(settings, 'NODESHOT_LINK_METRICS_RAW_RETENTION', timedelta(days=2))
+LINK_METRICS_RESOLUTION = getattr(settings, 'NODESHOT_LINK_METRICS_RESOLUTION', 3600)
+# downsampled data older than this is deleted
+LINK_METRICS_RETENTION = getattr(settings, 'NODESHOT_LINK_METRICS_RETENTION', timedelta(days=365))
+# max number of points returned by the link metrics API when interval is not specified
+LINK_METRICS_MAX_POINTS = getattr(settings, 'NODESHOT_LINK_METRICS_MAX_POINTS', 300)
 
 settings.CELERYBEAT_SCHEDULE.update({
     'update_topology': {
@@ -19,3 +46,11 @@ settings.CELERYBEAT_SCHEDULE.update({
         'schedule': timedelta(minutes=TOPOLOGY_UPDATE_INTERVAL),
     }
 })
+
+if LINK_METRICS_HISTORY:
+    settings.CELERYBEAT_SCHEDULE.update({
+        'downsample_link_metrics': {
+            'task': 'nodeshot.networking.links.tasks.downsample_link_metrics',
+            'schedule': timedelta(hours=1),
+        }
+    })
@@ -1,6 +1,10 @@
 from celery import task
 
+from nodeshot.core.base.utils import now
+
 from .utils import update_topology as update_topology_util
+from .models import LinkSample
+from .settings import LINK_METRICS_RAW_RETENTION, LINK_METRICS_RESOLUTION, LINK_METRICS_RETENTION
 
 
 @task
@@ -9,3 +13,14 @@ def update_topology():
     celery task wrapper for nodeshot.networking.utils.update_topology
     """
     update_topology_util()
+
+
+@task
+def downsample_link_metrics():
+    """
+    replaces raw link samples older than NODESHOT_LINK_METRICS_RAW_RETENTION with their averages
+    and deletes data older than NODESHOT_LINK_METRICS_RETENTION
+    """
+    LinkSample.downsample(older_than=now() - LINK_METRICS_RAW_RETENTION,
+                          resolution=LINK_METRICS_RESOLUTION,
+                          retention=now() - LINK_METRICS_RETENTION)
@@ -1,15 +1,28 @@
+import os
+import json
+import time
+import random
 from collections import OrderedDict
+from datetime import datetime, timedelta
+from unittest import skipUnless
 
+from django.db import connection
+from django.core.cache import get_cache
+from django.contrib.gis.geos import LineString, Point
 from django.core.exceptions import ValidationError
 from django.core.urlresolvers import reverse
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import utc
 
 from nodeshot.core.base.tests import BaseTestCase
 from nodeshot.core.base.tests import user_fixtures
+from nodeshot.core.nodes.models import Node
 from nodeshot.networking.net.models import Interface
 
-from .models import Link, Topology
+from .models import Link, Topology, LinkSample
 from .models.choices import LINK_STATUS, LINK_TYPES
 from .exceptions import LinkDataNotFound, LinkNotFound
+from .quality import get_quality
 
 
 class LinkTest(BaseTestCase):
@@ -110,6 +123,60 @@ class LinkTest(BaseTestCase):
         self.assertEqual(link.interface_a_mac, link.interface_a.mac)
         self.assertEqual(link.interface_b_mac, link.interface_b.mac)
 
+    def test_save_existing_link_queries(self):
+        self.link.save()
+        link = Link.objects.get(pk=self.link.pk)
+        link.metric_type = 'etx'
+        link.metric_value = 1.0
+        # related objects are not retrieved again
+        with self.assertNumQueries(1):
+            link.save()
+        self.assertEqual(link.quality, 6)
+
+    def test_save_changed_nodes(self):
+        self.link.save()
+        link = Link.objects.get(pk=self.link.pk)
+        line = link.line
+        node = Node.objects.exclude(pk__in=[link.node_a_id, link.node_b_id]).first()
+        link.node_b = node
+        link.save()
+        link = Link.objects.get(pk=link.pk)
+        self.assertEqual(link.node_b_name, node.name)
+        self.assertEqual(link.node_b_slug, node.slug)
+        self.assertNotEqual(link.line, line)
+        self.assertEqual(link.line, LineString(link.node_a.point, node.point))
+
+    def test_fill(self):
+        link = self.link
+        changed = link.fill()
+        self.assertEqual(changed, set(['node_a', 'node_b', 'layer', 'line', 'data']))
+        self.assertIsNone(link.pk)
+        self.assertEqual(link.node_a_slug, link.node_a.slug)
+        self.assertEqual(link.layer_slug, link.node_a.layer.slug)
+        self.assertEqual(link.interface_b_mac, link.interface_b.mac)
+        # nothing else to fill
+        self.assertEqual(link.fill(), set())
+
+    def test_fill_with_loaded_nodes(self):
+        """ nodes of interfaces loaded with select_related are used without further queries """
+        link = self.link
+        link.interface_a = Interface.objects.select_related('device__node__layer').get(pk=link.interface_a_id)
+        link.interface_b = Interface.objects.select_related('device__node__layer').get(pk=link.interface_b_id)
+        with self.assertNumQueries(0):
+            link.fill()
+        self.assertEqual(link.node_a, link.interface_a.device.node)
+
+    def test_redraw_when_node_moves(self):
+        link = self.link
+        link.save()
+        node = Node.objects.get(pk=link.node_a_id)
+        node.geometry = Point(node.point.x + 0.01, node.point.y + 0.01)
+        node.save()
+        link = Link.objects.get(pk=link.pk)
+        self.assertTrue(link.line.equals_exact(LineString(node.point, link.node_b.point)))
+        # lines which are already up to date are not written
+        self.assertEqual(Link.redraw(node), 0)
+
     def test_auto_link_type(self):
         link = self.link
         link.type = None
@@ -117,6 +184,71 @@ class LinkTest(BaseTestCase):
         link = Link.objects.find(link.id)
         self.assertEqual(link.type, LINK_TYPES.get('radio'))
 
+    def test_quality(self):
+        link = self.link
+        link.metric_type = 'etx'
+        # unknown
+        link.save()
+        self.assertEqual(link.quality, 0)
+        for metric_value, quality in [(1.0, 6), (1.5, 5), (1.8, 4), (3, 3), (4.9, 2), (10, 1)]:
+            link.metric_value = metric_value
+            link.save()
+            self.assertEqual(Link.objects.get(pk=link.pk).quality, quality)
+        link.metric_type = 'hop'
+        link.metric_value = 2
+        link.save()
+        self.assertEqual(link.quality, 5)
+        # default metric type
+        link.metric_type = None
+        link.metric_value = 1.0
+        link.save()
+        self.assertEqual(link.quality, 6)
+
+    def test_update_quality(self):
+        link = self.link
+        link.save()
+        values = [('etx', 1.0, 6), ('etx', 1.5, 5), ('etx', 10, 1), ('hop', 2, 5), (None, 2, 4),
+                  ('', 2, 4), ('etc', 3, 3), ('etx', None, 0), ('unknown', 1, 0)]
+        for metric_type, metric_value, quality in values:
+            Link.objects.filter(pk=link.pk).update(metric_type=metric_type, metric_value=metric_value)
+            self.assertEqual(Link.update_quality(Link.objects.filter(pk=link.pk)), 1)
+            self.assertEqual(Link.objects.get(pk=link.pk).quality, quality)
+        # links excluded from queryset are not touched
+        Link.objects.filter(pk=link.pk).update(metric_type='etx', metric_value=1.0)
+        Link.update_quality(Link.objects.exclude(pk=link.pk))
+        self.assertEqual(Link.objects.get(pk=link.pk).quality, 0)
+        Link.update_quality()
+        self.assertEqual(Link.objects.get(pk=link.pk).quality, 6)
+
+    @skipUnless(os.environ.get('NODESHOT_BENCHMARK'), 'set NODESHOT_BENCHMARK=1 to run benchmarks')
+    def test_quality_benchmark(self):
+        """ compares batch quality update with per object computation on 100k links """
+        n = 100000
+        random.seed(0)
+        Link.objects.bulk_create([Link(status=LINK_STATUS['active'],
+                                       metric_type=random.choice(['etx', 'hop', None]),
+                                       metric_value=random.uniform(1, 6),
+                                       data={})
+                                  for i in range(n)], batch_size=5000)
+        queryset = Link.objects.all()
+
+        start = time.time()
+        for metric_type, metric_value in queryset.values_list('metric_type', 'metric_value').iterator():
+            get_quality(metric_type, metric_value)
+        python_duration = time.time() - start
+
+        start = time.time()
+        Link.update_quality(queryset)
+        sql_duration = time.time() - start
+
+        start = time.time()
+        list(queryset.values_list('id', 'quality'))
+        read_duration = time.time() - start
+
+        print('\nquality of %d links: python %.3fs, batch update %.3fs, read %.3fs' % (
+            queryset.count(), python_duration, sql_duration, read_duration
+        ))
+
     def test_get_link(self):
         self.assertEqual(Link.get_link(source='172.16.41.42', target='172.16.40.22').pk, 1)
         self.assertEqual(Link.get_link(source='172.16.40.22', target='172.16.41.42').pk, 1)
@@ -195,6 +327,18 @@ class LinkTest(BaseTestCase):
         self.assertEqual(Link.objects.count(), 1)
         self.assertEqual(link.topology.id, t.id)
 
+    def test_links_api_cursor_pagination(self):
+        self.link.save()
+        url = reverse('api_link_list')
+        response = self.client.get(url, {'cursor': '', 'limit': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 1)
+        first = response.data['results'][0]
+        response = self.client.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertNotEqual(response.data['results'][0], first)
+        self.assertIsNone(response.data['next'])
+
     def test_links_api(self):
         link = self.link
         link.save()
@@ -208,7 +352,7 @@ class LinkTest(BaseTestCase):
         url = reverse('api_links_geojson_list')
         response = self.client.get(url)
         self.assertEquals(response.status_code, 200)
-        self.assertEqual(len(response.data['features']), 2)
+        self.assertEqual(len(json.loads(''.join(response.streaming_content))['features']), 2)
         # GET: 200 - link details
         url = reverse('api_link_details', args=[link.id])
         response = self.client.get(url)
@@ -217,6 +361,110 @@ class LinkTest(BaseTestCase):
         url = reverse('api_links_geojson_details', args=[link.id])
         response = self.client.get(url)
         self.assertEquals(response.status_code, 200)
+        self.assertEqual(response.data['type'], 'Feature')
+        self.assertEqual(response.data['geometry']['type'], 'LineString')
+
+    def test_links_geojson_api(self):
+        from nodeshot.core.base import cache as base_cache
+        from . import views
+        # the dummy cache used in development does not store anything
+        locmem = get_cache('django.core.cache.backends.locmem.LocMemCache')
+        original_caches = base_cache.cache, views.cache
+        base_cache.cache = views.cache = locmem
+        try:
+            self._test_links_geojson_api(locmem)
+        finally:
+            base_cache.cache, views.cache = original_caches
+
+    def _test_links_geojson_api(self, cache):
+        link = self.link
+        link.metric_type = 'etx'
+        link.metric_value = 1.0
+        link.save()
+        url = reverse('api_links_geojson_list')
+
+        def get(**params):
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'application/json')
+            return json.loads(''.join(response.streaming_content))
+
+        data = get()
+        self.assertEqual(data['type'], 'FeatureCollection')
+        self.assertEqual(len(data['features']), 2)
+        feature = [f for f in data['features'] if f['id'] == link.id][0]
+        self.assertEqual(feature['type'], 'Feature')
+        self.assertEqual(feature['geometry']['type'], 'LineString')
+        self.assertEqual(feature['geometry']['coordinates'], [list(point) for point in link.line.coords])
+        self.assertEqual(feature['properties'], {
+            'layer': link.layer_slug,
+            'node_a_name': link.node_a_name,
+            'node_b_name': link.node_b_name,
+            'status': 'active',
+            'type': 'radio',
+            'quality': 6,
+            'metric_type': 'etx',
+            'metric_value': 1.0
+        })
+        # layer filter
+        self.assertEqual(len(get(layers=link.layer_slug)['features']),
+                         Link.objects.filter(layer=link.layer).count())
+        self.assertEqual(len(get(layers='idontexist')['features']), 0)
+        # bbox filter
+        xmin, ymin, xmax, ymax = link.line.extent
+        bbox = '%s,%s,%s,%s' % (xmin - 0.001, ymin - 0.001, xmax + 0.001, ymax + 0.001)
+        self.assertIn(link.id, [f['id'] for f in get(bbox=bbox)['features']])
+        self.assertEqual(len(get(bbox='0,0,0.001,0.001')['features']), 0)
+        self.assertEqual(self.client.get(url, {'bbox': '1,2,3'}).status_code, 400)
+        # cached response
+        with self.assertNumQueries(0):
+            self.assertEqual(len(get()['features']), 2)
+        # unknown parameters, order and not existing layers do not create new cache keys
+        keys = len(cache._cache)
+        self.assertEqual(len(get(unknown='1')['features']), 2)
+        self.assertEqual(len(get(layers='%s,idontexist,%s' % (link.layer_slug, link.layer_slug))['features']),
+                         Link.objects.filter(layer=link.layer).count())
+        self.assertEqual(len(cache._cache), keys)
+        # responses filtered by bbox are not cached
+        get(bbox='0,0,0.002,0.002')
+        self.assertEqual(len(cache._cache), keys)
+        # cache is outdated when links change, the rest of the cache is not cleared
+        cache.set('unrelated', 'value')
+        link.delete()
+        self.assertEqual(len(get()['features']), 1)
+        self.assertEqual(cache.get('unrelated'), 'value')
+
+    def test_links_api_number_of_queries(self):
+        """ the number of queries must not depend on the number of links """
+        link = self.link
+        link.save()
+        urls = [
+            reverse('api_link_list'),
+            reverse('api_node_links', args=[link.node_a.slug]),
+            reverse('api_link_details', args=[link.id]),
+            reverse('api_links_geojson_details', args=[link.id])
+        ]
+
+        def count_queries():
+            counts = []
+            for url in urls:
+                with CaptureQueriesContext(connection) as context:
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                counts.append(len(context))
+            return counts
+
+        expected = count_queries()
+        for i in range(5):
+            Link(interface_a=link.interface_a, interface_b=link.interface_b,
+                 type=LINK_TYPES['radio'], status=LINK_STATUS['active']).save()
+        response = self.client.get(urls[1])
+        self.assertEqual(len(response.data), 7)
+        self.assertEqual(count_queries(), expected)
+        # relationships are built with the shortcuts stored in data
+        relationships = response.data[0]['relationships']
+        self.assertIn(link.node_a_slug, relationships['node_a'])
+        self.assertIn(link.node_b_slug, relationships['node_b'])
 
     def test_node_links_api(self):
         link = self.link
@@ -293,6 +541,33 @@ class TopologyTest(BaseTestCase):
             ]
         })
 
+    def test_topology_netjson_shared_interface(self):
+        t = Topology.objects.first()
+        for interface_b_id, metric_value in [(9, 1.01), (11, 2.0)]:
+            link = Link(**{
+                'topology': t,
+                'type': LINK_TYPES['radio'],
+                'status': LINK_STATUS['active'],
+                'interface_a_id': 7,
+                'interface_b_id': interface_b_id,
+                'metric_type': 'etx',
+                'metric_value': metric_value
+            })
+            link.full_clean()
+            link.save()
+        # links, ip addresses of interfaces a, ip addresses of interfaces b
+        with self.assertNumQueries(3):
+            graph = t.json()
+        # nodes are not repeated
+        self.assertEqual(graph['nodes'], [
+            {'id': '172.16.40.2'},
+            {'id': '172.16.40.4'},
+            {'id': '172.16.40.3'}
+        ])
+        self.assertEqual(len(graph['links']), 2)
+        self.assertEqual(graph['links'][1]['target'], '172.16.40.3')
+        self.assertEqual(graph['links'][1]['weight'], 2.0)
+
     def test_update_create(self):
         t = Topology.objects.first()
         self.assertEqual(t.link_set.count(), 0)
@@ -302,6 +577,12 @@ class TopologyTest(BaseTestCase):
         self.assertEqual(link.status, LINK_STATUS['active'])
         self.assertEqual(link.topology, t)
         self.assertEqual(link.metric_value, 2.0)
+        self.assertEqual(link.quality, 4)
+        # links are filled like in Link.save
+        self.assertEqual(link.node_a, link.interface_a.node)
+        self.assertEqual(link.node_b_slug, link.node_b.slug)
+        self.assertEqual(link.layer, link.node_a.layer)
+        self.assertEqual(link.line, LineString(link.node_a.point, link.node_b.point))
         link = Link.get_link(source='172.16.40.3', target='172.16.40.4')
         self.assertEqual(link.status, LINK_STATUS['active'])
         self.assertEqual(link.topology, t)
@@ -321,6 +602,250 @@ class TopologyTest(BaseTestCase):
         self.assertEqual(link.topology, t)
         self.assertEqual(link.metric_value, 1.0)
 
+    def test_update_topology_util(self):
+        from .utils import update_topology
+        t = Topology.objects.first()
+        t2 = Topology.objects.create(name='Rome 2', format=t.format,
+                                     url=t.url.replace('topology.json', 'topology_2.json'))
+        # a failing topology does not prevent the others from being updated
+        Topology.objects.create(name='Broken', format=t.format,
+                                url=t.url.replace('topology.json', 'idontexist.json'))
+        update_topology()
+        self.assertEqual(t.link_set.count(), 2)
+        self.assertEqual(t2.link_set.count(), 1)
+        link = t2.link_set.first()
+        self.assertEqual(link.status, LINK_STATUS['active'])
+        self.assertEqual(link.metric_value, 1.0)
+
+    def test_link_metrics_history(self):
+        t = Topology.objects.first()
+        t.update()
+        # a sample of each link is appended at every update
+        self.assertEqual(LinkSample.objects.count(), 2)
+        t.update()
+        self.assertEqual(LinkSample.objects.count(), 4)
+        LinkSample.objects.all().delete()
+        link = Link.get_link(source='172.16.40.1', target='172.16.40.2')
+        start = datetime(2015, 6, 1, 10, 0, tzinfo=utc)
+        for minutes, value in [(0, 1.0), (10, 2.0), (70, 4.0)]:
+            LinkSample.objects.create(link=link,
+                                      timestamp=start + timedelta(minutes=minutes),
+                                      metric_value=value,
+                                      status=LINK_STATUS['active'])
+        params = {
+            'since': '2015-06-01T09:00:00Z',
+            'until': '2015-06-01T13:00:00Z',
+            'interval': 3600
+        }
+        # link series
+        url = reverse('api_link_metrics', args=[link.pk])
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['link'], link.pk)
+        self.assertEqual(response.data['interval'], 3600)
+        series = response.data['series']
+        self.assertEqual(len(series), 2)
+        self.assertEqual(series[0]['time'], start)
+        self.assertEqual(series[0]['metric_value'], 1.5)
+        self.assertEqual(series[0]['status'], 'active')
+        self.assertEqual(series[1]['metric_value'], 4.0)
+        # node series
+        url = reverse('api_node_link_metrics', args=[link.node_a.slug])
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        links = dict((item['link'], item['series']) for item in response.data['links'])
+        self.assertEqual(links[link.pk], series)
+        # bad requests
+        url = reverse('api_link_metrics', args=[link.pk])
+        self.assertEqual(self.client.get(url, {'interval': 'wrong'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'since': 'wrong'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'since': params['until'], 'until': params['since']}).status_code, 400)
+        # 404
+        self.assertEqual(self.client.get(reverse('api_link_metrics', args=[0])).status_code, 404)
+        # downsampling: the period between 11:00 and 12:00 is not complete yet
+        count = LinkSample.downsample(older_than=start + timedelta(minutes=90), resolution=3600)
+        self.assertEqual(count, 2)
+        self.assertEqual(LinkSample.objects.filter(resolution=0).count(), 1)
+        sample = LinkSample.objects.get(resolution=3600)
+        self.assertEqual(sample.timestamp, start)
+        self.assertEqual(sample.metric_value, 1.5)
+        # series use both downsampled and raw samples
+        series = LinkSample.series([link.pk], start - timedelta(hours=1), start + timedelta(hours=3), 3600)[link.pk]
+        self.assertEqual([item['metric_value'] for item in series], [1.5, 4.0])
+        # retention
+        LinkSample.downsample(older_than=start, resolution=3600, retention=start + timedelta(minutes=1))
+        self.assertEqual(LinkSample.objects.filter(resolution=3600).count(), 0)
+
+    def test_network_graph(self):
+        from .graph import network_graph
+        t = Topology.objects.first()
+        t.update()
+        network_graph.invalidate()
+        link = Link.get_link(source='172.16.40.1', target='172.16.40.2')
+        node_a = link.node_a
+        node_b = link.node_b
+        # shortest path
+        url = reverse('api_graph_path')
+        response = self.client.get(url, {'source': node_a.slug, 'target': node_b.slug})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['path'], [node_a.slug, node_b.slug])
+        self.assertEqual(response.data['cost'], link.metric_value)
+        self.assertEqual(response.data['hops'], 1)
+        # reachability
+        response = self.client.get(reverse('api_graph_reachable'), {'source': node_a.slug})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(node_b.slug, response.data['nodes'])
+        self.assertNotIn(node_a.slug, response.data['nodes'])
+        # critical nodes
+        response = self.client.get(reverse('api_graph_critical_nodes'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], len(response.data['nodes']))
+        # graph is updated when links are saved
+        link.status = LINK_STATUS['disconnected']
+        link.save()
+        response = self.client.get(url, {'source': node_a.slug, 'target': node_b.slug})
+        self.assertIsNone(response.data['path'])
+        self.assertIsNone(response.data['cost'])
+        link.status = LINK_STATUS['active']
+        link.save()
+        response = self.client.get(url, {'source': node_a.slug, 'target': node_b.slug})
+        self.assertEqual(response.data['hops'], 1)
+        # and deleted
+        link.delete()
+        response = self.client.get(url, {'source': node_a.slug, 'target': node_b.slug})
+        self.assertIsNone(response.data['path'])
+        # bad requests
+        self.assertEqual(self.client.get(url, {'source': node_a.slug}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'source': node_a.slug, 'target': 'idontexist'}).status_code, 404)
+
+    def test_network_graph_algorithms(self):
+        from .graph import NetworkGraph
+        graph = NetworkGraph()
+        # avoid loading from database
+        graph.loaded_at = float('inf')
+        graph.ttl = float('inf')
+        # two triangles connected by 3 - 4, plus 6 - 7
+        edges = [(1, 2, 1.0), (2, 3, 1.0), (3, 1, 1.0), (3, 4, 2.0),
+                 (4, 5, 1.0), (5, 6, 1.0), (6, 4, 1.0), (6, 7, 1.0)]
+        for link_id, (a, b, weight) in enumerate(edges):
+            graph._add(link_id, a, b, weight)
+        self.assertEqual(graph.shortest_path(1, 7), ([1, 3, 4, 6, 7], 5.0))
+        self.assertEqual(graph.reachable(1), set([2, 3, 4, 5, 6, 7]))
+        self.assertEqual(graph.articulation_points(), set([3, 4, 6]))
+        # a parallel link with a lower weight replaces the edge weight
+        graph._add(100, 3, 4, 0.5)
+        self.assertEqual(graph.shortest_path(1, 4), ([1, 3, 4], 1.5))
+        graph._remove(100)
+        graph._remove(3)
+        self.assertEqual(graph.shortest_path(1, 7), (None, None))
+        self.assertEqual(graph.reachable(1), set([2, 3]))
+        self.assertEqual(graph.articulation_points(), set([6]))
+
+    def test_network_graph_access_levels(self):
+        from .graph import NetworkGraph
+        graph = NetworkGraph()
+        # avoid loading from database
+        graph.loaded_at = float('inf')
+        graph.ttl = float('inf')
+        # 1 - 2 - 3 is public, the shortcut 1 - 3 is private, node 5 is not published
+        graph._add(1, 1, 2, 1.0)
+        graph._add(2, 2, 3, 1.0)
+        graph._add(3, 1, 3, 0.5, access_level=2)
+        graph._add(4, 3, 4, 1.0)
+        graph._add(5, 4, 5, 1.0)
+        graph.nodes[5] = None
+        self.assertEqual(graph.shortest_path(1, 3), ([1, 3], 0.5))
+        self.assertEqual(graph.shortest_path(1, 3, max_level=2), ([1, 3], 0.5))
+        self.assertEqual(graph.shortest_path(1, 3, max_level=0), ([1, 2, 3], 2.0))
+        self.assertEqual(graph.reachable(1), set([2, 3, 4, 5]))
+        self.assertEqual(graph.reachable(1, max_level=0), set([2, 3, 4]))
+        self.assertEqual(graph.articulation_points(), set([3, 4]))
+        self.assertEqual(graph.articulation_points(max_level=0), set([2, 3]))
+        # private nodes
+        graph.nodes[2] = 1
+        self.assertEqual(graph.shortest_path(1, 3, max_level=0), (None, None))
+        self.assertEqual(graph.shortest_path(1, 3, max_level=1), ([1, 2, 3], 2.0))
+
+    def test_topology_links_push(self):
+        t = Topology.objects.first()
+        url = reverse('api_topology_links_push', args=[t.pk])
+        netjson = {
+            'type': 'NetworkGraph',
+            'protocol': 'OLSR',
+            'version': '0.6.6',
+            'metric': 'ETX',
+            'nodes': [{'id': '172.16.40.1'}, {'id': '172.16.40.2'}],
+            'links': [{'source': '172.16.40.1', 'target': '172.16.40.2', 'weight': 2.0}]
+        }
+
+        def post(data):
+            return self.client.post(url, json.dumps(data), content_type='application/json')
+
+        # staff only
+        self.assertEqual(post(netjson).status_code, 401)
+        self.client.login(username='registered', password='tester')
+        self.assertEqual(post(netjson).status_code, 403)
+        self.client.logout()
+        self.client.login(username='admin', password='tester')
+        # whole topology
+        response = post(netjson)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'added': 1, 'removed': 0, 'changed': 0, 'errors': []})
+        link = Link.get_link(source='172.16.40.1', target='172.16.40.2')
+        self.assertEqual(link.topology, t)
+        self.assertEqual(link.status, LINK_STATUS['active'])
+        self.assertEqual(link.metric_value, 2.0)
+        # differences
+        response = post({
+            'added': None,
+            'removed': None,
+            'changed': {'links': [{'source': '172.16.40.1', 'target': '172.16.40.2', 'weight': 1.0}]}
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['changed'], 1)
+        link = Link.objects.get(pk=link.pk)
+        self.assertEqual(link.metric_value, 1.0)
+        self.assertEqual(link.quality, 6)
+        # unknown addresses are reported
+        response = post({'added': {'links': [{'source': '10.0.0.1', 'target': '10.0.0.2', 'weight': 1}]}})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['added'], 0)
+        self.assertEqual(len(response.data['errors']), 1)
+        # links missing from the whole topology are disconnected
+        netjson['nodes'] = []
+        netjson['links'] = []
+        response = post(netjson)
+        self.assertEqual(response.data['removed'], 1)
+        self.assertEqual(Link.objects.get(pk=link.pk).status, LINK_STATUS['disconnected'])
+        # bad requests
+        self.assertEqual(post([]).status_code, 400)
+        self.assertEqual(post({'links': []}).status_code, 400)
+        self.assertEqual(post({'type': 'NetworkGraph', 'links': []}).status_code, 400)
+        self.assertEqual(post({'changed': {'links': [{'source': '172.16.40.1', 'target': '172.16.40.2'}]}}).status_code, 400)
+        self.assertEqual(post({'changed': {'links': [{'source': 1, 'target': 2, 'weight': 1}]}}).status_code, 400)
+        self.assertEqual(post({'removed': []}).status_code, 400)
+        # topology not found
+        url = reverse('api_topology_links_push', args=[0])
+        self.assertEqual(post(netjson).status_code, 404)
+
+    def test_update_interfaces_lookup(self):
+        t = Topology.objects.first()
+        # invalid addresses are ignored, 1 query for ip addresses, none for mac addresses
+        with self.assertNumQueries(1):
+            interfaces = t._get_interfaces(['172.16.40.1', '172.16.40.4', 'invalid'])
+        self.assertEqual(interfaces['172.16.40.1'].pk, 5)
+        self.assertEqual(interfaces['172.16.40.4'].pk, 9)
+        self.assertEqual(len(interfaces), 2)
+        t.update()
+        # links are looked up in both directions with a single query
+        with self.assertNumQueries(1):
+            links = t._get_links(interfaces.values())
+        self.assertEqual(len(links), 0)
+        interfaces = t._get_interfaces(['172.16.40.1', '172.16.40.2'])
+        links = t._get_links(interfaces.values())
+        self.assertEqual(links[(5, 7)], links[(7, 5)])
+        self.assertEqual(links[(5, 7)], Link.get_link(source='172.16.40.1', target='172.16.40.2'))
+
     def test_update_1_removed_1_changed(self):
         t = Topology.objects.first()
         t.update()
@@ -337,3 +862,5 @@ class TopologyTest(BaseTestCase):
         self.assertEqual(link.status, LINK_STATUS['active'])
         self.assertEqual(link.topology, t)
         self.assertEqual(link.metric_value, 1.0)
+        # quality is updated too
+        self.assertEqual(link.quality, 6)
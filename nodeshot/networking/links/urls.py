@@ -4,9 +4,17 @@ from django.conf.urls import patterns, url
 urlpatterns = patterns('nodeshot.networking.links.views',  # noqa
     url(r'^links/$', 'link_list', name='api_link_list'),
     url(r'^links/(?P<pk>[0-9]+)/$', 'link_details', name='api_link_details'),
+    url(r'^links/(?P<pk>[0-9]+)/metrics/$', 'link_metrics', name='api_link_metrics'),
     # geojson
     url(r'^links.geojson$', 'link_geojson_list', name='api_links_geojson_list'),
     url(r'^links/(?P<pk>[0-9]+).geojson$', 'link_geojson_details', name='api_links_geojson_details'),
     # node links
     url(r'^nodes/(?P<slug>[-\w]+)/links/$', 'node_link_list', name='api_node_links'),
+    url(r'^nodes/(?P<slug>[-\w]+)/links/metrics/$', 'node_link_metrics', name='api_node_link_metrics'),
+    # topology push
+    url(r'^topologies/(?P<pk>[0-9]+)/links/$', 'topology_links_push', name='api_topology_links_push'),
+    # network graph
+    url(r'^graph/path/$', 'graph_path', name='api_graph_path'),
+    url(r'^graph/reachable/$', 'graph_reachable', name='api_graph_reachable'),
+    url(r'^graph/critical-nodes/$', 'graph_critical_nodes', name='api_graph_critical_nodes'),
 )
@@ -1,7 +1,13 @@
+import sys
+import time
 import logging
+from multiprocessing.pool import ThreadPool
 logger = logging.getLogger('nodeshot.networking')
 
+from django.conf import settings
+
 from .models import Topology
+from .settings import TOPOLOGY_FETCH_WORKERS
 
 
 links_legend = [
@@ -17,16 +23,64 @@ links_legend = [
 ]
 
 
+def fetch_topology(topology):
+    """
+    retrieves the latest data of a topology, runs in a thread of update_topology
+    hence it must not access the database
+    :returns: tuple of topology, parser instance (None on failure), exc_info (None on success), duration in seconds
+    """
+    start = time.time()
+    try:
+        latest = topology.latest
+        exc_info = None
+    except Exception:
+        latest = None
+        exc_info = sys.exc_info()
+    return topology, latest, exc_info, time.time() - start
+
+
+def record_topology_update(topology, fetch_time, apply_time, success):
+    """ logs the duration of the update of a topology and sends it to influxdb if metrics are enabled """
+    logger.info('updated {0} (fetch: {1:.3f}s, apply: {2:.3f}s, success: {3})'.format(
+        topology.__repr__(), fetch_time, apply_time, success
+    ))
+    if 'nodeshot.core.metrics' not in settings.INSTALLED_APPS:
+        return
+    from nodeshot.core.metrics.utils import write
+    write('topology_update', {
+        'fetch_time': int(fetch_time * 1000),
+        'apply_time': int(apply_time * 1000),
+        'success': success
+    }, tags={'topology': topology.name})
+
+
 def update_topology():
     """
     updates all the topology
     sends logs to the "nodeshot.networking" logger
+
+    topologies are retrieved concurrently in a pool of threads (NODESHOT_TOPOLOGY_FETCH_WORKERS)
+    while changes are written to the database one topology at a time
     """
-    for topology in Topology.objects.all():
-        try:
-            topology.update()
-        except Exception as e:
-            msg = 'Failed to update {}'.format(topology.__repr__())
-            logger.exception(msg)
-            print('{0}: {1}\n'
-                  'see networking.log for more information\n'.format(msg, e.__class__))
+    topologies = list(Topology.objects.all())
+    if not topologies:
+        return
+    pool = ThreadPool(min(TOPOLOGY_FETCH_WORKERS, len(topologies)))
+    try:
+        # topologies are applied in the order in which their retrieval completes
+        for topology, latest, exc_info, fetch_time in pool.imap_unordered(fetch_topology, topologies):
+            start = time.time()
+            if exc_info is None:
+                try:
+                    topology.update(latest)
+                except Exception:
+                    exc_info = sys.exc_info()
+            record_topology_update(topology, fetch_time, time.time() - start, exc_info is None)
+            if exc_info is not None:
+                msg = 'Failed to update {}'.format(topology.__repr__())
+                logger.error(msg, exc_info=exc_info)
+                print('{0}: {1}\n'
+                      'see networking.log for more information\n'.format(msg, exc_info[0]))
+    finally:
+        pool.close()
+        pool.join()
@@ -1,17 +1,37 @@
-from django.http import Http404
+import json
+from datetime import timedelta
+
+from django.http import Http404, StreamingHttpResponse
+from django.core.cache import cache
+from django.utils.encoding import force_text
 from django.utils.translation import ugettext_lazy as _
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import is_naive, make_aware, utc
 from django.db.models import Q
 
-from rest_framework import authentication, generics
+from netdiff import NetJsonParser
+from netdiff.exceptions import NetdiffException
+
+from rest_framework import authentication, generics, permissions
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from rest_framework.exceptions import ParseError
 
-from nodeshot.core.base.mixins import ACLMixin
+from nodeshot.core.base.cache import cache_by_group
+from nodeshot.core.base.choices import ACCESS_LEVELS
+from nodeshot.core.base.mixins import ACLMixin, CursorPaginationMixin
+from nodeshot.core.base.utils import now, parse_bbox
 from nodeshot.core.nodes.models import Node
+from nodeshot.core.layers.models import Layer
 
 from .serializers import *  # noqa
-from .models import Link
+from .models import Link, LinkSample, Topology
+from .settings import LINK_METRICS_MAX_POINTS, GEOJSON_CACHE_TIMEOUT
+from .graph import network_graph
+from .cache import get_geojson_generation
 
 
-class LinkList(ACLMixin, generics.ListAPIView):
+class LinkList(CursorPaginationMixin, ACLMixin, generics.ListAPIView):
     """
     Retrieve link list according to user access level
 
@@ -19,6 +39,9 @@ class LinkList(ACLMixin, generics.ListAPIView):
 
      * `limit=<n>`: specify number of items per page (defaults to 40)
      * `limit=0`: turns off pagination
+     * `cursor=`: use cursor pagination, the response contains the `next` URL;
+       faster than `page=<n>` on deep pages, items are ordered by `updated` (or by `id` with `order=id`)
+     * `count=approximate`: add the estimated number of items to cursor paginated responses
     """
     authentication_classes = (authentication.SessionAuthentication,)
     queryset = Link.objects.all()
@@ -30,13 +53,116 @@ class LinkList(ACLMixin, generics.ListAPIView):
 link_list = LinkList.as_view()
 
 
-class LinkGeoJSONList(ACLMixin, generics.ListAPIView):
+class LinkGeoJSONList(ACLMixin, generics.GenericAPIView):
     """
     Retrieve link list in GeoJSON format
+
+    Parameters:
+
+     * `layers=<layer1>,<layer2>`: retrieve links of specified layers (comma separated)
+     * `bbox=<min lng>,<min lat>,<max lng>,<max lat>`: retrieve links which overlap the specified bounding box
+
+    Responses without `bbox` are cached by user group and layers until links change.
     """
     authentication_classes = (authentication.SessionAuthentication,)
     queryset = Link.objects.all()
-    serializer_class = LinkListGeoJSONSerializer
+    # number of features written at once in the streamed response
+    chunk_size = 500
+
+    def get_layers(self):
+        """ sorted slugs of the requested layers which exist, None if the parameter is missing """
+        if not hasattr(self, '_layers'):
+            layers = self.request.QUERY_PARAMS.get('layers')
+            if layers:
+                layers = Layer.objects.filter(slug__in=layers.split(',')).values_list('slug', flat=True)
+                self._layers = sorted(set(layers))
+            else:
+                self._layers = None
+        return self._layers
+
+    def get_queryset(self):
+        queryset = super(LinkGeoJSONList, self).get_queryset()
+        layers = self.get_layers()
+        bbox = self.request.QUERY_PARAMS.get('bbox')
+        if layers is not None:
+            queryset = queryset.filter(layer__slug__in=layers)
+        if bbox:
+            try:
+                bbox = parse_bbox(bbox)
+            except ValueError:
+                raise ParseError(_('bbox: expected 4 comma separated numbers'))
+            # "&&" operator, uses the spatial index
+            queryset = queryset.filter(line__bboverlaps=bbox)
+        return queryset
+
+    def get_cache_key(self):
+        """
+        key made of the validated parameters only, unknown parameters are ignored;
+        returns None when a bbox is specified, those responses are not cached
+        because the number of possible keys would be unlimited
+        """
+        if self.request.QUERY_PARAMS.get('bbox'):
+            return None
+        # group and media type are taken into account by cache_by_group
+        key = '%s.%s' % (cache_by_group(self, None, self.request, self.args, self.kwargs),
+                         get_geojson_generation())
+        layers = self.get_layers()
+        if layers is not None:
+            key = '%s?layers=%s' % (key, ','.join(layers))
+        return key
+
+    def get_features(self):
+        """ builds the features as strings, geometries are converted to GeoJSON by PostGIS """
+        statuses = dict((key, force_text(value)) for key, value in Link._meta.get_field('status').flatchoices)
+        types = dict((key, force_text(value)) for key, value in Link._meta.get_field('type').flatchoices)
+        rows = self.get_queryset().extra(select={
+            'geojson': 'ST_AsGeoJSON("links_link"."line")',
+            'layer_slug': '"links_link"."data" -> \'layer_slug\'',
+            'node_a_name': '"links_link"."data" -> \'node_a_name\'',
+            'node_b_name': '"links_link"."data" -> \'node_b_name\''
+        }).values('id', 'geojson', 'layer_slug', 'node_a_name', 'node_b_name',
+                  'status', 'type', 'quality', 'metric_type', 'metric_value')
+        for row in rows.order_by('id').iterator():
+            properties = json.dumps({
+                'layer': row['layer_slug'],
+                'node_a_name': row['node_a_name'],
+                'node_b_name': row['node_b_name'],
+                'status': statuses.get(row['status']),
+                'type': types.get(row['type']),
+                'quality': row['quality'],
+                'metric_type': row['metric_type'],
+                'metric_value': row['metric_value']
+            })
+            yield '{"type": "Feature", "id": %d, "geometry": %s, "properties": %s}' % (
+                row['id'], row['geojson'] or 'null', properties
+            )
+
+    def stream(self, cache_key=None):
+        """ yields the feature collection in chunks and caches it once complete (unless cache_key is None) """
+        content = ['{"type": "FeatureCollection", "features": [']
+        yield content[0]
+        separator = ''
+        chunk = []
+        for feature in self.get_features():
+            chunk.append(feature)
+            if len(chunk) == self.chunk_size:
+                content.append(separator + ', '.join(chunk))
+                yield content[-1]
+                separator = ', '
+                chunk = []
+        content.append((separator if chunk else '') + ', '.join(chunk) + ']}')
+        yield content[-1]
+        if cache_key is not None:
+            cache.set(cache_key, ''.join(content), GEOJSON_CACHE_TIMEOUT)
+
+    def get(self, request, *args, **kwargs):
+        cache_key = self.get_cache_key()
+        content = cache.get(cache_key) if cache_key is not None else None
+        if content is None:
+            content = self.stream(cache_key)
+        else:
+            content = [content]
+        return StreamingHttpResponse(content, content_type='application/json')
 
 link_geojson_list = LinkGeoJSONList.as_view()
 
@@ -60,7 +186,7 @@ class LinkGeoJSONDetails(LinkDetails):
     queryset = Link.objects.all()
     serializer_class = LinkDetailGeoJSONSerializer
 
-link_geojson_details = LinkDetails.as_view()
+link_geojson_details = LinkGeoJSONDetails.as_view()
 
 
 class NodeLinkList(generics.ListAPIView):
@@ -87,9 +213,269 @@ class NodeLinkList(generics.ListAPIView):
         # check permissions on node (for link creation)
         self.check_object_permissions(request, self.node)
         # return only links of current node
-        self.queryset = Link.objects.select_related('node')\
-                                    .accessible_to(self.request.user)\
+        # node slugs and names are read from the "data" shortcuts, no join is needed
+        self.queryset = Link.objects.accessible_to(self.request.user)\
                                     .filter(Q(node_a_id=self.node.id) |
                                             Q(node_b_id=self.node.id))
 
 node_link_list = NodeLinkList.as_view()
+
+
+class LinkMetricsMixin(object):
+    """
+    Parses time range and interval of the link metrics views
+    """
+    def get_date(self, name, default):
+        value = self.request.QUERY_PARAMS.get(name)
+        if not value:
+            return default
+        date = parse_datetime(value)
+        if date is None:
+            raise ParseError(_('%s: invalid date, expected ISO 8601 format') % name)
+        if is_naive(date):
+            date = make_aware(date, utc)
+        return date
+
+    def get_series(self, link_ids):
+        """ returns time range information and series of the specified links """
+        until = self.get_date('until', now())
+        since = self.get_date('since', until - timedelta(days=1))
+        if since >= until:
+            raise ParseError(_('since must be earlier than until'))
+        interval = self.request.QUERY_PARAMS.get('interval')
+        if interval:
+            try:
+                interval = int(interval)
+                assert interval > 0
+            except (ValueError, AssertionError):
+                raise ParseError(_('interval must be a positive integer'))
+        else:
+            interval = max(60, int((until - since).total_seconds() / LINK_METRICS_MAX_POINTS))
+        info = {
+            'since': since,
+            'until': until,
+            'interval': interval
+        }
+        return info, LinkSample.series(link_ids, since, until, interval)
+
+
+class LinkMetrics(LinkMetricsMixin, APIView):
+    """
+    Retrieve the history of metric value and status of specified link,
+    values are averaged over periods of "interval" seconds,
+    status is the worst one of each period.
+
+    Parameters:
+
+     * `since=<ISO 8601 date>`: defaults to 24 hours before `until`
+     * `until=<ISO 8601 date>`: defaults to now
+     * `interval=<seconds>`: defaults to a value which returns at most
+       `NODESHOT_LINK_METRICS_MAX_POINTS` points (300 by default)
+    """
+    authentication_classes = (authentication.SessionAuthentication,)
+
+    def get(self, request, *args, **kwargs):
+        try:
+            link = Link.objects.accessible_to(request.user).get(pk=kwargs['pk'])
+        except Link.DoesNotExist:
+            raise Http404(_('Link not found.'))
+        info, series = self.get_series([link.pk])
+        info.update({
+            'link': link.pk,
+            'series': series[link.pk]
+        })
+        return Response(info)
+
+link_metrics = LinkMetrics.as_view()
+
+
+class NodeLinkMetrics(LinkMetricsMixin, APIView):
+    """
+    Retrieve the history of metric value and status of the links of specified node,
+    accepts the same parameters of the link metrics resource.
+    """
+    authentication_classes = (authentication.SessionAuthentication,)
+
+    def get(self, request, *args, **kwargs):
+        try:
+            node = Node.objects.published()\
+                               .accessible_to(request.user)\
+                               .get(slug=kwargs['slug'])
+        except Node.DoesNotExist:
+            raise Http404(_('Node not found.'))
+        link_ids = list(Link.objects.accessible_to(request.user)
+                                    .filter(Q(node_a_id=node.id) | Q(node_b_id=node.id))
+                                    .order_by('pk')
+                                    .values_list('id', flat=True))
+        info, series = self.get_series(link_ids)
+        info.update({
+            'node': node.slug,
+            'links': [{'link': link_id, 'series': series[link_id]} for link_id in link_ids]
+        })
+        return Response(info)
+
+node_link_metrics = NodeLinkMetrics.as_view()
+
+
+class TopologyLinksPush(generics.GenericAPIView):
+    """
+    Update the links of the specified topology with data pushed by a collector.
+    Requires a staff user (basic or session authentication).
+
+    ### POST
+
+    Accepts either:
+
+     * a NetJSON `NetworkGraph`: the whole topology, missing links are set as "disconnected"
+     * the differences of the topology (same format returned by `netdiff.diff`): an object
+       with `added`, `removed` and `changed` keys, each one is either `null`
+       or an object containing a list of `links`
+
+    Links are objects with `source`, `target` (ip or mac addresses) and `weight` keys.
+
+    Changes are written in a single transaction, the response contains
+    the number of links processed for each section and the list of errors.
+    """
+    authentication_classes = (authentication.BasicAuthentication, authentication.SessionAuthentication)
+    permission_classes = (permissions.IsAdminUser,)
+    queryset = Topology.objects.all()
+    sections = ['added', 'removed', 'changed']
+
+    def validate_links(self, links, name):
+        if not isinstance(links, list):
+            raise ParseError(_('%s: expected a list of links') % name)
+        for link in links:
+            if not isinstance(link, dict) \
+               or not isinstance(link.get('source'), basestring) \
+               or not isinstance(link.get('target'), basestring) \
+               or isinstance(link.get('weight'), bool) \
+               or not isinstance(link.get('weight'), (int, long, float)):
+                raise ParseError(_('%s: each link must contain "source", "target" and a numeric "weight"') % name)
+
+    def get_diff(self, topology, data):
+        """ validates data and returns the differences to apply """
+        if not isinstance(data, dict):
+            raise ParseError(_('expected a JSON object'))
+        if data.get('type') == 'NetworkGraph':
+            self.validate_links(data.get('links'), 'links')
+            # data must not be a string, which netdiff would treat as a path or an URL
+            try:
+                return topology.diff(NetJsonParser(data))
+            except NetdiffException as e:
+                raise ParseError(str(e))
+        if not any(section in data for section in self.sections):
+            raise ParseError(_('expected a NetJSON NetworkGraph or an object with '
+                               '"added", "removed" or "changed" keys'))
+        for section in self.sections:
+            value = data.get(section)
+            if value is None:
+                continue
+            if not isinstance(value, dict):
+                raise ParseError(_('%s: expected null or an object containing "links"') % section)
+            self.validate_links(value.get('links'), section)
+        return data
+
+    def post(self, request, *args, **kwargs):
+        topology = self.get_object()
+        diff = self.get_diff(topology, request.DATA)
+        return Response(topology.apply_diff(diff))
+
+topology_links_push = TopologyLinksPush.as_view()
+
+
+class NetworkGraphMixin(object):
+    """
+    Translates node slugs to the node ids used by the network graph and vice versa,
+    only published nodes and links accessible to the current user are taken into account
+    """
+    authentication_classes = (authentication.SessionAuthentication,)
+
+    def get_access_level(self):
+        """ highest access level the current user can see, None if there is no restriction """
+        user = self.request.user
+        if user.is_superuser:
+            return None
+        elif user.is_authenticated():
+            # same group used by accessible_to
+            return ACCESS_LEVELS.get(user.groups.all().order_by('-id')[0].name)
+        return ACCESS_LEVELS.get('public')
+
+    def get_nodes(self):
+        return Node.objects.published().accessible_to(self.request.user)
+
+    def get_node_id(self, name):
+        slug = self.request.QUERY_PARAMS.get(name)
+        if not slug:
+            raise ParseError(_('%s parameter is required') % name)
+        try:
+            return self.get_nodes().only('id').get(slug=slug).id
+        except Node.DoesNotExist:
+            raise Http404(_('Node not found.'))
+
+    def get_slugs(self, ids):
+        """ returns a dict which maps ids of accessible nodes to slugs """
+        return dict(self.get_nodes().filter(id__in=ids).values_list('id', 'slug'))
+
+
+class GraphPath(NetworkGraphMixin, APIView):
+    """
+    Retrieve the path with the lowest total metric value between two nodes,
+    path and cost are null if the nodes are not connected.
+    Only links and nodes accessible to the current user are used.
+
+    Parameters:
+
+     * `source=<node slug>`
+     * `target=<node slug>`
+    """
+    def get(self, request, *args, **kwargs):
+        source = self.get_node_id('source')
+        target = self.get_node_id('target')
+        path, cost = network_graph.shortest_path(source, target, self.get_access_level())
+        if path is not None:
+            slugs = self.get_slugs(path)
+            path = [slugs.get(node_id) for node_id in path]
+        return Response({
+            'source': request.QUERY_PARAMS['source'],
+            'target': request.QUERY_PARAMS['target'],
+            'cost': cost,
+            'hops': len(path) - 1 if path else None,
+            'path': path
+        })
+
+graph_path = GraphPath.as_view()
+
+
+class GraphReachable(NetworkGraphMixin, APIView):
+    """
+    Retrieve the nodes which can be reached from the specified one through active links.
+
+    Parameters:
+
+     * `source=<node slug>`
+    """
+    def get(self, request, *args, **kwargs):
+        source = self.get_node_id('source')
+        nodes = sorted(self.get_slugs(network_graph.reachable(source, self.get_access_level())).values())
+        return Response({
+            'source': request.QUERY_PARAMS['source'],
+            'count': len(nodes),
+            'nodes': nodes
+        })
+
+graph_reachable = GraphReachable.as_view()
+
+
+class GraphCriticalNodes(NetworkGraphMixin, APIView):
+    """
+    Retrieve the critical nodes of the network (articulation points),
+    that is nodes whose failure would split the network in disconnected parts.
+    """
+    def get(self, request, *args, **kwargs):
+        nodes = sorted(self.get_slugs(network_graph.articulation_points(self.get_access_level())).values())
+        return Response({
+            'count': len(nodes),
+            'nodes': nodes
+        })
+
+graph_critical_nodes = GraphCriticalNodes.as_view()
@@ -33,6 +33,38 @@ __all__ = [
 ]
 
 
+# ------ Search ------ #
+
+from nodeshot.core.base import search
+
+search.register(Device, ['name', 'description'])
+
+
+# ------ Indexes ------ #
+
+from django.db.models.signals import post_syncdb
+from nodeshot.core.base import index_together
+
+# this app has no migrations, syncdb does not add the index of the cursor pagination to existing tables
+index_together.register(Device)
+
+
+def create_index_together_indexes(sender, **kwargs):
+    created = index_together.ensure_indexes(using=kwargs.get('db') or 'default')
+    if kwargs.get('verbosity', 1) > 0:
+        for name in created:
+            print('Created index %s' % name)
+
+
+post_syncdb.connect(create_index_together_indexes)
+
+try:
+    from south.signals import post_migrate
+    post_migrate.connect(create_index_together_indexes)
+except ImportError:
+    pass
+
+
 # ------ Add relationship to ExtensibleNodeSerializer ------ #
 
 from nodeshot.core.nodes.base import ExtensibleNodeSerializer
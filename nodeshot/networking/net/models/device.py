@@ -53,6 +53,8 @@ class Device(BaseAccessLevel):
 
     class Meta:
         app_label = 'net'
+        # cursor pagination of the API
+        index_together = [['updated', 'id']]
 
     def __unicode__(self):
         return '%s' % self.name
@@ -121,4 +123,5 @@ class Device(BaseAccessLevel):
     if 'grappelli' in settings.INSTALLED_APPS:
         @staticmethod
         def autocomplete_search_fields():
+            # backed by the trigram indexes of nodeshot.core.base.search
             return ('name__icontains',)
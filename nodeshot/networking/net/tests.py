@@ -95,6 +95,32 @@ class NetTest(BaseTestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(response.data['results']), Device.objects.access_level_up_to('public').count())
 
+    def test_device_list_cursor_pagination_api(self):
+        """ API device list cursor pagination """
+        url = reverse('api_device_list')
+        expected = list(Device.objects.access_level_up_to('public').order_by('id').values_list('name', flat=True))
+        names = []
+        response = self.client.get(url, {'cursor': '', 'order': 'id', 'limit': 1})
+        while response.data['next']:
+            names += [device['name'] for device in response.data['results']]
+            response = self.client.get(response.data['next'])
+        names += [device['name'] for device in response.data['results']]
+        self.assertEqual(names, expected)
+
+    def test_device_cursor_pagination_index(self):
+        """ the (updated, id) index is created in existing databases too """
+        from django.db import connection
+        from nodeshot.core.base.index_together import ensure_indexes
+        # created on syncdb
+        self.assertEqual(ensure_indexes(), [])
+        cursor = connection.cursor()
+        cursor.execute("SELECT indexname FROM pg_indexes WHERE tablename = 'net_device' "
+                       "AND indexdef LIKE '%%(updated, id)'")
+        for row in cursor.fetchall():
+            cursor.execute('DROP INDEX "%s"' % row[0])
+        self.assertEqual(ensure_indexes(), ['net_device_updated_id_idx'])
+        self.assertEqual(ensure_indexes(), [])
+
     def test_device_list_search_api(self):
         """ API device list search """
         url = reverse('api_device_list')
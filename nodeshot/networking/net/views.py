@@ -1,10 +1,10 @@
 from django.http import Http404
 from django.utils.translation import ugettext_lazy as _
-from django.db.models import Q
 
 from rest_framework import authentication, generics
 
-from nodeshot.core.base.mixins import ACLMixin, CustomDataMixin
+from nodeshot.core.base.mixins import ACLMixin, CustomDataMixin, CursorPaginationMixin
+from nodeshot.core.base.search import search as search_queryset
 from nodeshot.core.nodes.models import Node
 
 from .permissions import IsOwnerOrReadOnly
@@ -15,15 +15,18 @@ from .models import *
 # ------ DEVICES ------ #
 
 
-class DeviceList(ACLMixin, generics.ListAPIView):
+class DeviceList(CursorPaginationMixin, ACLMixin, generics.ListAPIView):
     """
     Retrieve device list according to user access level
     
     Parameters:
     
-     * `search=<word>`: search <word> in name, slug, description and address of nodes
+     * `search=<word>`: search <word> in name and description of devices
      * `limit=<n>`: specify number of items per page (defaults to 40)
      * `limit=0`: turns off pagination
+     * `cursor=`: use cursor pagination, the response contains the `next` URL;
+       faster than `page=<n>` on deep pages, items are ordered by `updated` (or by `id` with `order=id`)
+     * `count=approximate`: add the estimated number of items to cursor paginated responses
     """
     authentication_classes = (authentication.SessionAuthentication,)
     queryset = Device.objects.all().select_related('node')
@@ -45,12 +48,8 @@ class DeviceList(ACLMixin, generics.ListAPIView):
         search = self.request.QUERY_PARAMS.get('search', None)
         
         if search is not None:
-            search_query = (
-                Q(name__icontains=search) |
-                Q(description__icontains=search)
-            )
-            # add instructions for search to queryset
-            queryset = queryset.filter(search_query)
+            # name and description
+            queryset = search_queryset(queryset, search)
         
         return queryset
     